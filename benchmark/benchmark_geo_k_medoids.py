@@ -0,0 +1,389 @@
+""" Benchmarks the phases of geo_k_medoids without sending a single request to Google.
+
+    Every phase is timed for the original implementation working on instances of Address and Cluster (only for small
+    datasets, as it is slow) and for the array implementation used by geo_k_medoids. The distance matrices are either
+    the shipped munich_* datasets or synthetic road-like matrices of any size. Filling the distance matrix is benchmarked
+    against a local fake of the Distance Matrix API with configurable latency.
+
+    Usage, from the root of the repository:
+
+        python benchmark/benchmark_geo_k_medoids.py --sizes 100 1000 10000 --output results.json
+        python benchmark/benchmark_geo_k_medoids.py --sizes 100 --compare results.json
+
+    The results are written as JSON, one record per dataset, phase and implementation, so runs of different commits can
+    be compared with --compare.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import threading
+import subprocess
+import tracemalloc
+from unittest import mock
+
+import googlemaps
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import geo_k_medoids as g
+
+
+DEMO_DATASETS = ["munich_30", "munich_70", "munich_100", "munich_150"]
+RESULTS_VERSION = 1
+
+
+class FakeDistanceMatrixClient:
+    """ Local replacement of googlemaps.Client, answering Distance Matrix and Geocoding requests from a known distance
+        matrix and known coordinates. Every request sleeps for latency seconds plus latency_per_element seconds per
+        element, which imitates the round trip to Google.
+    """
+
+    def __init__(self, list_of_streets, distance_matrix, coordinates=None, latency=0.0, latency_per_element=0.0):
+        self._index = {street: i for i, street in enumerate(list_of_streets)}
+        self._distance_matrix = distance_matrix
+        self._coordinates = coordinates
+        self._latency = latency
+        self._latency_per_element = latency_per_element
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.elements = 0
+
+    def distance_matrix(self, origins, destinations, mode="driving"):
+        origins = ([origins] if isinstance(origins, str) else origins)
+        destinations = ([destinations] if isinstance(destinations, str) else destinations)
+
+        with self._lock:
+            self.requests += 1
+            self.elements += len(origins) * len(destinations)
+        time.sleep(self._latency + self._latency_per_element * len(origins) * len(destinations))
+
+        rows = list()
+        for origin in origins:
+            values = self._distance_matrix[self._index[origin], [self._index[street] for street in destinations]]
+            rows.append({"elements": [{"duration": {"value": int(value)}, "distance": {"value": int(value)}}
+                                      for value in values]})
+
+        return {"rows": rows}
+
+    def geocode(self, address):
+        with self._lock:
+            self.requests += 1
+        time.sleep(self._latency)
+
+        lat, lng = self._coordinates[self._index[address]]
+        return [{"geometry": {"location": {"lat": float(lat), "lng": float(lng)}}}]
+
+
+def get_fake_gmaps(fake_client):
+    """ Creates an instance of g.GoogleMapsClient talking to fake_client instead of Google.
+
+    :param fake_client: instance of FakeDistanceMatrixClient
+    :return:            instance of g.GoogleMapsClient
+    """
+    with mock.patch.object(googlemaps, "Client", lambda key: fake_client):
+        return g.GoogleMapsClient(api_key="fake")
+
+
+def make_road_like_dataset(n, seed=0, size=20000, speed=8.3, dtype=np.int32, rows_at_once=1024):
+    """ Creates a synthetic dataset resembling travel times in a city: random points in a square, whose travel time is
+        the straight line distance times a detour factor between 1.2 and 1.6, driven at a constant speed. The detour
+        factor of a pair depends on both points, so remote points are remote to everyone, as in a real road network.
+
+    :param n:               integer, number of points
+    :param seed:            seed of the random number generator
+    :param size:            edge length of the square in meters
+    :param speed:           speed in meters per second
+    :param dtype:           numpy dtype of the distance matrix
+    :param rows_at_once:    number of rows calculated at once, limits the temporary memory
+    :return:                tuple of list of street names, symmetric distance matrix and ndarray of coordinates
+    """
+    rng = np.random.default_rng(seed)
+    points = rng.random((n, 2)) * size
+    remoteness = rng.random(n) * 0.2
+
+    distance_matrix = np.empty((n, n), dtype=dtype)
+    for start in range(0, n, rows_at_once):
+        end = min(start + rows_at_once, n)
+        straight = np.sqrt(((points[start:end, None, :] - points[None, :, :]) ** 2).sum(axis=2))
+        detour = 1.2 + remoteness[start:end, None] + remoteness[None, :]
+        distance_matrix[start:end] = np.rint(straight * detour / speed)
+
+    # Points in Munich, which is only needed for the Geocoding fake
+    coordinates = np.column_stack([48.05 + points[:, 0] / 111000, 11.4 + points[:, 1] / 74000])
+
+    return ["Synthetic Street {}".format(i) for i in range(n)], distance_matrix, coordinates
+
+
+def load_demo_dataset(name):
+    """ Loads one of the shipped munich_* datasets into memory.
+
+    :param name:    string of name of dataset, e.g. "munich_30"
+    :return:        tuple of list of street names and distance matrix
+    """
+    directory = os.path.join(ROOT, "demo", name)
+    with open(os.path.join(directory, "{}_dataset.json".format(name)), encoding="utf-8") as file_sidecar:
+        sidecar = json.load(file_sidecar)
+
+    return sidecar["streets"], np.load(os.path.join(directory, sidecar["matrix_file"]))
+
+
+def measure(function, setup=None, repeat=1, memory=True):
+    """ Times function and measures the peak of memory allocated while it runs. The memory is measured in a separate
+        run, as tracing the allocations slows down the function.
+
+    :param function:    function to be measured, called with the result of setup as arguments
+    :param setup:       function returning a tuple of arguments of function, which is not timed. None for no arguments
+    :param repeat:      integer, number of timed runs, of which the fastest one is reported
+    :param memory:      False, if the memory should not be measured
+    :return:            tuple of seconds of fastest run and peak of allocated bytes (None, if not measured)
+    """
+    times = list()
+    for _ in range(repeat):
+        arguments = (setup() if setup is not None else ())
+        start = time.perf_counter()
+        function(*arguments)
+        times.append(time.perf_counter() - start)
+
+    peak = None
+    if memory:
+        arguments = (setup() if setup is not None else ())
+        tracemalloc.start()
+        try:
+            function(*arguments)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return min(times), peak
+
+
+def make_clusters(n, medoids):
+    """ Creates the state of the original implementation right before STEP 1-4.
+
+    :param n:       integer, number of points
+    :param medoids: ndarray of indices of the initial medoids
+    :return:        tuple of list of addresses and list of clusters
+    """
+    init = g.Cluster(center=g.Address(iid=-1, street_name="init"))
+    data = [g.Address(iid=i, street_name=str(i), cluster=init) for i in range(n)]
+    return data, [g.Cluster(center=data[medoid]) for medoid in medoids]
+
+
+def run_legacy_k_medoids(distance_matrix, medoids):
+    """ STEP 1-4 till STEP 3 exactly as the original geo_k_medoids, working on instances of Address and Cluster.
+
+    :param distance_matrix: distance matrix coding the distance from each point to each point
+    :param medoids:         ndarray of indices of the initial medoids
+    :return:                cost of the final clustering
+    """
+    data, list_clusters = make_clusters(len(distance_matrix), medoids)
+
+    g.assign_street_cluster(streets=data, list_clusters=list_clusters, distance_matrix=distance_matrix)
+    cost = g.calculate_cost(data, distance_matrix)
+
+    while True:
+        for cluster in list_clusters:
+            cluster.set_minimising_center(distance_matrix)
+
+        g.assign_street_cluster(streets=data, list_clusters=list_clusters, distance_matrix=distance_matrix)
+
+        if g.calculate_cost(data, distance_matrix) >= cost:
+            break
+
+        cost = g.calculate_cost(data, distance_matrix)
+
+    return cost
+
+
+def benchmark_clustering(name, distance_matrix, k, repeat=3, legacy_limit=150):
+    """ Benchmarks STEP 1-2 till STEP 3 on a distance matrix.
+
+    :param name:            string of name of dataset
+    :param distance_matrix: ndarray distance matrix
+    :param k:               integer showing the number of clusters
+    :param repeat:          integer, number of timed runs per phase
+    :param legacy_limit:    integer, the original implementation is only benchmarked up to this number of points
+    :return:                list of dictionaries, one per phase and implementation
+    """
+    n = len(distance_matrix)
+    medoids = g.calculate_v_vector(distance_matrix).argsort()[:k]
+    labels = g.assign_labels(distance_matrix, medoids)
+
+    def assign_legacy_setup():
+        return make_clusters(n, medoids)
+
+    def update_legacy_setup():
+        data, list_clusters = make_clusters(n, medoids)
+        g.assign_street_cluster(streets=data, list_clusters=list_clusters, distance_matrix=distance_matrix)
+        return (list_clusters,)
+
+    phases = [
+        ("calculate_v", "array", lambda: g.calculate_v_vector(distance_matrix), None),
+        ("initial_assignment", "array", lambda: g.assign_labels(distance_matrix, medoids), None),
+        ("set_minimising_center", "array", lambda: g.update_medoids(distance_matrix, labels, medoids), None),
+        ("loop", "park_jun", lambda: g.run_k_medoids(distance_matrix, medoids), None),
+        ("loop", "fasterpam", lambda: g.run_fasterpam(distance_matrix, medoids), None),
+    ]
+    if n <= legacy_limit:
+        phases += [
+            ("calculate_v", "legacy", lambda: [g.calculate_v(i, distance_matrix) for i in range(n)], None),
+            ("initial_assignment", "legacy",
+             lambda data, list_clusters: g.assign_street_cluster(data, list_clusters, distance_matrix),
+             assign_legacy_setup),
+            ("set_minimising_center", "legacy",
+             lambda list_clusters: [cluster.set_minimising_center(distance_matrix) for cluster in list_clusters],
+             update_legacy_setup),
+            ("loop", "legacy", lambda: run_legacy_k_medoids(distance_matrix, medoids), None),
+        ]
+
+    results = list()
+    for phase, implementation, function, setup in phases:
+        seconds, peak = measure(function, setup=setup, repeat=repeat)
+        results.append({"dataset": name, "n": n, "k": k, "phase": phase, "implementation": implementation,
+                        "seconds": seconds, "peak_bytes": peak})
+        print("{:>24} n={:<6} {:<22} {:<20} {:10.4f} s".format(name, n, phase, implementation, seconds),
+              file=sys.stderr)
+
+    return results
+
+
+def benchmark_fill(name, list_of_streets, distance_matrix, latency=0.02, latency_per_element=0.0, workers=8,
+                   pairwise_limit=50):
+    """ Benchmarks STEP 1-1, filling the distance matrix, against FakeDistanceMatrixClient. Every strategy has to
+        reproduce the distance matrix exactly.
+
+    :param name:                string of name of dataset
+    :param list_of_streets:     list of street names
+    :param distance_matrix:     ndarray distance matrix answered by the fake
+    :param latency:             seconds every request of the fake takes
+    :param latency_per_element: additional seconds per element of a request
+    :param workers:             integer, number of requests in flight for the concurrent strategies
+    :param pairwise_limit:      integer, one request per pair is only benchmarked up to this number of points
+    :return:                    list of dictionaries, one per strategy
+    """
+    n = len(list_of_streets)
+    data = [g.Address(iid=i, street_name=street) for i, street in enumerate(list_of_streets)]
+
+    strategies = [("block", dict(block_fill=True)),
+                  ("concurrent_block", dict(block_fill=True, workers=workers))]
+    if n <= pairwise_limit:
+        strategies = [("pairwise", dict()), ("concurrent_pairwise", dict(workers=workers))] + strategies
+
+    results = list()
+    for strategy, kwargs in strategies:
+        fake_client = FakeDistanceMatrixClient(list_of_streets, distance_matrix, latency=latency,
+                                               latency_per_element=latency_per_element)
+        gmaps = get_fake_gmaps(fake_client)
+
+        start = time.perf_counter()
+        filled = g.build_distance_matrix(gmaps, data, **kwargs)
+        seconds = time.perf_counter() - start
+
+        assert(np.array_equal(filled, distance_matrix)), "Strategy {} did not reproduce the distance matrix."\
+            .format(strategy)
+
+        results.append({"dataset": name, "n": n, "k": None, "phase": "fill", "implementation": strategy,
+                        "seconds": seconds, "peak_bytes": None, "requests": fake_client.requests,
+                        "elements": fake_client.elements, "latency": latency})
+        print("{:>24} n={:<6} {:<22} {:<20} {:10.4f} s".format(name, n, "fill", strategy, seconds), file=sys.stderr)
+
+    return results
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(old, new):
+    """ Prints the speed up of every measurement of new compared to the same measurement of old.
+
+    :param old: dictionary of results, as written by this script
+    :param new: dictionary of results, as written by this script
+    """
+    def key(record):
+        return record["dataset"], record["k"], record["phase"], record["implementation"]
+
+    old_records = {key(record): record for record in old["results"]}
+    print("Comparing {} (old) with {} (new)".format(old.get("commit"), new.get("commit")))
+
+    for record in new["results"]:
+        if key(record) not in old_records:
+            continue
+        old_seconds = old_records[key(record)]["seconds"]
+        print("{:>24} {:<22} {:<20} {:10.4f} s -> {:10.4f} s  x{:.2f}"
+              .format(record["dataset"], record["phase"], record["implementation"], old_seconds, record["seconds"],
+                      old_seconds / max(record["seconds"], 1e-12)))
+
+
+def run_benchmarks(sizes, demo_datasets, k=10, repeat=3, legacy_limit=150, fill_limit=300, pairwise_limit=50,
+                   latency=0.02, workers=8, seed=0):
+    """ Runs all benchmarks and collects the results.
+
+    :return:    dictionary of results, ready to be written as JSON
+    """
+    datasets = [(name,) + load_demo_dataset(name) for name in demo_datasets]
+    datasets += [("synthetic_{}".format(n),) + make_road_like_dataset(n, seed=seed)[:2] for n in sizes]
+
+    results = list()
+    for name, list_of_streets, distance_matrix in datasets:
+        results += benchmark_clustering(name, distance_matrix, min(k, len(distance_matrix)), repeat=repeat,
+                                        legacy_limit=legacy_limit)
+        if len(distance_matrix) <= fill_limit:
+            results += benchmark_fill(name, list_of_streets, distance_matrix, latency=latency, workers=workers,
+                                      pairwise_limit=pairwise_limit)
+
+    return {"version": RESULTS_VERSION,
+            "commit": get_commit(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "parameters": {"sizes": sizes, "demo_datasets": demo_datasets, "k": k, "repeat": repeat,
+                           "legacy_limit": legacy_limit, "fill_limit": fill_limit, "pairwise_limit": pairwise_limit,
+                           "latency": latency, "workers": workers, "seed": seed},
+            "results": results}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmarks the phases of geo_k_medoids.")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[100, 1000, 10000],
+                        help="number of points of the synthetic datasets")
+    parser.add_argument("--demo", nargs="*", default=DEMO_DATASETS, help="shipped datasets to be benchmarked")
+    parser.add_argument("--k", type=int, default=10, help="number of clusters")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per phase, the fastest one is reported")
+    parser.add_argument("--legacy-limit", type=int, default=150,
+                        help="largest dataset the original implementation is benchmarked on")
+    parser.add_argument("--fill-limit", type=int, default=300, help="largest dataset the matrix fill is benchmarked on")
+    parser.add_argument("--pairwise-limit", type=int, default=50,
+                        help="largest dataset one request per pair is benchmarked on")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds every fake request takes")
+    parser.add_argument("--workers", type=int, default=8, help="requests in flight for the concurrent fill")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic datasets")
+    parser.add_argument("--output", help="file the JSON results are written to, standard output if not given")
+    parser.add_argument("--compare", help="JSON results of an earlier run, which the new results are compared to")
+    arguments = parser.parse_args()
+
+    benchmark_results = run_benchmarks(arguments.sizes, arguments.demo, k=arguments.k, repeat=arguments.repeat,
+                                       legacy_limit=arguments.legacy_limit, fill_limit=arguments.fill_limit,
+                                       pairwise_limit=arguments.pairwise_limit, latency=arguments.latency,
+                                       workers=arguments.workers, seed=arguments.seed)
+
+    if arguments.output:
+        with open(arguments.output, "w", encoding="utf-8") as file_results:
+            json.dump(benchmark_results, file_results, indent=2)
+    elif not arguments.compare:
+        print(json.dumps(benchmark_results, indent=2))
+
+    if arguments.compare:
+        with open(arguments.compare, encoding="utf-8") as file_old:
+            compare_results(json.load(file_old), benchmark_results)
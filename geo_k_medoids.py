@@ -1,14 +1,328 @@
+import os
+import abc
+import math
+import time
+import heapq
+import random
+import asyncio
+import logging
+import sqlite3
+import threading
+import contextlib
+import concurrent.futures
+from multiprocessing import shared_memory
 import googlemaps
 import numpy as np
 
 
+# Limits of a single request to Google's Distance Matrix API, see
+# https://developers.google.com/maps/documentation/distance-matrix/usage-and-billing
+MAX_ORIGINS_PER_REQUEST = 25
+MAX_DESTINATIONS_PER_REQUEST = 25
+MAX_ELEMENTS_PER_REQUEST = 100
+
+# Price of one element (pair of streets) of the Distance Matrix API in EUR
+COST_PER_ELEMENT = 0.005
+
+# Price of one request to the Geocoding API in EUR
+COST_PER_GEOCODING_REQUEST = 0.005
+
+# Mean radius of the earth in meters, used for straight line distances between coordinates
+EARTH_RADIUS = 6371000
+
+# Default number of streets per region of geo_k_medoids_regions, well below the limit of 500 streets of a full matrix
+MAX_REGION_SIZE = 300
+
 
 ################################################ DEFINITIONS OF CLASSES ################################################
 
+class DistanceCache:
+
+    def __init__(self, path="distance_cache.sqlite", ttl=None, max_entries=None, symmetric=True):
+        """ Persistent cache for distances obtained by the Distance Matrix API, saved in a SQLite database. Entries are
+            keyed by the normalised origin, normalised destination, metric and means of travel.
+
+        :param path:        string of path of the SQLite file, it is created if it does not exist yet
+        :param ttl:         time to live of an entry in seconds. Older entries are treated as missing. None for no expiry
+        :param max_entries: maximal number of entries. If exceeded, the least recently used entries are deleted. None
+                            for no limit
+        :param symmetric:   True, if the distance from a to b may be used for the distance from b to a. The clustering
+                            symmetrises the distance matrix anyway
+        """
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._symmetric = symmetric
+        self._hits = 0
+        self._misses = 0
+        self._last_used = dict()
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS distances (origin TEXT, destination TEXT, metric TEXT, "
+                                 "mode TEXT, value INTEGER, created REAL, last_used REAL, "
+                                 "PRIMARY KEY (origin, destination, metric, mode))")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS distances_last_used ON distances (last_used)")
+        self._connection.commit()
+        self._entries = self._connection.execute("SELECT COUNT(*) FROM distances").fetchone()[0]
+
+    def _key(self, origin, destination, metric, mode):
+        origin = normalise_street_name(origin)
+        destination = normalise_street_name(destination)
+        if self._symmetric and destination < origin:
+            origin, destination = destination, origin
+        return origin, destination, metric, mode
+
+    def get(self, origin, destination, metric, mode="driving"):
+        """ Returns the cached distance from origin to destination or None, if it is not cached or expired.
+
+        :param origin:      string of street, the travel starts at
+        :param destination: string of street, the travel ends at
+        :param metric:      "time" or "distance"
+        :param mode:        means of travel as understood by the Distance Matrix API, e.g. "driving"
+        :return:            cached distance or None
+        """
+        key = self._key(origin, destination, metric, mode)
+        now = time.time()
+
+        with self._lock:
+            row = self._connection.execute("SELECT value, created FROM distances WHERE origin=? AND destination=? "
+                                           "AND metric=? AND mode=?", key).fetchone()
+
+            # Expired entries are overwritten as soon as the distance has been requested again
+            if row is None or (self._ttl is not None and now - row[1] > self._ttl):
+                self._misses += 1
+                return None
+
+            # Writing the time of usage is postponed to the next commit, so reading stays cheap
+            self._last_used[key] = now
+            self._hits += 1
+            return row[0]
+
+    def set(self, origin, destination, metric, value, mode="driving"):
+        """ Saves the distance from origin to destination. Least recently used entries are evicted, if the cache
+            exceeds max_entries.
+
+        :param origin:      string of street, the travel starts at
+        :param destination: string of street, the travel ends at
+        :param metric:      "time" or "distance"
+        :param value:       distance returned by the Distance Matrix API
+        :param mode:        means of travel as understood by the Distance Matrix API, e.g. "driving"
+        """
+        self.set_many([(origin, destination, value)], metric, mode)
+
+    def set_many(self, entries, metric, mode="driving"):
+        """ Same as set, but for a list of (origin, destination, value) tuples in one single transaction.
+
+        :param entries: list of tuples (origin, destination, value)
+        :param metric:  "time" or "distance"
+        :param mode:    means of travel as understood by the Distance Matrix API, e.g. "driving"
+        """
+        now = time.time()
+
+        with self._lock:
+            self._write_last_used()
+
+            for origin, destination, value in entries:
+                key = self._key(origin, destination, metric, mode)
+                cursor = self._connection.execute("UPDATE distances SET value=?, created=?, last_used=? WHERE origin=? "
+                                                  "AND destination=? AND metric=? AND mode=?",
+                                                  (int(value), now, now) + key)
+                if cursor.rowcount == 0:
+                    self._connection.execute("INSERT INTO distances VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                             key + (int(value), now, now))
+                    self._entries += 1
+
+            if self._max_entries is not None and self._entries > self._max_entries:
+                self._connection.execute("DELETE FROM distances WHERE rowid IN (SELECT rowid FROM distances "
+                                         "ORDER BY last_used LIMIT ?)", (self._entries - self._max_entries,))
+                self._entries = self._max_entries
+
+            self._connection.commit()
+
+    def _write_last_used(self):
+        self._connection.executemany("UPDATE distances SET last_used=? WHERE origin=? AND destination=? AND metric=? "
+                                     "AND mode=?", [(now,) + key for key, now in self._last_used.items()])
+        self._last_used.clear()
+
+    def get_hits(self):
+        return self._hits
+
+    def get_misses(self):
+        return self._misses
+
+    def get_statistics(self):
+        """ Returns the hit and miss counters of this cache together with the money saved by the hits.
+
+        :return:    dictionary with keys "hits", "misses", "hit_rate", "entries" and "saved_eur"
+        """
+        lookups = self._hits + self._misses
+        return {"hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": (self._hits / lookups if lookups else 0.0),
+                "entries": self._entries,
+                "saved_eur": round(self._hits * COST_PER_ELEMENT, 2)}
+
+    def close(self):
+        with self._lock:
+            self._write_last_used()
+            self._connection.commit()
+            self._connection.close()
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity=None):
+        """ Thread safe rate limiter following the token bucket scheme. On average, acquire returns rate times per
+            second, short bursts of up to capacity calls are allowed.
+
+        :param rate:        float, number of tokens added per second, e.g. the queries per second quota of the API
+        :param capacity:    maximal number of tokens in the bucket, defaults to one second worth of tokens
+        """
+        self._rate = rate
+        self._capacity = (capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self._capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Blocks until a token is available and takes it.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._last_refill) * self._rate)
+                self._last_refill = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                waiting_time = (1 - self._tokens) / self._rate
+
+            time.sleep(waiting_time)
+
+
+class Instrumentation:
+
+    def __init__(self, logger=None, sink=None, callback=None, level=logging.INFO):
+        """ Collects what happens during a run of geo_k_medoids: the time spent in each phase, the number of requests,
+            cache hits and retries, the estimated spend and the cost after each iteration. Every measurement is passed
+            on as soon as it is made, so long runs can be watched while they are running. Without an instance of this
+            class nothing is measured at all.
+
+        :param logger:      instance of logging.Logger, which receives a message per phase and iteration. None for no
+                            logging
+        :param sink:        function taking the name of a metric, its value and its kind ("timing" in seconds,
+                            "counter" as increment or "gauge"), e.g. for forwarding to StatsD or Prometheus. None for no
+                            sink
+        :param callback:    function taking the number of the iteration, the cost and the number of points which
+                            changed their cluster, called after each iteration of the clustering loop. None for no
+                            callback
+        :param level:       logging level of the messages
+        """
+        self._logger = logger
+        self._sink = sink
+        self._callback = callback
+        self._level = level
+        self._timings = dict()
+        self._counters = dict()
+        self._iterations = list()
+        self._lock = threading.Lock()
+
+    def add_timing(self, name, seconds):
+        """ Adds seconds to the time spent in phase name.
+        """
+        self._timings[name] = self._timings.get(name, 0.0) + seconds
+        if self._logger is not None:
+            self._logger.log(self._level, "Phase %s took %.3f seconds", name, seconds)
+        if self._sink is not None:
+            self._sink(name, seconds, "timing")
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """ Context manager measuring the time spent in its body as phase name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(name, time.perf_counter() - start)
+
+    def count(self, name, amount=1):
+        """ Thread safe increment of counter name, e.g. "distance_matrix_requests", "distance_matrix_elements",
+            "geocoding_requests", "cache_hits" or "retries".
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+        if self._sink is not None:
+            self._sink(name, amount, "counter")
+
+    def record_iteration(self, cost, moved, seconds):
+        """ Records one iteration of the clustering loop.
+
+        :param cost:    total cost after the iteration
+        :param moved:   number of points, which changed their cluster in the iteration
+        :param seconds: time spent in the iteration
+        """
+        iteration = len(self._iterations) + 1
+        self._iterations.append({"iteration": iteration, "cost": cost, "moved": moved, "seconds": seconds})
+        self._timings["iterations"] = self._timings.get("iterations", 0.0) + seconds
+
+        if self._logger is not None:
+            self._logger.log(self._level, "Iteration %d: cost %s, %d points moved, %.3f seconds", iteration, cost,
+                             moved, seconds)
+        if self._sink is not None:
+            self._sink("cost", cost, "gauge")
+            self._sink("moved", moved, "gauge")
+        if self._callback is not None:
+            self._callback(iteration, cost, moved)
+
+    def get_estimated_spend(self):
+        """ Estimated costs in EUR of all requests sent so far, see COST_PER_ELEMENT and COST_PER_GEOCODING_REQUEST.
+        """
+        return self._counters.get("distance_matrix_elements", 0) * COST_PER_ELEMENT \
+            + self._counters.get("geocoding_requests", 0) * COST_PER_GEOCODING_REQUEST
+
+    def get_statistics(self):
+        """ Returns a dictionary containing the seconds spent per phase, the counters, the estimated spend in EUR and a
+            list of all iterations.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+
+        return {"timings": dict(self._timings),
+                "counters": counters,
+                "estimated_spend": self.get_estimated_spend(),
+                "iterations": list(self._iterations)}
+
+    def report(self):
+        """ Logs and sinks a summary of the whole run and returns the statistics.
+        """
+        statistics = self.get_statistics()
+        if self._logger is not None:
+            self._logger.log(self._level, "Timings in seconds: %s, counters: %s, estimated spend: %.2f EUR",
+                             statistics["timings"], statistics["counters"], statistics["estimated_spend"])
+        if self._sink is not None:
+            self._sink("estimated_spend", statistics["estimated_spend"], "gauge")
+
+        return statistics
+
+
 class GoogleMapsClient:
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache=None, mode="driving", instrumentation=None):
+        """
+        :param api_key:         string of Google Services API key
+        :param cache:           instance of DistanceCache, which is asked before any request is sent. None for no cache
+        :param mode:            means of travel, see the mode parameter of the Distance Matrix API
+        :param instrumentation: instance of Instrumentation counting requests and cache hits. None for no counting
+        """
         self.__gmaps_client = googlemaps.Client(key=api_key)
+        self.__cache = cache
+        self.__mode = mode
+        self.__instrumentation = instrumentation
+
+    def get_instrumentation(self):
+        return self.__instrumentation
 
     def distance_between_streets(self, street_one, street_two, metric):
         """ This function uses the Google Distance Matrix API for getting the distance between to streets.
@@ -30,8 +344,803 @@ class GoogleMapsClient:
         :return:            distance between street_one and street_two calculated by Google's Distance Matrix API
         """
         assert(metric == "time" or metric == "distance"), "Unvalid metric has been chosen, try 'time' or 'distance'"
+        if self.__cache is not None:
+            value = self.__cache.get(street_one, street_two, metric, self.__mode)
+            if value is not None:
+                if self.__instrumentation is not None:
+                    self.__instrumentation.count("cache_hits")
+                return value
+
         query = ("duration" if metric == "time" else metric)
-        return self.__gmaps_client.distance_matrix(street_one, street_two)['rows'][0]['elements'][0][query]['value']
+        value = self.__gmaps_client.distance_matrix(street_one, street_two,
+                                                    mode=self.__mode)['rows'][0]['elements'][0][query]['value']
+
+        if self.__instrumentation is not None:
+            self.__instrumentation.count("distance_matrix_requests")
+            self.__instrumentation.count("distance_matrix_elements")
+
+        if self.__cache is not None:
+            self.__cache.set(street_one, street_two, metric, value, self.__mode)
+
+        return value
+
+    def address_to_coordinates(self, street_name):
+        """ Uses Google's Geocoding API for converting an address into coordinates.
+
+        :param street_name: string of street name the coordinates are asked for
+        :return:            tuple of floats (latitude, longitude)
+        """
+        location = self.__gmaps_client.geocode(street_name)[0]["geometry"]["location"]
+        if self.__instrumentation is not None:
+            self.__instrumentation.count("geocoding_requests")
+        return location["lat"], location["lng"]
+
+    def addresses_to_coordinates(self, street_names, workers=8, queries_per_second=None):
+        """ Converts many addresses into coordinates at once. Identical addresses (after normalisation) are geocoded
+            only once, the requests are sent by a pool of workers and transient errors are retried.
+
+        :param street_names:        list of strings of street names the coordinates are asked for
+        :param workers:             integer, maximal number of requests in flight
+        :param queries_per_second:  quota of the Geocoding API, which is never exceeded. None for no limit
+        :return:                    list of tuples of floats (latitude, longitude), one for each entry of street_names
+        """
+        limiter = (TokenBucket(queries_per_second) if queries_per_second else None)
+
+        unique_streets = dict()
+        for street_name in street_names:
+            unique_streets.setdefault(normalise_street_name(street_name), street_name)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            coordinates = dict(zip(unique_streets, executor.map(
+                lambda street_name: request_with_retry(lambda: self.address_to_coordinates(street_name), limiter,
+                                                       instrumentation=self.__instrumentation),
+                unique_streets.values())))
+
+        return [coordinates[normalise_street_name(street_name)] for street_name in street_names]
+
+    def distances_between_streets(self, origins, destinations, metric):
+        """ Same as distance_between_streets, but for several origins and destinations at once. Only one request is
+            sent to the Distance Matrix API, thus the number of origins and destinations has to stay within the limits
+            of a single request (see MAX_ORIGINS_PER_REQUEST, MAX_DESTINATIONS_PER_REQUEST and
+            MAX_ELEMENTS_PER_REQUEST).
+
+        :param origins:         list of strings of streets, the travel starts at
+        :param destinations:    list of strings of streets, the travel ends at
+        :param metric:          string specifying usage of certain metric. "time" for travelling time and "distance"
+                                for travelling distance
+        :return:                list of lists, where entry [i][j] is the distance from origins[i] to destinations[j]
+        """
+        assert(metric == "time" or metric == "distance"), "Unvalid metric has been chosen, try 'time' or 'distance'"
+        result = [[None] * len(destinations) for _ in origins]
+
+        if self.__cache is not None:
+            for i, origin in enumerate(origins):
+                for j, destination in enumerate(destinations):
+                    result[i][j] = self.__cache.get(origin, destination, metric, self.__mode)
+
+            if self.__instrumentation is not None:
+                self.__instrumentation.count("cache_hits", sum(len(row) - row.count(None) for row in result))
+
+        # Only origins and destinations with at least one missing pair are requested
+        missing_origins = [i for i in range(len(origins)) if None in result[i]]
+        missing_destinations = [j for j in range(len(destinations)) if any(result[i][j] is None for i in missing_origins)]
+
+        if missing_origins:
+            query = ("duration" if metric == "time" else metric)
+            rows = self.__gmaps_client.distance_matrix([origins[i] for i in missing_origins],
+                                                       [destinations[j] for j in missing_destinations],
+                                                       mode=self.__mode)['rows']
+            if self.__instrumentation is not None:
+                self.__instrumentation.count("distance_matrix_requests")
+                self.__instrumentation.count("distance_matrix_elements",
+                                             len(missing_origins) * len(missing_destinations))
+
+            new_entries = list()
+            for i, row in zip(missing_origins, rows):
+                for j, element in zip(missing_destinations, row['elements']):
+                    result[i][j] = element[query]['value']
+                    new_entries.append((origins[i], destinations[j], result[i][j]))
+
+            if self.__cache is not None:
+                self.__cache.set_many(new_entries, metric, self.__mode)
+
+        return result
+
+
+class CondensedDistanceMatrix:
+
+    def __init__(self, n, dtype=np.uint32, data=None):
+        """ Symmetric distance matrix with zero diagonal, which only stores the n * (n-1) / 2 entries above the diagonal
+            in a flat array (same order as scipy's condensed distance matrices). Storing only one triangle halves the
+            memory, together with a narrow dtype it shrinks by a factor of 4 for uint32 or float32 and by a factor of
+            8 for uint16 (travel times up to 18 hours in seconds) compared to a dense n x n matrix of int64.
+
+            It is indexed like a dense ndarray, e.g. matrix[i, j], matrix[:, medoids], matrix[rows, columns] or
+            matrix[np.ix_(rows, columns)], and returns ndarrays of the gathered entries. Hence, the functions of the
+            clustering steps work with it unchanged, without the square matrix ever being created.
+
+        :param n:       integer, number of points
+        :param dtype:   numpy dtype of the stored distances
+        :param data:    ndarray of length n * (n-1) / 2 of already condensed distances, which is used without copying.
+                        None for a new matrix of zeros
+        """
+        self._n = n
+        self._data = (np.zeros(n * (n - 1) // 2, dtype=dtype) if data is None else data)
+        assert(len(self._data) == n * (n - 1) // 2), "Condensed data does not fit the number of points."
+
+    @staticmethod
+    def from_dense(matrix, dtype=np.uint32):
+        """ Creates a condensed copy of a dense symmetric distance matrix.
+
+        :param matrix:  ndarray of shape (n, n)
+        :param dtype:   numpy dtype of the stored distances
+        :return:        instance of CondensedDistanceMatrix
+        """
+        condensed = CondensedDistanceMatrix(len(matrix), dtype=dtype)
+        for row in range(len(matrix) - 1):
+            start = condensed_index(len(matrix), row, row + 1)
+            condensed._data[start:start + len(matrix) - row - 1] = matrix[row, row + 1:]
+
+        return condensed
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def shape(self):
+        return self._n, self._n
+
+    @property
+    def dtype(self):
+        return self._data.dtype
+
+    @property
+    def nbytes(self):
+        return self._data.nbytes
+
+    def get_data(self):
+        return self._data
+
+    def _indices(self, key):
+        """ Translates the key of matrix[key] into two arrays of row and column indices, which broadcast to the shape
+            numpy would return for a dense matrix.
+        """
+        rows, columns = (key if isinstance(key, tuple) else (key, slice(None)))
+        rows_are_slice, columns_are_slice = isinstance(rows, slice), isinstance(columns, slice)
+        rows = (np.arange(self._n)[rows] if rows_are_slice else np.asarray(rows))
+        columns = (np.arange(self._n)[columns] if columns_are_slice else np.asarray(columns))
+
+        if rows_are_slice and columns_are_slice:
+            return rows[:, None], columns[None, :]
+        if rows_are_slice:
+            return rows.reshape((-1,) + (1,) * columns.ndim), columns
+        if columns_are_slice:
+            return rows.reshape(rows.shape + (1,)), columns
+        return rows, columns
+
+    def __getitem__(self, key):
+        rows, columns = np.broadcast_arrays(*self._indices(key))
+        diagonal = (rows == columns)
+        if self._n < 2:
+            return np.zeros(rows.shape, dtype=self.dtype)
+
+        index = condensed_index(self._n, np.where(diagonal, 0, rows), np.where(diagonal, 1, columns))
+        return np.where(diagonal, 0, self._data[index])
+
+    def __setitem__(self, key, value):
+        rows, columns, value = np.broadcast_arrays(*self._indices(key), value)
+        off_diagonal = (rows != columns)
+        self._data[condensed_index(self._n, rows[off_diagonal], columns[off_diagonal])] = value[off_diagonal]
+
+    def sum(self, axis=None, rows_at_once=None):
+        """ Sum of the entries along one axis, both axes give the same result due to symmetry. The rows are gathered
+            chunk by chunk.
+
+        :param axis:            0, 1 or None for the sum of all entries
+        :param rows_at_once:    number of rows gathered at once, None for at most 2^24 entries at once
+        :return:                ndarray of row sums or sum of all entries
+        """
+        if rows_at_once is None:
+            rows_at_once = max(1, 2 ** 24 // max(self._n, 1))
+
+        row_sums = np.concatenate([self[start:start + rows_at_once].sum(axis=1)
+                                   for start in range(0, self._n, rows_at_once)] or [np.zeros(0)])
+
+        return (row_sums.sum() if axis is None else row_sums)
+
+
+class LazyDistanceMatrix(CondensedDistanceMatrix):
+
+    def __init__(self, gmaps, list_of_streets, metric="time", dtype=np.uint32, workers=1, queries_per_second=None,
+                 max_retries=5, backoff=0.5):
+        """ Condensed distance matrix, whose distances are requested the first time they are read and kept afterwards.
+            All distances missing in one read, e.g. matrix[:, medoids] or matrix[np.ix_(members, members)], are
+            requested together, see fetch. Hence, the number of paid elements grows with the entries the clustering
+            actually reads instead of with all n * (n-1) / 2 pairs.
+            Every distance is requested from the later to the earlier street, just like the lower triangle of
+            build_distance_matrix, so a completely read lazy matrix equals the symmetrised one of build_distance_matrix.
+
+        :param gmaps:               instance of GoogleMapsClient
+        :param list_of_streets:     list of strings of streets, in the order of the distance matrix
+        :param metric:              "time" for travel time by car between points and "distance" for travel distance
+        :param dtype:               numpy dtype of the stored distances
+        :param workers:             integer, maximal number of requests in flight during one fetch
+        :param queries_per_second:  quota of the API, which is never exceeded. None for no limit
+        :param max_retries:         integer, number of retries of a request failing with a transient error
+        :param backoff:             waiting time in seconds before the first retry, it doubles with each retry
+        """
+        super().__init__(len(list_of_streets), dtype=dtype)
+        self._gmaps = gmaps
+        self._streets = list(list_of_streets)
+        self._metric = metric
+        self._workers = workers
+        self._limiter = (TokenBucket(queries_per_second) if queries_per_second else None)
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._known = np.zeros(len(self._data), dtype=bool)
+
+    def get_amount_known(self):
+        """ Number of pairs, whose distance has been requested (or set) so far.
+        """
+        return int(np.count_nonzero(self._known))
+
+    def is_complete(self):
+        return self.get_amount_known() == len(self._known)
+
+    def __getitem__(self, key):
+        self.fetch(*np.broadcast_arrays(*self._indices(key)))
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        rows, columns = np.broadcast_arrays(*self._indices(key))
+        off_diagonal = (rows != columns)
+        self._known[condensed_index(self._n, rows[off_diagonal], columns[off_diagonal])] = True
+
+    def fetch(self, rows, columns):
+        """ Requests the distances of all pairs (rows[i], columns[i]), which are not known yet. Destinations missing the
+            same origins share their requests, which are tiles of up to MAX_ELEMENTS_PER_REQUEST pairs, so reading a
+            block like matrix[np.ix_(members, members)] costs about as few requests as build_distance_matrix.
+
+        :param rows:    ndarray of indices of rows
+        :param columns: ndarray of indices of columns of the same shape
+        """
+        rows, columns = np.ravel(rows), np.ravel(columns)
+        off_diagonal = (rows != columns)
+        later = np.maximum(rows[off_diagonal], columns[off_diagonal])
+        earlier = np.minimum(rows[off_diagonal], columns[off_diagonal])
+        index = condensed_index(self._n, earlier, later)
+        missing = ~self._known[index]
+        index, first = np.unique(index[missing], return_index=True)
+        if len(index) == 0:
+            return
+        assert_affordable(self.get_amount_known() + len(index))
+
+        # The origins are split into groups of MAX_ORIGINS_PER_REQUEST, the pairs are sorted by destination and origin
+        later, earlier = later[missing][first], earlier[missing][first]
+        groups = np.searchsorted(np.unique(later), later) // MAX_ORIGINS_PER_REQUEST
+        origins_of_destination = dict()
+        for group, origin, destination in zip(groups.tolist(), later.tolist(), earlier.tolist()):
+            origins_of_destination.setdefault((group, destination), []).append(origin)
+
+        # Destinations missing the same origins share a request, so no pair is paid for twice
+        destinations_of_origins = dict()
+        for (_, destination), origins in origins_of_destination.items():
+            destinations_of_origins.setdefault(tuple(origins), []).append(destination)
+
+        tiles = list()
+        for origins, destinations in destinations_of_origins.items():
+            step = min(MAX_DESTINATIONS_PER_REQUEST, MAX_ELEMENTS_PER_REQUEST // len(origins))
+            tiles.extend((list(origins), destinations[start:start + step])
+                         for start in range(0, len(destinations), step))
+
+        if self._workers > 1:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._workers)
+            futures = [executor.submit(self._fetch_tile, *tile) for tile in tiles]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+        else:
+            for tile in tiles:
+                self._fetch_tile(*tile)
+
+    def _fetch_tile(self, origin_indices, destination_indices):
+        block = request_with_retry(lambda: self._gmaps.distances_between_streets(
+            [self._streets[i] for i in origin_indices], [self._streets[j] for j in destination_indices], self._metric),
+            self._limiter, self._max_retries, self._backoff, self._gmaps.get_instrumentation())
+
+        rows, columns = np.meshgrid(np.asarray(origin_indices), np.asarray(destination_indices), indexing="ij")
+        index = condensed_index(self._n, rows.ravel(), columns.ravel())
+        self._data[index] = np.asarray(block).ravel()
+        self._known[index] = True
+
+
+class FillCheckpoint:
+
+    def __init__(self, path, list_of_streets, metric="time", mode="driving", interval=60):
+        """ Keeps track of the pairs of streets, whose distances have already been requested, and saves them to a local
+            file every interval seconds, on errors and at the end of the fill. If the file exists, the progress saved in
+            it is loaded, so a fill interrupted by a quota error or a network problem continues where it stopped
+            instead of paying for every distance again.
+            The file holds the distances of the strictly lower triangle in condensed form (see CondensedDistanceMatrix)
+            and a bitmap of the completed pairs, both as arrays of a .npz file.
+
+        :param path:            string of path of the checkpoint file
+        :param list_of_streets: list of strings of streets, in the order of the distance matrix
+        :param metric:          "time" or "distance"
+        :param mode:            means of travel, see GoogleMapsClient
+        :param interval:        seconds between two saves
+        """
+        self._path = path
+        self._streets = list(list_of_streets)
+        self._metric = metric
+        self._mode = mode
+        self._interval = interval
+        self._lock = threading.Lock()
+
+        n = len(self._streets)
+        self._values = np.zeros(n * (n - 1) // 2, dtype=np.int64)
+        self._done = np.zeros(n * (n - 1) // 2, dtype=bool)
+
+        if os.path.exists(path):
+            with np.load(path, allow_pickle=False) as checkpoint:
+                assert(checkpoint["streets"].tolist() == self._streets and str(checkpoint["metric"]) == metric
+                       and str(checkpoint["mode"]) == mode), "Checkpoint {} belongs to other streets, metric or mode."\
+                    .format(path)
+                self._values = checkpoint["values"]
+                self._done = np.unpackbits(checkpoint["done"], count=len(self._done)).astype(bool)
+
+        self._last_save = time.monotonic()
+
+    def __len__(self):
+        return len(self._streets)
+
+    def get_path(self):
+        return self._path
+
+    def get_amount_missing(self):
+        """ Number of pairs, whose distance has not been requested yet.
+        """
+        return int(len(self._done) - np.count_nonzero(self._done))
+
+    def is_complete(self):
+        return self.get_amount_missing() == 0
+
+    def get_missing(self, origin_indices, destination_indices):
+        """ Shrinks a block of the lower triangle to the origins and destinations with at least one missing pair.
+
+        :param origin_indices:      range or list of indices of origins
+        :param destination_indices: range or list of indices of destinations
+        :return:                    tuple of lists of indices of origins and destinations still to be requested
+        """
+        rows, columns = np.meshgrid(np.asarray(origin_indices), np.asarray(destination_indices), indexing="ij")
+        missing = (rows > columns)
+        missing[missing] = ~self._done[condensed_index(len(self), rows[missing], columns[missing])]
+
+        return np.flatnonzero(missing.any(axis=1)).tolist(), np.flatnonzero(missing.any(axis=0)).tolist()
+
+    def mark(self, origin_indices, destination_indices, block):
+        """ Stores the requested distances of a block, only its entries in the strictly lower triangle are used. The
+            checkpoint is saved, if the last save is more than interval seconds ago.
+
+        :param origin_indices:      list of indices of origins
+        :param destination_indices: list of indices of destinations
+        :param block:               list of lists, where entry [i][j] is the distance between the i-th origin and the
+                                    j-th destination
+        """
+        rows, columns = np.meshgrid(np.asarray(origin_indices), np.asarray(destination_indices), indexing="ij")
+        lower = (rows > columns)
+        index = condensed_index(len(self), rows[lower], columns[lower])
+
+        with self._lock:
+            self._values[index] = np.asarray(block, dtype=np.int64).reshape(rows.shape)[lower]
+            self._done[index] = True
+
+            if time.monotonic() - self._last_save >= self._interval:
+                self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        """ Writes the checkpoint to a temporary file first, which then replaces the old checkpoint. Thus, an
+            interruption while saving never leaves a broken checkpoint behind.
+        """
+        temporary_path = self._path + ".tmp"
+        with open(temporary_path, "wb") as file_checkpoint:
+            np.savez(file_checkpoint, streets=np.array(self._streets, dtype=str), metric=self._metric, mode=self._mode,
+                     values=self._values, done=np.packbits(self._done))
+        os.replace(temporary_path, self._path)
+        self._last_save = time.monotonic()
+
+    def write_to(self, distance_matrix):
+        """ Writes all distances requested so far into the lower triangle of distance_matrix.
+
+        :param distance_matrix: ndarray or CondensedDistanceMatrix of the size of the checkpoint
+        """
+        if isinstance(distance_matrix, CondensedDistanceMatrix):
+            distance_matrix.get_data()[:] = self._values
+        else:
+            rows, columns = np.triu_indices(len(self), 1)
+            distance_matrix[columns, rows] = self._values
+
+
+class DistanceProvider(abc.ABC):
+    """ Source of the distance matrix of geo_k_medoids other than Google's Distance Matrix API. A provider only has to
+        implement get_distance_matrix, a provider without it cannot be instantiated. get_distances should be
+        overridden whenever a block of distances is cheaper than the whole distance matrix of its streets.
+    """
+
+    @abc.abstractmethod
+    def get_distance_matrix(self, list_of_streets):
+        """
+        :param list_of_streets: list of strings of streets
+        :return:                symmetric ndarray containing the distance from each street to each street
+        """
+
+    def get_distances(self, origins, destinations):
+        """ Distances from every origin to every destination, like the origins coming later than the destinations in
+            the distance matrix of origins and destinations together.
+
+        :param origins:         list of strings of streets
+        :param destinations:    list of strings of streets
+        :return:                ndarray of shape (len(origins), len(destinations))
+        """
+        return self.get_distance_matrix(list(destinations) + list(origins))[len(destinations):, :len(destinations)]
+
+
+class PrecomputedDistanceProvider(DistanceProvider):
+
+    def __init__(self, distance_matrix, list_of_streets):
+        """ Provides distances from a distance matrix calculated before, e.g. one of the demo datasets. Any subset of
+            its streets in any order can be asked for, streets are compared by normalise_street_name.
+
+        :param distance_matrix: ndarray or CondensedDistanceMatrix belonging to list_of_streets
+        :param list_of_streets: list of strings of streets
+        """
+        assert(distance_matrix.shape == (len(list_of_streets), len(list_of_streets))), "Distance matrix does not fit " \
+                                                                                       "the list of streets."
+        self._distance_matrix = distance_matrix
+        self._index = {normalise_street_name(street): i for i, street in enumerate(list_of_streets)}
+
+    def _get_indices(self, list_of_streets):
+        indices = list()
+        for street in list_of_streets:
+            assert(normalise_street_name(street) in self._index), "Street {} is not part of the precomputed distance " \
+                                                                  "matrix.".format(street)
+            indices.append(self._index[normalise_street_name(street)])
+
+        return indices
+
+    def get_distance_matrix(self, list_of_streets):
+        indices = self._get_indices(list_of_streets)
+        return np.asarray(self._distance_matrix[np.ix_(indices, indices)])
+
+    def get_distances(self, origins, destinations):
+        return np.asarray(self._distance_matrix[np.ix_(self._get_indices(origins), self._get_indices(destinations))])
+
+
+class StraightLineDistanceProvider(DistanceProvider):
+
+    def __init__(self, coordinates=None, gmaps=None, factor=1.0, euclidean=False):
+        """ Provides straight line distances between the coordinates of the streets, optionally multiplied by a factor,
+            e.g. a detour factor (see fit_detour_factor) or the inverse of a speed for travel times. Costs nothing, but
+            ignores the road network.
+
+        :param coordinates: dictionary of street to its coordinates, either (latitude, longitude) in degrees or, with
+                            euclidean, (x, y) in meters. Streets missing in it are geocoded with gmaps
+        :param gmaps:       instance of GoogleMapsClient used for geocoding. None, if all coordinates are given
+        :param factor:      float, all distances in meters are multiplied by it
+        :param euclidean:   True for planar coordinates, False for latitudes and longitudes (haversine)
+        """
+        self._coordinates = (coordinates if coordinates is not None else dict())
+        self._gmaps = gmaps
+        self._factor = factor
+        self._euclidean = euclidean
+
+    def get_distance_matrix(self, list_of_streets, rows_at_once=1024):
+        return self.get_distances(list_of_streets, list_of_streets, rows_at_once)
+
+    def get_distances(self, origins, destinations, rows_at_once=1024):
+        origin_coordinates = get_coordinates(origins, self._coordinates, self._gmaps)
+        destination_coordinates = get_coordinates(destinations, self._coordinates, self._gmaps)
+        distances = np.zeros((len(origin_coordinates), len(destination_coordinates)))
+
+        for start in range(0, len(origin_coordinates), rows_at_once):
+            rows, columns = origin_coordinates[start:start + rows_at_once, None, :], destination_coordinates[None, :, :]
+            if self._euclidean:
+                distances[start:start + rows_at_once] = np.sqrt(((rows - columns) ** 2).sum(axis=2))
+            else:
+                distances[start:start + rows_at_once] = haversine(rows, columns)
+
+        return self._factor * distances
+
+
+class RoadGraph:
+
+    def __init__(self, coordinates, sources, targets, weights, directed=True):
+        """ Road network for calculating travel times offline. The edges are stored in compressed sparse row format,
+            such that the edges leaving node i are edges indptr[i] till indptr[i + 1].
+
+        :param coordinates: ndarray of shape (nodes, 2) of latitudes and longitudes in degrees
+        :param sources:     ndarray of indices of the nodes the edges start at
+        :param targets:     ndarray of indices of the nodes the edges end at
+        :param weights:     ndarray of non negative weights of the edges, e.g. travel times in seconds
+        :param directed:    False, if every edge can be used in both directions
+        """
+        self._coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+        self._directed = directed
+
+        sources, targets, weights = np.asarray(sources), np.asarray(targets), np.asarray(weights, dtype=float)
+        assert(len(sources) == len(targets) == len(weights)), "Every edge needs a source, a target and a weight."
+        assert(np.all(weights >= 0)), "Dijkstra's algorithm needs non negative weights."
+        self._edges = (sources, targets, weights)
+
+        if not directed:
+            sources, targets, weights = np.concatenate([sources, targets]), np.concatenate([targets, sources]), \
+                                        np.concatenate([weights, weights])
+
+        order = np.argsort(sources, kind="stable")
+        self._indptr = np.searchsorted(sources[order], np.arange(len(self._coordinates) + 1))
+        self._indices = targets[order]
+        self._weights = weights[order]
+
+    @staticmethod
+    def load(path):
+        """ Opens a road graph saved by RoadGraph.save.
+
+        :param path:    string of path of .npz file
+        :return:        instance of RoadGraph
+        """
+        with np.load(path, allow_pickle=False) as graph:
+            return RoadGraph(graph["coordinates"], graph["sources"], graph["targets"], graph["weights"],
+                             bool(graph["directed"]))
+
+    @staticmethod
+    def from_csv(nodes_path, edges_path, directed=True):
+        """ Reads a road graph exported to two CSV files with one header line each, e.g. from OpenStreetMap.
+
+        :param nodes_path:  string of path of the nodes, with columns id, latitude and longitude
+        :param edges_path:  string of path of the edges, with columns id of source, id of target and travel time
+        :param directed:    False, if every edge can be used in both directions
+        :return:            instance of RoadGraph
+        """
+        nodes = np.loadtxt(nodes_path, delimiter=",", skiprows=1, ndmin=2)
+        edges = np.loadtxt(edges_path, delimiter=",", skiprows=1, ndmin=2)
+
+        order = np.argsort(nodes[:, 0])
+        node_ids = nodes[order, 0]
+        sources, targets = np.searchsorted(node_ids, edges[:, 0]), np.searchsorted(node_ids, edges[:, 1])
+        assert(np.all(node_ids[np.minimum(sources, len(node_ids) - 1)] == edges[:, 0])
+               and np.all(node_ids[np.minimum(targets, len(node_ids) - 1)] == edges[:, 1])), \
+            "Edges refer to unknown nodes."
+
+        return RoadGraph(nodes[order, 1:3], sources, targets, edges[:, 2], directed)
+
+    def save(self, path):
+        with open(path, "wb") as file_graph:
+            np.savez(file_graph, coordinates=self._coordinates, sources=self._edges[0], targets=self._edges[1],
+                     weights=self._edges[2], directed=self._directed)
+
+    def get_nearest_nodes(self, coordinates, rows_at_once=64):
+        """ Snaps coordinates to the nearest nodes of the graph by straight line distance.
+
+        :param coordinates:     ndarray of shape (n, 2) of latitudes and longitudes in degrees
+        :param rows_at_once:    number of coordinates, whose distances to all nodes are calculated at once
+        :return:                ndarray of indices of nodes
+        """
+        nodes = np.zeros(len(coordinates), dtype=np.int64)
+        for start in range(0, len(coordinates), rows_at_once):
+            distances = haversine(coordinates[start:start + rows_at_once, None, :], self._coordinates[None, :, :])
+            nodes[start:start + rows_at_once] = np.argmin(distances, axis=1)
+
+        return nodes
+
+    def get_shortest_path_lengths(self, source_nodes, target_nodes, processes=None):
+        """ Runs one single source Dijkstra per source node, in parallel processes, each stopping as soon as all target
+            nodes are reached.
+
+        :param source_nodes:    ndarray of indices of nodes
+        :param target_nodes:    ndarray of indices of nodes
+        :param processes:       integer, number of worker processes. None for the number of processors, 1 for running
+                                in this process
+        :return:                ndarray of shape (sources, targets), inf for unreachable targets
+        """
+        graph = (self._indptr.tolist(), self._indices.tolist(), self._weights.tolist(),
+                 np.asarray(target_nodes).tolist())
+        source_nodes = np.asarray(source_nodes).tolist()
+
+        if processes == 1 or len(source_nodes) < 2:
+            return np.array([run_dijkstra(*graph, source) for source in source_nodes]).reshape(len(source_nodes), -1)
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=set_worker_road_graph,
+                                                    initargs=graph) as executor:
+            chunksize = max(1, len(source_nodes) // (4 * (processes or os.cpu_count() or 1)))
+            rows = list(executor.map(run_worker_dijkstra, source_nodes, chunksize=chunksize))
+
+        return np.array(rows).reshape(len(source_nodes), -1)
+
+
+class RoadGraphDistanceProvider(DistanceProvider):
+
+    def __init__(self, graph, coordinates=None, gmaps=None, processes=None):
+        """ Provides travel times (or whatever the weights of the graph are) on a local road network, without any
+            request to the Distance Matrix API. Every street is snapped to its nearest node, and one single source
+            Dijkstra per street fills a whole row of the distance matrix. Like the fill via Google, the distance from
+            the later to the earlier street of each pair is used for both directions.
+
+        :param graph:       instance of RoadGraph or string of path of a graph saved by RoadGraph.save
+        :param coordinates: dictionary of street to its coordinates (latitude, longitude). Streets missing in it are
+                            geocoded with gmaps
+        :param gmaps:       instance of GoogleMapsClient used for geocoding. None, if all coordinates are given
+        :param processes:   integer, number of processes running Dijkstra's algorithm. None for the number of
+                            processors
+        """
+        self._graph = (RoadGraph.load(graph) if isinstance(graph, str) else graph)
+        self._coordinates = (coordinates if coordinates is not None else dict())
+        self._gmaps = gmaps
+        self._processes = processes
+
+    def get_distance_matrix(self, list_of_streets):
+        nodes = self._graph.get_nearest_nodes(get_coordinates(list_of_streets, self._coordinates, self._gmaps))
+
+        # Streets snapped to the same node need only one run of Dijkstra's algorithm
+        unique_nodes, inverse = np.unique(nodes, return_inverse=True)
+        lengths = self._graph.get_shortest_path_lengths(unique_nodes, unique_nodes, self._processes)
+        assert(np.all(np.isfinite(lengths))), "Some streets cannot be reached from each other in the road graph."
+
+        distance_matrix = np.tril(lengths[np.ix_(inverse, inverse)])
+        return symmetrise(distance_matrix)
+
+    def get_distances(self, origins, destinations):
+        origin_nodes = self._graph.get_nearest_nodes(get_coordinates(origins, self._coordinates, self._gmaps))
+        destination_nodes = self._graph.get_nearest_nodes(get_coordinates(destinations, self._coordinates, self._gmaps))
+
+        # One run of Dijkstra's algorithm per distinct origin node, stopping once all destination nodes are reached
+        unique_origins, inverse_origins = np.unique(origin_nodes, return_inverse=True)
+        unique_destinations, inverse_destinations = np.unique(destination_nodes, return_inverse=True)
+        lengths = self._graph.get_shortest_path_lengths(unique_origins, unique_destinations, self._processes)
+        assert(np.all(np.isfinite(lengths))), "Some streets cannot be reached from each other in the road graph."
+
+        return lengths[np.ix_(inverse_origins, inverse_destinations)]
+
+
+class KMedoidsModel:
+
+    def __init__(self, centers, api_key="", metric="time", cache=None, provider=None, queries_per_second=None,
+                 workers=4, max_delay=0.05, instrumentation=None):
+        """ Fitted clustering, which assigns new addresses to the nearest of the final medoids of a clustering run
+            without clustering again. Only the k distances from each new address to the medoids are needed, which are
+            requested for many addresses at once.
+
+        :param centers:             list of strings of the streets of the medoids, e.g. the centers of the result of
+                                    geo_k_medoids. See from_result
+        :param api_key:             string of Google Services API key, not needed with a provider
+        :param metric:              "time" or "distance", should be the one the clustering was done with
+        :param cache:               instance of DistanceCache. None for no cache
+        :param provider:            instance of DistanceProvider used instead of Google's Distance Matrix API. None for
+                                    Google
+        :param queries_per_second:  quota of the Distance Matrix API, which is not going to be exceeded. None for no
+                                    limit
+        :param workers:             integer, number of batches assigned at the same time by assign_async
+        :param max_delay:           seconds assign_async waits for more addresses before sending a batch
+        :param instrumentation:     instance of Instrumentation counting the requests. None for no counting
+        """
+        self._centers = list(centers)
+        self._metric = metric
+        self._provider = provider
+        self._gmaps = (GoogleMapsClient(api_key, cache=cache, instrumentation=instrumentation) if provider is None
+                       else None)
+        self._limiter = (TokenBucket(queries_per_second) if queries_per_second else None)
+        self._workers = workers
+        self._max_delay = max_delay
+
+        self._executor = None
+        self._pending = list()
+        self._flush_handle = None
+
+    @staticmethod
+    def from_result(result, api_key="", **kwargs):
+        """ Creates a model from the result of geo_k_medoids, see __init__ for the keyword arguments.
+        """
+        return KMedoidsModel([cluster["center"] for cluster in result], api_key, **kwargs)
+
+    def get_centers(self):
+        return self._centers
+
+    def get_batch_size(self):
+        """ Number of addresses fitting into one request together with all medoids as destinations.
+        """
+        destinations = min(len(self._centers), MAX_DESTINATIONS_PER_REQUEST, MAX_ELEMENTS_PER_REQUEST)
+        return max(1, min(MAX_ORIGINS_PER_REQUEST, MAX_ELEMENTS_PER_REQUEST // max(destinations, 1)))
+
+    def get_distances_to_centers(self, list_of_streets):
+        """
+        :param list_of_streets: list of strings of streets
+        :return:                ndarray of shape (len(list_of_streets), k) of the distances to the medoids
+        """
+        if self._provider is not None:
+            return self._provider.get_distances(list(list_of_streets), self._centers)
+
+        origins = [Address(iid=i, street_name=street) for i, street in enumerate(list_of_streets)]
+        destinations = [Address(iid=j, street_name=street) for j, street in enumerate(self._centers)]
+        return get_distances(self._gmaps, origins, destinations, self._metric, self._limiter)
+
+    def assign(self, list_of_streets):
+        """ Assigns every street to its nearest medoid. Ties are broken in favour of the medoid coming first, just like
+            in the clustering. Identical streets are only asked for once.
+
+        :param list_of_streets: list of strings of streets
+        :return:                list of integers, entry i is the index (in get_centers) of the cluster of street i
+        """
+        if len(list_of_streets) == 0:
+            return list()
+
+        first_indices, inverse, _ = deduplicate_streets(list_of_streets)
+        distances = self.get_distances_to_centers([list_of_streets[i] for i in first_indices])
+
+        return np.argmin(distances, axis=1)[inverse].tolist()
+
+    async def assign_async(self, street_name):
+        """ Assigns one street from a coroutine without blocking the event loop. Streets arriving within max_delay
+            seconds are collected and assigned together, with one request per get_batch_size streets, so a service can
+            assign thousands of addresses per minute.
+
+        :param street_name: string of street
+        :return:            integer, index (in get_centers) of the cluster of the street
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((street_name, future))
+
+        if len(self._pending) >= self.get_batch_size():
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._max_delay, self._flush)
+
+        return await future
+
+    async def assign_many_async(self, list_of_streets):
+        """ Same as assign, but as a coroutine, see assign_async.
+        """
+        return list(await asyncio.gather(*[self.assign_async(street) for street in list_of_streets]))
+
+    def _flush(self):
+        """ Sends all pending streets of assign_async to a worker thread and resolves their futures with the result.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, list()
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._workers)
+
+        loop = asyncio.get_running_loop()
+        result = loop.run_in_executor(self._executor, self.assign, [street for street, _ in batch])
+
+        def resolve(done):
+            for i, (_, future) in enumerate(batch):
+                if future.cancelled():
+                    continue
+                if done.exception() is not None:
+                    future.set_exception(done.exception())
+                else:
+                    future.set_result(done.result()[i])
+
+        result.add_done_callback(resolve)
+
+    def close(self):
+        """ Stops the worker threads of assign_async.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
 
 
 class Address:
@@ -86,6 +1195,16 @@ class Cluster:
     def get_member(self):
         return self._members
 
+    def set_member(self, members):
+        """ Replaces all members of this cluster at once and sets this cluster as their cluster. Unlike add_member, the
+            old clusters of the addresses are not updated.
+
+        :param members: list of addresses, elements are of type Address
+        """
+        self._members = list(members)
+        for address in self._members:
+            address.set_cluster(self)
+
     def add_member(self, address):
         """ This function adds a new address to this cluster. Simultaneously, it deletes the passed address in its old
             cluster. Thus, we secure, that each address has only one single cluster.
@@ -102,10 +1221,11 @@ class Cluster:
 
         :param address: type Address, which is going to be deleted
         """
-        if str(address) in [str(ad) for ad in self._members]:
-            self._members.remove(address)
-        # Possible problems: Same address twice!
-        # TODO: Deal with duplicate addresses!
+        # Addresses are compared by identity, as two different addresses may share the same street name
+        for i, member in enumerate(self._members):
+            if member is address:
+                del self._members[i]
+                break
 
     def set_minimising_center(self, distance_matrix):
         """ This function gets the mediod of this cluster and sets it as the new center
@@ -127,6 +1247,91 @@ class Cluster:
 #################################################### AUXILIARY PART ####################################################
 
 
+def assert_affordable(amount_elements):
+    """ Stops before too many elements of the Distance Matrix API are requested, roughly as many as for a full
+        distance matrix of 500 streets.
+
+    :param amount_elements: integer, expected number of requested elements (pairs of streets)
+    """
+    assert(amount_elements < 125000),"By proceeding, high costs will encounter! " \
+                                     "The account belonging to passed API key will be charged with at least {} EUR! " \
+                                     "Delete this assertion, only if you know what you are doing! "\
+                                    .format(str(round(COST_PER_ELEMENT * amount_elements, 2)))
+
+
+def measure_phase(instrumentation, name):
+    """ Returns a context manager measuring the time spent in its body as phase name, or doing nothing at all without
+        instrumentation.
+
+    :param instrumentation: instance of Instrumentation or None
+    :param name:            string of name of phase
+    """
+    if instrumentation is None:
+        return contextlib.nullcontext()
+    return instrumentation.phase(name)
+
+
+def normalise_street_name(street_name):
+    """ Normalises a street name for comparisons, such that upper and lower case as well as surplus white spaces do not
+        matter.
+
+    :param street_name: string of street name
+    :return:            string of normalised street name
+    """
+    return " ".join(street_name.lower().split())
+
+
+def deduplicate_streets(list_of_streets):
+    """ Collapses identical streets, compared by normalise_street_name. Identical streets have a distance of zero to
+        each other and the same distances to everything else, so it suffices to cluster every street once, counting it
+        as often as it occurs.
+
+    :param list_of_streets: list of strings of street names, may contain duplicates
+    :return:                tuple of three ndarrays: the index of the first occurrence of every unique street, the
+                            index of the unique street for every entry of list_of_streets and the number of occurrences
+                            (weight) of every unique street
+    """
+    positions = dict()
+    first_indices = list()
+    inverse = np.empty(len(list_of_streets), dtype=np.int64)
+
+    for i, street in enumerate(list_of_streets):
+        key = normalise_street_name(street)
+        if key not in positions:
+            positions[key] = len(first_indices)
+            first_indices.append(i)
+        inverse[i] = positions[key]
+
+    return np.array(first_indices, dtype=np.int64), inverse, np.bincount(inverse, minlength=len(first_indices))
+
+
+def condensed_index(n, row, column):
+    """ Position of entry [row, column] of a symmetric n x n matrix in its condensed form, see CondensedDistanceMatrix.
+        Works for integers as well as ndarrays of indices, row and column must not be equal.
+
+    :param n:       integer, number of points
+    :param row:     index or ndarray of indices of rows
+    :param column:  index or ndarray of indices of columns
+    :return:        position or ndarray of positions in the flat array of the condensed matrix
+    """
+    low = np.minimum(row, column).astype(np.int64)
+    high = np.maximum(row, column).astype(np.int64)
+    return low * (2 * n - low - 1) // 2 + (high - low - 1)
+
+
+def get_distance_dtype(dtype, condensed):
+    """ Default dtype of a new distance matrix. A condensed matrix is only asked for to save memory, so it defaults to
+        uint32 (travel times and distances in seconds and meters fit easily), a dense one to int as ever.
+
+    :param dtype:       numpy dtype asked for or None for the default
+    :param condensed:   True for a CondensedDistanceMatrix
+    :return:            numpy dtype
+    """
+    if dtype is not None:
+        return dtype
+    return (np.uint32 if condensed else int)
+
+
 def sum_over_columns(matrix, row):
     result = 0
     for i in range(len(matrix)):
@@ -150,10 +1355,575 @@ def calculate_v(index, matrix):
     return result
 
 
+def calculate_v_vector(matrix, chunk_size=None, weights=None):
+    """ Vectorised version of calculate_v, returning v for all indices at once. The row sums are calculated only once,
+        thus it needs O(n^2) instead of O(n^3) operations. The rows are added in the same order as in calculate_v, so
+        the results are identical.
+
+    :param matrix:      ndarray distance matrix
+    :param chunk_size:  number of rows divided by their row sum at once. Limits the temporary memory to chunk_size x n
+                        floats. None for choosing it automatically, such that at most about 256 MB are used
+    :param weights:     ndarray of the multiplicity of every point, see deduplicate_streets. v is then the one of the
+                        matrix with every point repeated as often as its weight. None for all weights being one
+    :return:            ndarray of v for every index
+    """
+    n = len(matrix)
+    if chunk_size is None:
+        chunk_size = max(1, 2 ** 25 // max(n, 1))
+    chunk_size = min(chunk_size, n)
+
+    if weights is None:
+        row_sums = matrix.sum(axis=1)
+    else:
+        row_sums = np.concatenate([matrix[start:start + chunk_size] @ weights for start in range(0, n, chunk_size)])
+    result = np.zeros(n)
+
+    # The first row of the buffer carries the result of the previous chunks, such that the summation order is kept
+    buffer = np.empty((chunk_size + 1, n))
+    for start in range(0, n, chunk_size):
+        end = min(start + chunk_size, n)
+        buffer[0] = result
+        np.divide(matrix[start:end], row_sums[start:end, None], out=buffer[1:end - start + 1])
+        if weights is not None:
+            buffer[1:end - start + 1] *= weights[start:end, None]
+        result = buffer[:end - start + 1].sum(axis=0)
+
+    return result
+
+
 def symmetrise(matrix):
     return matrix + matrix.T - np.diag(matrix.diagonal())
 
 
+def get_lower_triangle_tiles(n, max_elements=MAX_ELEMENTS_PER_REQUEST, max_origins=MAX_ORIGINS_PER_REQUEST,
+                             max_destinations=MAX_DESTINATIONS_PER_REQUEST):
+    """ Splits the strictly lower triangle of a n x n matrix into blocks of origins and destinations, so that each block
+        can be requested with one single Distance Matrix API request. Every entry [i, j] with i > j is covered exactly
+        once, and no other entry is covered, so no element is paid for more than with one request per pair.
+
+    :param n:                   integer, size of the distance matrix
+    :param max_elements:        maximal number of origins times destinations in one request
+    :param max_origins:         maximal number of origins in one request
+    :param max_destinations:    maximal number of destinations in one request
+    :return:                    list of tuples (origin_indices, destination_indices), both of type range
+    """
+    size = min(math.isqrt(max_elements), max_origins, max_destinations)
+    tiles = list()
+
+    for row_start in range(0, n, size):
+        row_end = min(row_start + size, n)
+        for column_start in range(0, row_start, size):
+            tiles.append((range(row_start, row_end), range(column_start, column_start + size)))
+
+        # block on the diagonal, split such that neither the diagonal nor the mirrored pairs are requested (and billed)
+        tiles.extend(get_triangle_tiles(row_start, row_end))
+
+    return tiles
+
+
+def get_triangle_tiles(start, end):
+    """ Splits the pairs [i, j] with start <= j < i < end into rectangular blocks covering each pair exactly once. The
+        triangle is halved recursively into the block of its lower half times its upper half and two smaller triangles.
+
+    :param start:   integer, first index of the triangle
+    :param end:     integer, index after the last one of the triangle
+    :return:        list of tuples (origin_indices, destination_indices), both of type range
+    """
+    if end - start < 2:
+        return list()
+
+    middle = (start + end) // 2
+    return [(range(middle, end), range(start, middle))] + get_triangle_tiles(start, middle) \
+        + get_triangle_tiles(middle, end)
+
+
+def fill_distance_matrix_blocks(gmaps, data, distance_matrix, metric):
+    """ Fills the lower triangle of the distance matrix block by block, sending one Distance Matrix API request per
+        block instead of one request per pair of streets. The entries are the same as the ones obtained by calling
+        distance_between_streets for every pair, only the number of requests shrinks.
+
+    :param gmaps:           instance of GoogleMapsClient
+    :param data:            list of addresses, elements are of type Address
+    :param distance_matrix: ndarray, whose lower triangle is going to be filled
+    :param metric:          "time" for travel time by car between points and "distance" for travel distance by car
+    """
+    for origin_indices, destination_indices in get_lower_triangle_tiles(len(data)):
+        block = gmaps.distances_between_streets(origins=[data[i].get_street_name() for i in origin_indices],
+                                                destinations=[data[j].get_street_name() for j in destination_indices],
+                                                metric=metric)
+        for row, i in zip(block, origin_indices):
+            for value, j in zip(row, destination_indices):
+                if i > j:
+                    distance_matrix[i, j] = value
+
+
+def fill_distance_matrix_checkpointed(gmaps, data, distance_matrix, metric, checkpoint, block_fill=False, workers=1,
+                                      queries_per_second=None, max_retries=5, backoff=0.5):
+    """ Fills the lower triangle of the distance matrix like build_distance_matrix, but requests only the pairs missing
+        in the checkpoint and records every answer in it. If a request fails for good, the checkpoint is saved before
+        the error is raised, so calling this function again with the same checkpoint resumes the fill.
+
+    :param gmaps:               instance of GoogleMapsClient
+    :param data:                list of addresses, elements are of type Address
+    :param distance_matrix:     ndarray or CondensedDistanceMatrix, whose lower triangle is going to be filled
+    :param metric:              "time" for travel time by car between points and "distance" for travel distance by car
+    :param checkpoint:          instance of FillCheckpoint belonging to the streets of data
+    :param block_fill:          True, if one request should contain a whole block of pairs
+    :param workers:             integer, maximal number of requests in flight
+    :param queries_per_second:  quota of the API, which is never exceeded. None for no limit
+    :param max_retries:         integer, number of retries of a request failing with a transient error
+    :param backoff:             waiting time in seconds before the first retry, it doubles with each retry
+    """
+    assert(len(checkpoint) == len(data)), "Checkpoint does not fit the list of streets."
+    limiter = (TokenBucket(queries_per_second) if queries_per_second else None)
+    instrumentation = gmaps.get_instrumentation()
+
+    def fill_tile(origin_indices, destination_indices):
+        rows, columns = checkpoint.get_missing(origin_indices, destination_indices)
+        rows = [origin_indices[i] for i in rows]
+        columns = [destination_indices[j] for j in columns]
+
+        if block_fill and rows:
+            block = request_with_retry(lambda: gmaps.distances_between_streets(
+                [data[i].get_street_name() for i in rows], [data[j].get_street_name() for j in columns], metric),
+                limiter, max_retries, backoff, instrumentation)
+            checkpoint.mark(rows, columns, block)
+        elif rows:
+            # Without block_fill, each tile is a single row of the lower triangle
+            for column in columns:
+                value = request_with_retry(
+                    lambda: gmaps.distance_between_streets(street_one=data[rows[0]].get_street_name(),
+                                                           street_two=data[column].get_street_name(), metric=metric),
+                    limiter, max_retries, backoff, instrumentation)
+                checkpoint.mark(rows, [column], [[value]])
+
+    if block_fill:
+        tiles = get_lower_triangle_tiles(len(data))
+    else:
+        tiles = [(range(row, row + 1), range(row)) for row in range(1, len(data))]
+
+    try:
+        if workers > 1:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+            futures = [executor.submit(fill_tile, *tile) for tile in tiles]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+        else:
+            for tile in tiles:
+                fill_tile(*tile)
+    finally:
+        # Everything paid for so far is kept, no matter whether the fill succeeded or not
+        checkpoint.save()
+
+    checkpoint.write_to(distance_matrix)
+
+
+def is_transient_error(error):
+    """ Decides, whether a failed request to Google's APIs is worth retrying, e.g. time outs, server errors or an
+        exceeded query limit. Errors like an invalid API key or an unknown address are not transient.
+
+    :param error:   exception raised by the googlemaps library
+    :return:        True, if the request may succeed when sent again
+    """
+    if isinstance(error, googlemaps.exceptions.HTTPError):
+        return error.status_code == 429 or error.status_code >= 500
+    if isinstance(error, (googlemaps.exceptions.Timeout, googlemaps.exceptions.TransportError)):
+        return True
+    return isinstance(error, googlemaps.exceptions.ApiError) and error.status in ("OVER_QUERY_LIMIT", "UNKNOWN_ERROR")
+
+
+def request_with_retry(request, limiter=None, max_retries=5, backoff=0.5, instrumentation=None):
+    """ Calls request, waiting for the rate limiter before each attempt. Transient errors are retried with exponentially
+        growing and randomly jittered waiting times, all other errors are raised immediately.
+
+    :param request:     function without arguments sending the actual request
+    :param limiter:     instance of TokenBucket or None for no rate limit
+    :param max_retries: integer, number of retries before the error is raised
+    :param backoff:     waiting time in seconds before the first retry, it doubles with each retry
+    :param instrumentation: instance of Instrumentation counting the retries. None for no counting
+    :return:            return value of request
+    """
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return request()
+        except Exception as error:
+            if attempt == max_retries or not is_transient_error(error):
+                raise
+            if instrumentation is not None:
+                instrumentation.count("retries")
+            time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def fill_distance_matrix_concurrent(gmaps, data, distance_matrix, metric, block_fill=False, workers=8,
+                                    queries_per_second=None, max_retries=5, backoff=0.5):
+    """ Fills the lower triangle of the distance matrix with several requests in flight at the same time. The results
+        are written directly into distance_matrix. Without block_fill, each worker fills a whole column of the lower
+        triangle with one request per pair, with block_fill each worker requests one block at a time (see
+        fill_distance_matrix_blocks).
+
+    :param gmaps:               instance of GoogleMapsClient
+    :param data:                list of addresses, elements are of type Address
+    :param distance_matrix:     ndarray, whose lower triangle is going to be filled
+    :param metric:              "time" for travel time by car between points and "distance" for travel distance by car
+    :param block_fill:          True, if one request should contain a whole block of pairs
+    :param workers:             integer, maximal number of requests in flight
+    :param queries_per_second:  quota of the API, which is never exceeded. None for no limit
+    :param max_retries:         integer, number of retries of a request failing with a transient error
+    :param backoff:             waiting time in seconds before the first retry, it doubles with each retry
+    """
+    limiter = (TokenBucket(queries_per_second) if queries_per_second else None)
+    instrumentation = gmaps.get_instrumentation()
+
+    def fill_block(origin_indices, destination_indices):
+        origins = [data[i].get_street_name() for i in origin_indices]
+        destinations = [data[j].get_street_name() for j in destination_indices]
+        block = request_with_retry(lambda: gmaps.distances_between_streets(origins, destinations, metric),
+                                   limiter, max_retries, backoff, instrumentation)
+        for row, i in zip(block, origin_indices):
+            for value, j in zip(row, destination_indices):
+                if i > j:
+                    distance_matrix[i, j] = value
+
+    def fill_column(column):
+        for row in range(column):
+            distance_matrix[column, row] = request_with_retry(
+                lambda: gmaps.distance_between_streets(street_one=data[column].get_street_name(),
+                                                       street_two=data[row].get_street_name(),
+                                                       metric=metric),
+                limiter, max_retries, backoff, instrumentation)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    if block_fill:
+        futures = [executor.submit(fill_block, *tile) for tile in get_lower_triangle_tiles(len(data))]
+    else:
+        futures = [executor.submit(fill_column, column) for column in range(1, len(data))]
+
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+    finally:
+        # In case of an error, pending requests are dropped instead of being paid for
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def get_strip_tiles(new_indices, old_indices, max_elements=MAX_ELEMENTS_PER_REQUEST, max_origins=MAX_ORIGINS_PER_REQUEST,
+                    max_destinations=MAX_DESTINATIONS_PER_REQUEST):
+    """ Splits the pairs needed after adding new points to a distance matrix into blocks of origins and destinations,
+        such that each block fits into one single Distance Matrix API request. The blocks cover every pair of a new and
+        an old point and the lower triangle of the pairs of new points.
+
+    :param new_indices:         list of indices of the new points
+    :param old_indices:         list of indices of the points with known distances
+    :param max_elements:        maximal number of origins times destinations in one request
+    :param max_origins:         maximal number of origins in one request
+    :param max_destinations:    maximal number of destinations in one request
+    :return:                    list of tuples (origin_indices, destination_indices), both of type list
+    """
+    size = min(math.isqrt(max_elements), max_origins, max_destinations)
+    tiles = list()
+
+    for row_start in range(0, len(new_indices), size):
+        for column_start in range(0, len(old_indices), size):
+            tiles.append((new_indices[row_start:row_start + size], old_indices[column_start:column_start + size]))
+
+    for origin_positions, destination_positions in get_lower_triangle_tiles(len(new_indices), max_elements,
+                                                                            max_origins, max_destinations):
+        tiles.append(([new_indices[i] for i in origin_positions], [new_indices[j] for j in destination_positions]))
+
+    return tiles
+
+
+def grow_distance_matrix(gmaps, distance_matrix, old_list_of_streets, data, metric, block_fill=False):
+    """ See update_distance_matrix. Copies the known distances into a new symmetric matrix and requests the missing
+        ones, writing both [i, j] and [j, i].
+
+    :param gmaps:               instance of GoogleMapsClient
+    :param distance_matrix:     ndarray of shape (n_old, n_old) belonging to old_list_of_streets
+    :param old_list_of_streets: list of strings of the streets distance_matrix has been built for
+    :param data:                list of addresses, elements are of type Address, the new matrix is built for
+    :param metric:              "time" for travel time by car between points and "distance" for travel distance by car
+    :param block_fill:          True, if one request should contain a whole block of pairs
+    :return:                    ndarray of shape (len(data), len(data))
+    """
+    old_index = {normalise_street_name(street): i for i, street in enumerate(old_list_of_streets)}
+    positions = [old_index.get(normalise_street_name(address.get_street_name()), -1) for address in data]
+
+    known_indices = [i for i, position in enumerate(positions) if position >= 0]
+    new_indices = [i for i, position in enumerate(positions) if position < 0]
+    is_new = np.array([position < 0 for position in positions], dtype=bool)
+
+    new_matrix = np.zeros((len(data), len(data)), dtype=(distance_matrix.dtype if distance_matrix.size else int))
+    known_positions = [positions[i] for i in known_indices]
+    new_matrix[np.ix_(known_indices, known_indices)] = distance_matrix[np.ix_(known_positions, known_positions)]
+
+    for origin_indices, destination_indices in get_strip_tiles(new_indices, known_indices):
+        if block_fill:
+            block = gmaps.distances_between_streets(origins=[data[i].get_street_name() for i in origin_indices],
+                                                    destinations=[data[j].get_street_name()
+                                                                  for j in destination_indices],
+                                                    metric=metric)
+        else:
+            block = [[(gmaps.distance_between_streets(data[i].get_street_name(), data[j].get_street_name(), metric)
+                       if i > j or not is_new[j] else 0) for j in destination_indices] for i in origin_indices]
+
+        for row, i in zip(block, origin_indices):
+            for value, j in zip(row, destination_indices):
+                # pairs of two new points are only needed once
+                if i > j or not is_new[j]:
+                    new_matrix[i, j] = value
+                    new_matrix[j, i] = value
+
+    return new_matrix
+
+
+def get_distances(gmaps, origins, destinations, metric, limiter=None, max_retries=5, backoff=0.5):
+    """ Requests the distances from every origin to every destination, split into as few requests as the limits of the
+        Distance Matrix API allow. Each request waits for the rate limiter and is retried on its own, so a transient
+        error never causes the requests already answered to be sent and paid for again.
+
+    :param gmaps:           instance of GoogleMapsClient
+    :param origins:         list of addresses, elements are of type Address
+    :param destinations:    list of addresses, elements are of type Address
+    :param metric:          "time" for travel time by car between points and "distance" for travel distance by car
+    :param limiter:         instance of TokenBucket, which every request waits for. None for no rate limit
+    :param max_retries:     integer, number of retries of a request failing with a transient error
+    :param backoff:         waiting time in seconds before the first retry, it doubles with each retry
+    :return:                ndarray of shape (len(origins), len(destinations))
+    """
+    distances = np.zeros((len(origins), len(destinations)), dtype=int)
+
+    columns = min(len(destinations), MAX_DESTINATIONS_PER_REQUEST, MAX_ELEMENTS_PER_REQUEST) or 1
+    rows = max(1, min(MAX_ORIGINS_PER_REQUEST, MAX_ELEMENTS_PER_REQUEST // columns))
+
+    for row_start in range(0, len(origins), rows):
+        for column_start in range(0, len(destinations), columns):
+            origin_names = [address.get_street_name() for address in origins[row_start:row_start + rows]]
+            destination_names = [address.get_street_name()
+                                 for address in destinations[column_start:column_start + columns]]
+            distances[row_start:row_start + rows, column_start:column_start + columns] = request_with_retry(
+                lambda: gmaps.distances_between_streets(origins=origin_names, destinations=destination_names,
+                                                        metric=metric),
+                limiter, max_retries, backoff, gmaps.get_instrumentation())
+
+    return distances
+
+
+def haversine(coordinates_one, coordinates_two):
+    """ Straight line distance along the surface of the earth in meters. Works on ndarrays of coordinates, whose last
+        axis holds latitude and longitude in degrees, and broadcasts like numpy.
+
+    :param coordinates_one: ndarray of shape (..., 2)
+    :param coordinates_two: ndarray of shape (..., 2)
+    :return:                ndarray of distances in meters
+    """
+    latitude_one, longitude_one = np.radians(coordinates_one[..., 0]), np.radians(coordinates_one[..., 1])
+    latitude_two, longitude_two = np.radians(coordinates_two[..., 0]), np.radians(coordinates_two[..., 1])
+
+    a = np.sin((latitude_two - latitude_one) / 2) ** 2 \
+        + np.cos(latitude_one) * np.cos(latitude_two) * np.sin((longitude_two - longitude_one) / 2) ** 2
+
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def get_nearest_neighbours(coordinates, m, rows_at_once=1024):
+    """ Finds for every point the m points with the smallest straight line distance, the point itself excluded.
+
+    :param coordinates:     ndarray of shape (n, 2) of latitudes and longitudes in degrees
+    :param m:               integer, number of neighbours per point
+    :param rows_at_once:    number of points, whose distances to all points are calculated at once
+    :return:                ndarray of shape (n, m) of indices of the neighbours, in no particular order
+    """
+    n = len(coordinates)
+    m = min(m, n - 1)
+    neighbours = np.zeros((n, max(m, 0)), dtype=np.int64)
+    if m <= 0:
+        return neighbours
+
+    for start in range(0, n, rows_at_once):
+        end = min(start + rows_at_once, n)
+        distances = haversine(coordinates[start:end, None, :], coordinates[None, :, :])
+        distances[np.arange(end - start), np.arange(start, end)] = np.inf
+        neighbours[start:end] = np.argpartition(distances, m - 1, axis=1)[:, :m]
+
+    return neighbours
+
+
+def get_coordinates(list_of_streets, coordinates, gmaps=None):
+    """ Looks up the coordinates of streets, geocoding the ones missing in coordinates.
+
+    :param list_of_streets: list of strings of streets
+    :param coordinates:     dictionary of street to its coordinates
+    :param gmaps:           instance of GoogleMapsClient, only needed if a street is missing in coordinates
+    :return:                ndarray of shape (n, 2)
+    """
+    missing = [street for street in list_of_streets if street not in coordinates]
+    if missing:
+        assert(gmaps is not None), "No coordinates of {} and no GoogleMapsClient for geocoding them.".format(missing[0])
+        coordinates = dict(coordinates)
+        coordinates.update(zip(missing, gmaps.addresses_to_coordinates(missing)))
+
+    return np.array([coordinates[street] for street in list_of_streets], dtype=float).reshape(-1, 2)
+
+
+# Road graph of a worker process of RoadGraph.get_shortest_path_lengths, see set_worker_road_graph
+worker_road_graph = None
+
+
+def set_worker_road_graph(indptr, indices, weights, target_nodes):
+    """ Initialiser of the worker processes of RoadGraph.get_shortest_path_lengths. The graph is sent to every process
+        once instead of once per source node.
+    """
+    global worker_road_graph
+    worker_road_graph = (indptr, indices, weights, target_nodes)
+
+
+def run_worker_dijkstra(source):
+    return run_dijkstra(*worker_road_graph, source)
+
+
+def run_dijkstra(indptr, indices, weights, target_nodes, source):
+    """ Single source Dijkstra on a graph in compressed sparse row format (see RoadGraph), stopping as soon as all
+        target nodes are settled. Works on lists, which are faster than ndarrays for single element accesses.
+
+    :param indptr:          list, the edges leaving node i are edges indptr[i] till indptr[i + 1]
+    :param indices:         list of the nodes the edges end at
+    :param weights:         list of the weights of the edges
+    :param target_nodes:    list of indices of nodes, whose distance from the source is asked for
+    :param source:          index of node the shortest paths start at
+    :return:                list of lengths of the shortest paths to the target nodes, inf for unreachable ones
+    """
+    distances = {source: 0.0}
+    settled = set()
+    remaining = set(target_nodes)
+    heap = [(0.0, source)]
+
+    while heap and remaining:
+        distance, node = heapq.heappop(heap)
+        if node in settled:
+            continue
+        settled.add(node)
+        remaining.discard(node)
+
+        for edge in range(indptr[node], indptr[node + 1]):
+            neighbour = indices[edge]
+            new_distance = distance + weights[edge]
+            if new_distance < distances.get(neighbour, math.inf):
+                distances[neighbour] = new_distance
+                heapq.heappush(heap, (new_distance, neighbour))
+
+    return [(distances[node] if node in settled else math.inf) for node in target_nodes]
+
+
+def fit_detour_factor(straight_distances, road_distances):
+    """ Fits the factor turning straight line distances into road distances (or travel times) by least squares, i.e.
+        road_distance ~ factor * straight_distance.
+
+    :param straight_distances:  ndarray of straight line distances in meters
+    :param road_distances:      ndarray of distances returned by the Distance Matrix API for the same pairs
+    :return:                    float, the fitted factor
+    """
+    denominator = np.dot(straight_distances, straight_distances)
+    if denominator == 0:
+        return 1.0
+
+    return float(np.dot(straight_distances, road_distances) / denominator)
+
+
+def partition_coordinates(coordinates, regions, seed=None, max_iterations=100, max_size=None):
+    """ Coarse geographic partition of points by k-means (Lloyd's algorithm with k-means++ initial centers) on their
+        coordinates, projected onto a plane around their mean latitude. It needs no distances of the Distance Matrix
+        API at all and is only meant to separate points, which are never going to share a cluster anyway.
+
+    :param coordinates:     ndarray of shape (n, 2) of latitudes and longitudes in degrees
+    :param regions:         integer, number of regions
+    :param seed:            seed of the random number generator drawing the initial centers
+    :param max_iterations:  integer, maximal number of iterations of Lloyd's algorithm
+    :param max_size:        integer, maximal number of points of a region. Larger regions are split again and again,
+                            so there may be more regions than asked for. None for no limit
+    :return:                ndarray of labels, entry i is the number of the region point i belongs to. Every region
+                            gets at least one point
+    """
+    if max_size is not None:
+        labels = partition_coordinates(coordinates, regions, seed, max_iterations)
+        regions = np.bincount(labels)
+        while regions.max() > max_size:
+            region = int(np.argmax(regions))
+            members = np.flatnonzero(labels == region)
+            parts = -(-len(members) // max_size)
+
+            if np.all(coordinates[members] == coordinates[members[0]]):
+                # Points at the same place cannot be told apart by their coordinates
+                sub_labels = np.arange(len(members)) * parts // len(members)
+            else:
+                places = len(np.unique(coordinates[members], axis=0))
+                sub_labels = partition_coordinates(coordinates[members], min(parts, places), seed, max_iterations)
+            labels[members] = np.where(sub_labels == 0, region, len(regions) + sub_labels - 1)
+            regions = np.bincount(labels)
+
+        return labels
+
+    assert(1 <= regions <= len(coordinates)), "Number of regions has to be between 1 and the number of points."
+    points = np.column_stack((coordinates[:, 0], coordinates[:, 1] * np.cos(np.radians(coordinates[:, 0].mean()))))
+    rng = np.random.default_rng(seed)
+
+    centers = [points[rng.integers(len(points))]]
+    distance_nearest = ((points - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, regions):
+        if distance_nearest.sum() > 0:
+            centers.append(points[rng.choice(len(points), p=distance_nearest / distance_nearest.sum())])
+        else:
+            centers.append(points[rng.integers(len(points))])
+        distance_nearest = np.minimum(distance_nearest, ((points - centers[-1]) ** 2).sum(axis=1))
+    centers = np.array(centers)
+
+    labels = None
+    for _ in range(max_iterations):
+        distances = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        new_labels = np.argmin(distances, axis=1)
+
+        # An empty region takes over the point farthest from its center
+        for region in np.setdiff1d(np.arange(regions), new_labels):
+            farthest = np.argmax(distances[np.arange(len(points)), new_labels]
+                                 * (np.bincount(new_labels, minlength=regions)[new_labels] > 1))
+            new_labels[farthest] = region
+            distances[farthest] = 0
+
+        if labels is not None and (new_labels == labels).all():
+            break
+        labels = new_labels
+        centers = np.array([points[labels == region].mean(axis=0) for region in range(regions)])
+
+    return labels
+
+
+def distribute_clusters(sizes, k, shares=None):
+    """ Distributes k clusters among regions in proportion to their shares by the largest remainder method. Every
+        region gets at least one cluster and at most as many clusters as it has points.
+
+    :param sizes:   ndarray of the number of points of every region
+    :param k:       integer showing the total number of clusters
+    :param shares:  ndarray of the shares of the regions, e.g. their sizes or spreads. None for their sizes
+    :return:        ndarray of the number of clusters of every region, which sum up to k
+    """
+    sizes = np.asarray(sizes)
+    assert(len(sizes) <= k <= sizes.sum()), "Every region needs at least one cluster and one point per cluster."
+    shares = np.asarray(sizes if shares is None else shares, dtype=float)
+    quotas = (k * shares / shares.sum() if shares.sum() > 0 else k * sizes / sizes.sum())
+
+    counts = np.minimum(sizes, np.maximum(1, np.floor(quotas).astype(int)))
+    while counts.sum() < k:
+        counts[np.argmax(np.where(counts < sizes, quotas - counts, -np.inf))] += 1
+    while counts.sum() > k:
+        counts[np.argmax(np.where(counts > 1, counts - quotas, -np.inf))] -= 1
+
+    return counts
+
+
 def get_nearest_center(address, list_clusters, distance_matrix):
     """ Takes an address and returns the cluster it has the smallest distance to.
 
@@ -197,10 +1967,890 @@ def calculate_cost(data, distance_matrix):
     return cost
 
 
+def assign_labels(distance_matrix, medoids):
+    """ Array version of assign_street_cluster. Assigns every point to its nearest medoid. Ties are broken in favour of
+        the medoid coming first, just like in get_nearest_center.
+
+    :param distance_matrix: distance matrix coding the distance from each point to each point
+    :param medoids:         ndarray of indices of the medoids, one per cluster
+    :return:                ndarray of labels, entry i is the number of the cluster point i belongs to
+    """
+    if isinstance(distance_matrix, LazyDistanceMatrix):
+        return assign_labels_pruned(distance_matrix, medoids)
+    return np.argmin(distance_matrix[:, medoids], axis=1)
+
+
+def assign_labels_pruned(distance_matrix, medoids):
+    """ Same as assign_labels, but reads only those distances from points to medoids, which can change the decision
+        for the nearest medoid. The medoids are visited one after another. By the triangle inequality,
+        d(x, m) >= d(m_x, m) - d(x, m_x) for the nearest medoid m_x of point x found so far, so m cannot be nearer than
+        m_x (and not as near either), if d(m_x, m) > 2 * d(x, m_x). Only the k * k distances between the medoids are
+        read in advance (Elkan, 2003, Using the triangle inequality to accelerate k-means).
+        Meant for a LazyDistanceMatrix, where every skipped distance is an element not paid for. The labels equal the
+        ones of assign_labels, as long as the distances fulfil the triangle inequality.
+
+    :param distance_matrix: distance matrix coding the distance from each point to each point
+    :param medoids:         ndarray of indices of the medoids, one per cluster
+    :return:                ndarray of labels, entry i is the number of the cluster point i belongs to
+    """
+    between_medoids = np.asarray(distance_matrix[np.ix_(medoids, medoids)], dtype=float)
+    labels = np.zeros(len(distance_matrix), dtype=np.int64)
+    nearest = np.asarray(distance_matrix[:, medoids[0]]).astype(float)
+
+    for cluster in range(1, len(medoids)):
+        candidates = np.flatnonzero(between_medoids[labels, cluster] <= 2 * nearest)
+        distances = np.asarray(distance_matrix[candidates, medoids[cluster]], dtype=float)
+
+        # Only strictly nearer medoids win, so ties go to the medoid coming first
+        nearer = (distances < nearest[candidates])
+        labels[candidates[nearer]] = cluster
+        nearest[candidates[nearer]] = distances[nearer]
+
+    return labels
+
+
+def calculate_cost_labels(distance_matrix, labels, medoids, weights=None):
+    """ Array version of calculate_cost.
+
+    :param distance_matrix: distance matrix coding the distance from each point to each point
+    :param labels:          ndarray of labels, entry i is the number of the cluster point i belongs to
+    :param medoids:         ndarray of indices of the medoids, one per cluster
+    :param weights:         ndarray of the multiplicity of every point. None for all weights being one
+    :return:                sum of all distances from each point to the medoid of its cluster
+    """
+    distances = distance_matrix[np.arange(len(labels)), medoids[labels]]
+    if weights is None:
+        return distances.sum()
+    return (weights * distances).sum()
+
+
+def get_point_costs(distance_matrix, points, medoids_of_points, weights=None):
+    """ Weighted distances of points to their medoids, as signed integers for integer distance matrices, such that
+        differences of them do not overflow.
+
+    :param distance_matrix:     distance matrix coding the distance from each point to each point
+    :param points:              ndarray of indices of points
+    :param medoids_of_points:   ndarray of indices of the medoid of each point
+    :param weights:             ndarray of the multiplicity of every point. None for all weights being one
+    :return:                    ndarray of the cost of each point
+    """
+    distances = np.asarray(distance_matrix[points, medoids_of_points])
+    distances = distances.astype(np.int64 if np.issubdtype(distances.dtype, np.integer) else float)
+    return (distances if weights is None else weights[points] * distances)
+
+
+def update_medoids(distance_matrix, labels, medoids, block_elements=2 ** 24, weights=None, clusters=None):
+    """ Array version of Cluster.set_minimising_center for all clusters. The new medoid of a cluster is the member with
+        the smallest sum of distances to all other members, ties are broken in favour of the smaller index. Clusters
+        without members keep their medoid.
+
+    :param distance_matrix: distance matrix coding the distance from each point to each point
+    :param labels:          ndarray of labels, entry i is the number of the cluster point i belongs to
+    :param medoids:         ndarray of indices of the medoids, one per cluster
+    :param block_elements:  maximal number of entries of the distance matrix gathered at once
+    :param weights:         ndarray of the multiplicity of every point, the distances to a member are counted as often
+                            as its weight. None for all weights being one
+    :param clusters:        iterable of the numbers of the clusters to be updated, all others keep their medoid. None
+                            for all clusters
+    :return:                ndarray of indices of the new medoids
+    """
+    new_medoids = medoids.copy()
+
+    for cluster in (range(len(medoids)) if clusters is None else clusters):
+        members = np.flatnonzero(labels == cluster)
+        if len(members) == 0:
+            continue
+
+        costs = np.zeros(len(members))
+        step = max(1, block_elements // len(members))
+        for start in range(0, len(members), step):
+            block = distance_matrix[np.ix_(members[start:start + step], members)]
+            costs += (block.sum(axis=0) if weights is None else weights[members[start:start + step]] @ block)
+
+        new_medoids[cluster] = members[np.argmin(costs)]
+
+    return new_medoids
+
+
+def run_k_medoids(distance_matrix, initial_medoids, weights=None, instrumentation=None):
+    """ STEP 1-4 till STEP 3 of Park and Jun on arrays instead of instances of Address and Cluster. The state of the
+        clustering is a label per point and a medoid per cluster.
+        Only the medoids of clusters, which gained or lost members in the last iteration, are updated, as the medoid of
+        an unchanged cluster stays the same. The total cost is kept as a running value, changed only by the points
+        whose medoid moved or who moved to another cluster. Thus, late iterations with few moving points are cheap.
+
+    :param distance_matrix: distance matrix coding the distance from each point to each point
+    :param initial_medoids: indices of the initial medoids, one per cluster
+    :param weights:         ndarray of the multiplicity of every point. None for all weights being one
+    :param instrumentation: instance of Instrumentation, which times the initial assignment and records every
+                            iteration. None for no instrumentation
+    :return:                tuple of labels, medoids and the total cost of the final clustering
+    """
+    medoids = np.asarray(initial_medoids)
+    points = np.arange(len(distance_matrix))
+
+    with measure_phase(instrumentation, "initial_assignment"):
+        # STEP 1-4
+        labels = assign_labels(distance_matrix, medoids)
+
+        # STEP 1-5
+        point_costs = get_point_costs(distance_matrix, points, medoids[labels], weights)
+        cost = point_costs.sum()
+
+    # In the first iteration, no medoid has been calculated from its members yet
+    dirty = np.ones(len(medoids), dtype=bool)
+
+    # STEP 2 and 3
+    while True:
+        start = time.perf_counter()
+        new_medoids = update_medoids(distance_matrix, labels, medoids, weights=weights, clusters=np.flatnonzero(dirty))
+
+        # Only the members of clusters with a new medoid change their cost
+        members = np.flatnonzero(np.isin(labels, np.flatnonzero(new_medoids != medoids)))
+        medoids = new_medoids
+        new_point_costs = get_point_costs(distance_matrix, members, medoids[labels[members]], weights)
+        new_cost = cost + (new_point_costs - point_costs[members]).sum()
+        point_costs[members] = new_point_costs
+
+        new_labels = assign_labels(distance_matrix, medoids)
+        moved = np.flatnonzero(new_labels != labels)
+        new_point_costs = get_point_costs(distance_matrix, moved, medoids[new_labels[moved]], weights)
+        new_cost += (new_point_costs - point_costs[moved]).sum()
+        point_costs[moved] = new_point_costs
+
+        dirty[:] = False
+        dirty[labels[moved]] = True
+        dirty[new_labels[moved]] = True
+
+        if instrumentation is not None:
+            instrumentation.record_iteration(new_cost, len(moved), time.perf_counter() - start)
+        labels = new_labels
+
+        if new_cost >= cost:
+            break
+
+        cost = new_cost
+
+    return labels, medoids, cost
+
+
+def get_nearest_two(distance_matrix, medoids):
+    """ Finds for every point its nearest and second nearest medoid. Ties are broken in favour of the medoid coming
+        first, just like in assign_labels.
+
+    :param distance_matrix: distance matrix coding the distance from each point to each point
+    :param medoids:         ndarray of indices of at least two medoids
+    :return:                tuple of ndarrays: nearest cluster, second nearest cluster, distance to nearest medoid and
+                            distance to second nearest medoid for every point
+    """
+    distances = distance_matrix[:, medoids].astype(float)
+    order = np.argsort(distances, axis=1, kind="stable")
+    rows = np.arange(len(distances))
+
+    return order[:, 0], order[:, 1], distances[rows, order[:, 0]], distances[rows, order[:, 1]]
+
+
+def run_fasterpam(distance_matrix, initial_medoids, max_passes=100, weights=None, instrumentation=None):
+    """ Alternative to run_k_medoids, following FasterPAM (Schubert and Rousseeuw, 2021, Fast and eager k-medoids
+        clustering, in Information Systems 101). Every point caches its nearest and second nearest medoid, so the change
+        of the total cost caused by swapping a medoid with a non-medoid is obtained for all k medoids at once in O(n).
+        The first improving swap is accepted eagerly. The loop stops, when no swap improves the cost anymore. This is a
+        local optimum of another neighbourhood than the one of run_k_medoids, so depending on the data either method
+        may end at the lower cost.
+        Nb. The distance matrix is assumed to be symmetric, as everywhere in this module.
+
+    :param distance_matrix: distance matrix coding the distance from each point to each point
+    :param initial_medoids: indices of the initial medoids, e.g. the ones of STEP 1-3 of Park and Jun
+    :param max_passes:      integer, maximal number of passes over all points
+    :param weights:         ndarray of the multiplicity of every point. None for all weights being one
+    :param instrumentation: instance of Instrumentation, which records every accepted swap as an iteration. None for
+                            no instrumentation
+    :return:                tuple of labels, medoids and the total cost of the final clustering
+    """
+    medoids = np.array(initial_medoids)
+    n, k = len(distance_matrix), len(medoids)
+
+    if k == 1:
+        # The optimal single medoid is the point with the smallest sum of distances
+        labels = np.zeros(n, dtype=np.int64)
+        medoids = update_medoids(distance_matrix, labels, medoids, weights=weights)
+        return labels, medoids, calculate_cost_labels(distance_matrix, labels, medoids, weights)
+
+    point_weights = (np.ones(n) if weights is None else np.asarray(weights, dtype=float))
+
+    with measure_phase(instrumentation, "initial_assignment"):
+        nearest, second, distance_nearest, distance_second = get_nearest_two(distance_matrix, medoids)
+        removal_loss = np.bincount(nearest, weights=point_weights * (distance_second - distance_nearest), minlength=k)
+    start = time.perf_counter()
+
+    is_medoid = np.zeros(n, dtype=bool)
+    is_medoid[medoids] = True
+
+    candidates_without_swap = 0
+    for step in range(max_passes * n):
+        if candidates_without_swap >= n:
+            break
+
+        candidate = step % n
+        candidates_without_swap += 1
+        if is_medoid[candidate]:
+            continue
+
+        distances = distance_matrix[candidate].astype(float)
+        closer = distances < distance_nearest
+        closer_than_second = ~closer & (distances < distance_second)
+
+        # change of the total cost when swapping medoid i with the candidate, for every i at once
+        delta = removal_loss \
+            + np.bincount(nearest[closer], weights=(point_weights * (distance_nearest - distance_second))[closer],
+                          minlength=k) \
+            + np.bincount(nearest[closer_than_second],
+                          weights=(point_weights * (distances - distance_second))[closer_than_second], minlength=k)
+        best = np.argmin(delta)
+
+        if delta[best] + (point_weights * (distances - distance_nearest))[closer].sum() < 0:
+            is_medoid[medoids[best]] = False
+            is_medoid[candidate] = True
+            medoids[best] = candidate
+
+            previous_nearest = nearest
+            nearest, second, distance_nearest, distance_second = get_nearest_two(distance_matrix, medoids)
+            if instrumentation is not None:
+                instrumentation.record_iteration((point_weights * distance_nearest).sum(),
+                                                 int(np.count_nonzero(nearest != previous_nearest)),
+                                                 time.perf_counter() - start)
+                start = time.perf_counter()
+            removal_loss = np.bincount(nearest, weights=point_weights * (distance_second - distance_nearest),
+                                       minlength=k)
+            candidates_without_swap = 0
+
+    labels = assign_labels(distance_matrix, medoids)
+    return labels, medoids, calculate_cost_labels(distance_matrix, labels, medoids, weights)
+
+
+def optimise_medoids(distance_matrix, initial_medoids, method="park_jun", weights=None, instrumentation=None):
+    """ Runs the chosen clustering loop starting at the initial medoids.
+
+    :param distance_matrix: distance matrix coding the distance from each point to each point
+    :param initial_medoids: indices of the initial medoids, one per cluster
+    :param method:          "park_jun" for run_k_medoids, "fasterpam" for run_fasterpam
+    :param weights:         ndarray of the multiplicity of every point. None for all weights being one
+    :param instrumentation: instance of Instrumentation or None, see run_k_medoids
+    :return:                tuple of labels, medoids and the total cost of the final clustering
+    """
+    assert(method == "park_jun" or method == "fasterpam"), "Unvalid method has been chosen, try 'park_jun' or " \
+                                                            "'fasterpam'"
+    if method == "fasterpam":
+        return run_fasterpam(distance_matrix, initial_medoids, weights=weights, instrumentation=instrumentation)
+    return run_k_medoids(distance_matrix, initial_medoids, weights, instrumentation)
+
+
+def share_distance_matrix(distance_matrix):
+    """ Copies the distance matrix into a block of shared memory, which worker processes can attach to without
+        receiving a pickled copy. The caller has to close and unlink the shared memory when all workers are done.
+
+    :param distance_matrix: ndarray or CondensedDistanceMatrix
+    :return:                tuple of the SharedMemory instance and a small picklable description of the matrix, which
+                            is passed to attach_distance_matrix
+    """
+    condensed = isinstance(distance_matrix, CondensedDistanceMatrix)
+    array = (distance_matrix.get_data() if condensed else np.asarray(distance_matrix))
+
+    shared = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shared.buf)[...] = array
+
+    return shared, (shared.name, array.shape, str(array.dtype), (len(distance_matrix) if condensed else None))
+
+
+def attach_distance_matrix(description):
+    """ Attaches to a distance matrix shared by share_distance_matrix, without copying it.
+
+    :param description: description returned by share_distance_matrix
+    :return:            tuple of the SharedMemory instance, which has to be closed after usage, and the distance matrix
+    """
+    name, shape, dtype, n = description
+    shared = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(shape, dtype=dtype, buffer=shared.buf)
+    return shared, (array if n is None else CondensedDistanceMatrix(n, dtype=dtype, data=array))
+
+
+def optimise_shared_medoids(description, initial_medoids, method="park_jun", weights=None):
+    """ Same as optimise_medoids, but on a distance matrix in shared memory. Meant to run in a worker process.
+
+    :param description:     description returned by share_distance_matrix
+    :param initial_medoids: indices of the initial medoids, one per cluster
+    :param method:          "park_jun" or "fasterpam"
+    :param weights:         ndarray of the multiplicity of every point. None for all weights being one
+    :return:                tuple of labels, medoids and the total cost of the final clustering
+    """
+    shared, distance_matrix = attach_distance_matrix(description)
+    try:
+        return optimise_medoids(distance_matrix, initial_medoids, method, weights)
+    finally:
+        del distance_matrix
+        shared.close()
+
+
+def get_initial_medoids_plus_plus(distance_matrix, k, rng, weights=None, medoids=None):
+    """ Randomised initial medoids following k-means++ (Arthur and Vassilvitskii, 2007): the first medoid is drawn
+        uniformly, every further one with a probability proportional to the squared distance to the nearest medoid
+        drawn so far.
+
+    :param distance_matrix: distance matrix coding the distance from each point to each point
+    :param k:               integer showing the number of clusters
+    :param rng:             instance of np.random.Generator
+    :param weights:         ndarray of the multiplicity of every point, which multiplies its probability. None for all
+                            weights being one
+    :param medoids:         list of indices of medoids chosen already, which are kept and only completed to k medoids.
+                            None to start from scratch
+    :return:                ndarray of indices of the k initial medoids
+    """
+    n = len(distance_matrix)
+    if medoids:
+        medoids = [int(medoid) for medoid in medoids]
+        distance_nearest = np.asarray(distance_matrix[medoids]).min(axis=0).astype(float)
+    else:
+        if weights is None:
+            medoids = [int(rng.integers(n))]
+        else:
+            medoids = [int(rng.choice(n, p=weights / weights.sum()))]
+        distance_nearest = distance_matrix[medoids[0]].astype(float)
+
+    for _ in range(len(medoids), k):
+        probabilities = distance_nearest ** 2
+        if weights is not None:
+            probabilities *= weights
+        probabilities[medoids] = 0
+        if probabilities.sum() > 0:
+            medoid = int(rng.choice(n, p=probabilities / probabilities.sum()))
+        else:
+            medoid = int(rng.choice(np.setdiff1d(np.arange(n), medoids)))
+
+        medoids.append(medoid)
+        distance_nearest = np.minimum(distance_nearest, distance_matrix[medoid])
+
+    return np.array(medoids)
+
+
+def optimise_multi_start(distance_matrix, list_initial_medoids, method="park_jun", processes=None, weights=None,
+                         instrumentation=None):
+    """ Runs the clustering loop for several sets of initial medoids and keeps the clustering of lowest cost. With more
+        than one start, the starts run in a pool of processes attached to one shared copy of the distance matrix, except
+        for a LazyDistanceMatrix, whose starts run one after another.
+
+    :param distance_matrix:         distance matrix coding the distance from each point to each point
+    :param list_initial_medoids:    list of ndarrays of indices of initial medoids
+    :param method:                  "park_jun" or "fasterpam"
+    :param processes:               integer, number of worker processes. None for the number of processors
+    :param weights:                 ndarray of the multiplicity of every point. None for all weights being one
+    :param instrumentation:         instance of Instrumentation or None. Iterations are only recorded for a single
+                                    start, as the starts in other processes cannot report back while running
+    :return:                        tuple of labels, medoids and the total cost of the best clustering. In case of equal
+                                    costs, the earlier start wins
+    """
+    starts = len(list_initial_medoids)
+    if starts == 1:
+        return optimise_medoids(distance_matrix, list_initial_medoids[0], method, weights, instrumentation)
+
+    if isinstance(distance_matrix, LazyDistanceMatrix):
+        # The starts run one after another, such that every start profits from the distances requested by the others
+        results = [optimise_medoids(distance_matrix, initial_medoids, method, weights, instrumentation)
+                   for initial_medoids in list_initial_medoids]
+        return min(results, key=lambda result: result[2])
+
+    shared, description = share_distance_matrix(distance_matrix)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(optimise_shared_medoids, [description] * starts, list_initial_medoids,
+                                        [method] * starts, [weights] * starts))
+    finally:
+        shared.close()
+        shared.unlink()
+
+    return min(results, key=lambda result: result[2])
+
+
+def build_clusters(data, labels, medoids):
+    """ Creates instances of Cluster from the result of run_k_medoids.
+
+    :param data:    list of addresses, elements are of type Address
+    :param labels:  ndarray of labels, entry i is the number of the cluster data[i] belongs to
+    :param medoids: ndarray of indices of the medoids, one per cluster
+    :return:        list of clusters, elements are of type Cluster
+    """
+    list_clusters = list()
+    for cluster, medoid in enumerate(medoids):
+        list_clusters.append(Cluster(center=data[medoid]))
+        list_clusters[-1].set_member([data[i] for i in np.flatnonzero(labels == cluster)])
+
+    return list_clusters
+
+
 ################################################## MAIN FUNCTIONALITY ##################################################
 
 
-def geo_k_medoids(api_key, list_of_streets, k, metric="time"):
+def build_distance_matrix(gmaps, data, metric="time", block_fill=False, workers=1, queries_per_second=None,
+                          condensed=False, dtype=None, checkpoint=None):
+    """ STEP 1-1 of Park and Jun. Requests the distances between all pairs of addresses and returns the symmetric
+        distance matrix. See geo_k_medoids for the meaning of the options.
+
+    :param gmaps:       instance of GoogleMapsClient
+    :param data:        list of addresses, elements are of type Address
+    :param checkpoint:  instance of FillCheckpoint, see fill_distance_matrix_checkpointed. None for no checkpoint
+    :return:            ndarray or CondensedDistanceMatrix containing the distance from each point to each point
+    """
+    dtype = get_distance_dtype(dtype, condensed)
+    if condensed:
+        distance_matrix = CondensedDistanceMatrix(len(data), dtype=dtype)
+    else:
+        distance_matrix = np.zeros((len(data), len(data)), dtype=dtype)
+
+    if checkpoint is not None:
+        fill_distance_matrix_checkpointed(gmaps, data, distance_matrix, metric, checkpoint, block_fill=block_fill,
+                                          workers=workers, queries_per_second=queries_per_second)
+    elif workers > 1:
+        fill_distance_matrix_concurrent(gmaps, data, distance_matrix, metric, block_fill=block_fill, workers=workers,
+                                        queries_per_second=queries_per_second)
+    elif block_fill:
+        fill_distance_matrix_blocks(gmaps, data, distance_matrix, metric)
+    else:
+        for column in range(len(data)):
+            for row in range(column):
+                distance_matrix[column, row] = gmaps.distance_between_streets(street_one=data[column].get_street_name(),
+                                                                              street_two=data[row].get_street_name(),
+                                                                              metric=metric)
+
+    if not condensed:
+        distance_matrix = symmetrise(distance_matrix)
+
+    return distance_matrix
+
+
+def build_sparse_distance_matrix(gmaps, data, neighbours, metric="time", condensed=False, dtype=None, workers=8,
+                                 queries_per_second=None, max_retries=5, backoff=0.5):
+    """ Alternative to build_distance_matrix, needing O(n * neighbours) instead of O(n^2) requests. All addresses are
+        geocoded once and only the distances between each point and its nearest neighbours (by straight line) are
+        requested. Every other entry is estimated by the straight line distance times a detour factor, which is
+        fitted to the requested pairs. Far apart pairs hardly ever decide which medoid a point belongs to, so the
+        clustering works well on this partly estimated matrix.
+
+    :param gmaps:       instance of GoogleMapsClient
+    :param data:        list of addresses, elements are of type Address
+    :param neighbours:  integer, number of nearest neighbours per point, whose distances are requested
+    :param metric:      "time" for travel time by car between points and "distance" for travel distance by car
+    :param condensed:   True, if only the upper triangle of the distance matrix should be stored
+    :param dtype:       numpy dtype of the distance matrix, see get_distance_dtype
+    :param workers:     integer, maximal number of requests in flight, while geocoding as well as while requesting
+                        the distances to the neighbours
+    :param queries_per_second:  quota of the APIs, which is never exceeded. None for no limit
+    :param max_retries: integer, number of retries of a request failing with a transient error
+    :param backoff:     waiting time in seconds before the first retry, it doubles with each retry
+    :return:            ndarray or CondensedDistanceMatrix containing the distance from each point to each point
+    """
+    dtype = get_distance_dtype(dtype, condensed)
+    coordinates = np.array(gmaps.addresses_to_coordinates([address.get_street_name() for address in data],
+                                                           workers=workers, queries_per_second=queries_per_second),
+                           dtype=float).reshape(-1, 2)
+    candidates = get_nearest_neighbours(coordinates, neighbours)
+
+    # Each unordered pair is requested only once, with one origin and up to MAX_DESTINATIONS_PER_REQUEST destinations
+    requested = set()
+    tasks = list()
+    size = min(MAX_DESTINATIONS_PER_REQUEST, MAX_ELEMENTS_PER_REQUEST)
+
+    for origin in range(len(data)):
+        destinations = list()
+        for destination in candidates[origin]:
+            pair = (min(origin, destination), max(origin, destination))
+            if pair not in requested:
+                requested.add(pair)
+                destinations.append(int(destination))
+
+        tasks.extend((origin, destinations[start:start + size]) for start in range(0, len(destinations), size))
+
+    limiter = (TokenBucket(queries_per_second) if queries_per_second else None)
+
+    def request_neighbours(task):
+        origin, chunk = task
+        return request_with_retry(lambda: gmaps.distances_between_streets(
+            origins=[data[origin].get_street_name()], destinations=[data[j].get_street_name() for j in chunk],
+            metric=metric)[0], limiter, max_retries, backoff, gmaps.get_instrumentation())
+
+    if workers > 1:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        try:
+            list_of_values = list(executor.map(request_neighbours, tasks))
+        finally:
+            # In case of an error, pending requests are dropped instead of being paid for
+            executor.shutdown(wait=True, cancel_futures=True)
+    else:
+        list_of_values = [request_neighbours(task) for task in tasks]
+
+    origin_indices, destination_indices, road_distances = list(), list(), list()
+    for (origin, chunk), values in zip(tasks, list_of_values):
+        origin_indices.extend([origin] * len(chunk))
+        destination_indices.extend(chunk)
+        road_distances.extend(values)
+
+    origin_indices = np.array(origin_indices, dtype=np.int64)
+    destination_indices = np.array(destination_indices, dtype=np.int64)
+    road_distances = np.array(road_distances, dtype=float)
+
+    factor = fit_detour_factor(haversine(coordinates[origin_indices], coordinates[destination_indices]),
+                               road_distances)
+
+    def estimate(rows, columns):
+        estimates = factor * haversine(coordinates[rows], coordinates[columns])
+        return (np.rint(estimates) if np.issubdtype(np.dtype(dtype), np.integer) else estimates)
+
+    if condensed:
+        distance_matrix = CondensedDistanceMatrix(len(data), dtype=dtype)
+        for row in range(len(data) - 1):
+            distance_matrix[row, row + 1:] = estimate(row, slice(row + 1, None))
+    else:
+        distance_matrix = np.zeros((len(data), len(data)), dtype=dtype)
+        rows_at_once = max(1, 2 ** 22 // max(len(data), 1))
+        for start in range(0, len(data), rows_at_once):
+            rows = np.arange(start, min(start + rows_at_once, len(data)))
+            distance_matrix[rows] = estimate(rows[:, None], np.arange(len(data))[None, :])
+
+    distance_matrix[origin_indices, destination_indices] = road_distances
+    distance_matrix[destination_indices, origin_indices] = road_distances
+
+    return distance_matrix
+
+
+def update_distance_matrix(api_key, distance_matrix, old_list_of_streets, new_list_of_streets, metric="time",
+                           block_fill=False, cache=None):
+    """ Adapts the distance matrix of yesterday's streets to today's streets. Every known distance is reused, rows and
+        columns of removed streets are dropped and only the distances between new streets and all other streets are
+        requested. Thus, only O(n_new * n) instead of O(n^2) requests are needed. Streets are matched by their
+        normalised names.
+        Nb. Starting from an empty matrix, np.zeros((0, 0)), and an empty list of streets builds the whole matrix.
+
+    :param api_key:             string of Google Services API key, for being able to use their services
+    :param distance_matrix:     ndarray of shape (n_old, n_old), distance matrix belonging to old_list_of_streets
+    :param old_list_of_streets: list of strings of the streets distance_matrix has been built for
+    :param new_list_of_streets: list of strings of the streets the new distance matrix is built for
+    :param metric:              "time" for travel time by car between points and "distance" for travel distance by car
+    :param block_fill:          True, if one request should contain a whole block of pairs
+    :param cache:               instance of DistanceCache, which is asked before any request is sent
+    :return:                    ndarray of shape (n_new, n_new), which can be passed to geo_k_medoids
+    """
+    assert(distance_matrix.shape == (len(old_list_of_streets), len(old_list_of_streets))), \
+        "Distance matrix does not fit the old list of streets."
+
+    gmaps = GoogleMapsClient(api_key, cache=cache)
+    data = [Address(iid=i, street_name=street) for i, street in enumerate(new_list_of_streets)]
+
+    return grow_distance_matrix(gmaps, distance_matrix, old_list_of_streets, data, metric, block_fill=block_fill)
+
+
+def build_distance_matrix_resumable(api_key, list_of_streets, path, metric="time", block_fill=True, cache=None,
+                                   workers=1, queries_per_second=None, interval=60, condensed=False, dtype=None):
+    """ Runs STEP 1-1 as a job of its own, separate from the clustering. The progress is saved in the checkpoint file
+        at path, so if the job is interrupted, calling this function again with the same arguments requests only the
+        missing pairs. The result can be passed as distance_matrix to geo_k_medoids.
+
+    :param api_key:         string of Google Services API key, for being able to use their services
+    :param list_of_streets: list containing strings of streets
+    :param path:            string of path of the checkpoint file, see FillCheckpoint
+    :param interval:        seconds between two saves of the checkpoint
+    :return:                ndarray or CondensedDistanceMatrix containing the distance from each point to each point
+    """
+    checkpoint = FillCheckpoint(path, list_of_streets, metric=metric, interval=interval)
+    assert_affordable(checkpoint.get_amount_missing())
+
+    data = [Address(iid=i, street_name=street) for i, street in enumerate(list_of_streets)]
+    gmaps = GoogleMapsClient(api_key, cache=cache)
+
+    return build_distance_matrix(gmaps, data, metric=metric, block_fill=block_fill, workers=workers,
+                                 queries_per_second=queries_per_second, condensed=condensed, dtype=dtype,
+                                 checkpoint=checkpoint)
+
+
+def run_clara_sample(gmaps, data, sample, k, metric="time", block_fill=True):
+    """ Runs the algorithm of Park and Jun on a subsample of the addresses.
+
+    :param gmaps:       instance of GoogleMapsClient
+    :param data:        list of addresses, elements are of type Address
+    :param sample:      ndarray of indices of the addresses in the subsample
+    :param k:           integer showing the number of clusters
+    :param metric:      "time" for travel time by car between points and "distance" for travel distance by car
+    :param block_fill:  True, if one request should contain a whole block of pairs
+    :return:            ndarray of indices (with respect to data) of the k medoids found in the subsample
+    """
+    sample_matrix = build_distance_matrix(gmaps, [data[i] for i in sample], metric=metric, block_fill=block_fill)
+    v_list = calculate_v_vector(sample_matrix)
+    _, sample_medoids, _ = run_k_medoids(sample_matrix, v_list.argsort()[:k])
+
+    return sample[sample_medoids]
+
+
+def geo_k_medoids_clara(api_key, list_of_streets, k, metric="time", sample_size=None, samples=5, seed=None,
+                        workers=None, block_fill=True, cache=None):
+    """ Sampled version of geo_k_medoids for large lists of streets, following the idea of CLARA (Kaufman and
+        Rousseeuw, 1990). The algorithm of Park and Jun runs on several random subsamples, each candidate set of medoids
+        is evaluated against all streets using only the distances to the medoids, and the best set is kept.
+        The requested elements are samples * sample_size * (sample_size - 1) / 2 for the subsamples plus n for every
+        distinct medoid. A medoid found in several subsamples is requested only once, but as the subsamples hardly
+        overlap, this is usually close to samples * k * n. Compared to the n * (n - 1) / 2 elements of the full
+        distance matrix, this pays off for n well above samples * k, but it still grows linearly with n: for
+        n = 10000, k = 10 and 5 samples it is about 500000 elements, which assert_affordable refuses.
+
+    :param api_key:         string of Google Services API key, for being able to use their services
+    :param list_of_streets: list containing strings, which represents the data one wishes to cluster
+    :param k:               integer showing the number of clusters
+    :param metric:          "time" for travel time by car between points and "distance" for travel distance by car
+    :param sample_size:     integer, number of streets per subsample. None for 40 + 2 * k as suggested by CLARA
+    :param samples:         integer, number of subsamples
+    :param seed:            seed of the random number generator drawing the subsamples, for reproducible results
+    :param workers:         integer, number of subsamples processed in parallel. None for all at once
+    :param block_fill:      True, if one request should contain a whole block of pairs
+    :param cache:           instance of DistanceCache, which is asked before any request is sent
+    :return:                list of dictionaries, in which each dictionary represents one cluster as indicated in the
+                            following: {"center": "street1", "members":["street 1", "street 2"]}
+    """
+    sample_size = min(len(list_of_streets), (sample_size if sample_size is not None else 40 + 2 * k))
+    assert_affordable(samples * (sample_size * (sample_size - 1) // 2 + len(list_of_streets) * k))
+    workers = (workers or samples)
+
+    gmaps = GoogleMapsClient(api_key, cache=cache)
+    data = [Address(iid=i, street_name=street) for i, street in enumerate(list_of_streets)]
+
+    rng = np.random.default_rng(seed)
+    list_samples = [np.sort(rng.choice(len(data), size=sample_size, replace=False)) for _ in range(samples)]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        list_medoids = list(executor.map(
+            lambda sample: run_clara_sample(gmaps, data, sample, k, metric=metric, block_fill=block_fill),
+            list_samples))
+
+        # The distances of all streets to each distinct medoid, shared by all samples
+        unique_medoids = np.unique(np.concatenate(list_medoids))
+        step = min(MAX_DESTINATIONS_PER_REQUEST, MAX_ELEMENTS_PER_REQUEST)
+        columns = np.hstack(list(executor.map(
+            lambda start: get_distances(gmaps, data, [data[m] for m in unique_medoids[start:start + step]], metric),
+            range(0, len(unique_medoids), step))))
+
+    candidates = list()
+    for medoids in list_medoids:
+        distances = columns[:, np.searchsorted(unique_medoids, medoids)]
+        candidates.append((distances.min(axis=1).sum(), medoids, distances))
+
+    # The first sample wins in case of equal costs, so results do not depend on the order of completion
+    cost, medoids, distances = min(candidates, key=lambda candidate: candidate[0])
+    labels = np.argmin(distances, axis=1)
+
+    return clusters_to_result(build_clusters(data, labels, medoids))
+
+
+def get_distance_matrix(api_key, data, metric="time", block_fill=False, cache=None, workers=1, queries_per_second=None,
+                        condensed=False, dtype=None, distance_matrix=None, neighbours=None, instrumentation=None,
+                        checkpoint=None, provider=None, lazy=False):
+    """ Returns the distance matrix for the addresses, either the given precalculated one, a sparse one, a lazy one or
+        a full one.
+        See geo_k_medoids for the meaning of the options.
+
+    :param api_key: string of Google Services API key, for being able to use their services
+    :param data:    list of addresses, elements are of type Address
+    :return:        ndarray or CondensedDistanceMatrix containing the distance from each point to each point
+    """
+    dtype = get_distance_dtype(dtype, condensed or lazy)
+    if distance_matrix is None and provider is not None:
+        distance_matrix = provider.get_distance_matrix([address.get_street_name() for address in data])
+        if np.issubdtype(np.dtype(dtype), np.integer) and not np.issubdtype(distance_matrix.dtype, np.integer):
+            distance_matrix = np.rint(distance_matrix)
+
+        if condensed:
+            distance_matrix = CondensedDistanceMatrix.from_dense(distance_matrix, dtype=dtype)
+        else:
+            distance_matrix = distance_matrix.astype(dtype, copy=False)
+
+    elif distance_matrix is None and lazy:
+        gmaps = GoogleMapsClient(api_key, cache=cache, instrumentation=instrumentation)
+        distance_matrix = LazyDistanceMatrix(gmaps, [address.get_street_name() for address in data], metric=metric,
+                                             dtype=dtype, workers=workers, queries_per_second=queries_per_second)
+
+    elif distance_matrix is None and neighbours is not None:
+        assert_affordable(len(data) * neighbours)
+
+        gmaps = GoogleMapsClient(api_key, cache=cache, instrumentation=instrumentation)
+        distance_matrix = build_sparse_distance_matrix(gmaps, data, neighbours, metric=metric, condensed=condensed,
+                                                       dtype=dtype, workers=workers,
+                                                       queries_per_second=queries_per_second)
+
+    elif distance_matrix is None:
+        if checkpoint is not None:
+            checkpoint = FillCheckpoint(checkpoint, [address.get_street_name() for address in data], metric=metric)
+
+        # Only the pairs of the lower triangle are requested, or only the ones missing in the checkpoint
+        assert_affordable(checkpoint.get_amount_missing() if checkpoint is not None
+                          else len(data) * (len(data) - 1) // 2)
+
+        gmaps = GoogleMapsClient(api_key, cache=cache, instrumentation=instrumentation)
+        distance_matrix = build_distance_matrix(gmaps, data, metric=metric, block_fill=block_fill, workers=workers,
+                                                queries_per_second=queries_per_second, condensed=condensed, dtype=dtype,
+                                                checkpoint=checkpoint)
+    else:
+        assert(distance_matrix.shape == (len(data), len(data))), "Distance matrix does not fit the list of streets."
+
+    return distance_matrix
+
+
+def get_warm_start_medoids(api_key, list_of_streets, initial_centers, distance_matrix, v_list, k, metric="time",
+                           cache=None, provider=None, rng=None, weights=None):
+    """ Maps the medoids of a previous run onto the current streets, as initial medoids instead of the ones of STEP 1-3.
+        A center still contained in list_of_streets is used as it is. A center which disappeared is replaced by the
+        nearest street, which is not a medoid yet. Its distances to the streets are requested (or taken from the
+        provider), which costs only n elements per disappeared center. Without an API key and without a provider, the
+        street of smallest v (STEP 1-3) is used instead. If fewer than k centers are given, the remaining medoids are
+        the streets of smallest v, too. Without v (for a LazyDistanceMatrix), these medoids are drawn following
+        k-means++ around the medoids found for the other centers instead, see get_initial_medoids_plus_plus.
+
+    :param api_key:         string of Google Services API key, only needed for disappeared centers
+    :param list_of_streets: list of strings of the current streets, in the order of the distance matrix
+    :param initial_centers: list of strings of the streets of the previous medoids, e.g. the centers of the result of
+                            the previous run
+    :param distance_matrix: distance matrix belonging to list_of_streets
+    :param v_list:          ndarray of v of STEP 1-2 or None, if v has not been calculated
+    :param k:               integer showing the number of clusters
+    :param rng:             instance of np.random.Generator, only needed without v. None for a random seed
+    :param weights:         ndarray of the multiplicity of every point, only used without v. None for all weights
+                            being one
+    :return:                ndarray of indices of the k initial medoids, the i-th one belonging to initial_centers[i]
+    """
+    index = dict()
+    for i, street in enumerate(list_of_streets):
+        index.setdefault(normalise_street_name(street), i)
+
+    initial_centers = list(initial_centers)[:k]
+    vanished = [center for center in initial_centers if normalise_street_name(center) not in index]
+    distances_vanished = None
+    if vanished and (api_key or provider is not None):
+        model = KMedoidsModel(vanished, api_key, metric=metric, cache=cache, provider=provider)
+        distances_vanished = model.get_distances_to_centers(list_of_streets)
+
+    medoids = list()
+    is_medoid = np.zeros(len(list_of_streets), dtype=bool)
+    for center in initial_centers:
+        if normalise_street_name(center) in index:
+            distances = distance_matrix[index[normalise_street_name(center)]].astype(float)
+        elif distances_vanished is not None:
+            distances = distances_vanished[:, vanished.index(center)].astype(float)
+        elif v_list is not None:
+            distances = v_list.astype(float)
+        else:
+            medoids.append(None)
+            continue
+
+        # the street itself, if not a medoid yet, otherwise the nearest street which is not a medoid yet
+        distances[is_medoid] = np.inf
+        medoids.append(int(np.argmin(distances)))
+        is_medoid[medoids[-1]] = True
+
+    if v_list is None:
+        # Without v, the missing medoids follow k-means++ around the medoids found so far
+        known = [medoid for medoid in medoids if medoid is not None]
+        rng = (rng if rng is not None else np.random.default_rng())
+        drawn = iter(get_initial_medoids_plus_plus(distance_matrix, k, rng, weights, known)[len(known):].tolist())
+        medoids = [(next(drawn) if medoid is None else medoid) for medoid in medoids] + list(drawn)
+    else:
+        for i in v_list.argsort():
+            if len(medoids) >= k:
+                break
+            if not is_medoid[i]:
+                medoids.append(int(i))
+                is_medoid[i] = True
+
+    return np.array(medoids)
+
+
+def clusters_to_result(list_clusters):
+    """ Converts clusters into the result format of geo_k_medoids.
+
+    :param list_clusters:   list of clusters, elements are of type Cluster
+    :return:                list of dictionaries, in which each dictionary represents one cluster as indicated in the
+                            following: {"center": "street1", "members":["street 1", "street 2"]}
+    """
+    result = list()
+    for cluster in list_clusters:
+        result.append({"center":cluster.get_center().get_street_name(),
+                       "members":[street.get_street_name() for street in cluster.get_member()]})
+
+    return result
+
+
+def geo_k_medoids_sweep(api_key, list_of_streets, list_of_k, metric="time", method="park_jun", processes=None,
+                        deduplicate=False, n_init=1, seed=None, **kwargs):
+    """ Runs geo_k_medoids for several numbers of clusters, e.g. for finding the elbow of the cost curve. The distance
+        matrix and v (STEP 1-1 and 1-2) are calculated only once. Every start of every k runs in its own process, all
+        processes share one copy of the distance matrix in shared memory instead of receiving a pickled copy each.
+
+    :param api_key:         string of Google Services API key, for being able to use their services
+    :param list_of_streets: list containing strings, which represents the data one wishes to cluster
+    :param list_of_k:       iterable of integers, numbers of clusters to try
+    :param metric:          "time" for travel time by car between points and "distance" for travel distance by car
+    :param method:          "park_jun" or "fasterpam", see geo_k_medoids
+    :param processes:       integer, number of worker processes. None for the number of processors
+    :param deduplicate:     True, if identical streets should be requested and clustered only once, see geo_k_medoids
+    :param n_init:          integer, number of starts per k, see geo_k_medoids
+    :param seed:            seed of the random number generator for the additional starts, see geo_k_medoids
+    :param kwargs:          further keyword arguments of geo_k_medoids for obtaining the distance matrix, i.e.
+                            block_fill, cache, workers, queries_per_second, condensed, dtype, distance_matrix,
+                            neighbours, instrumentation, checkpoint or provider
+    :return:                dictionary, where the key is k and the value is a dictionary {"cost": total cost,
+                            "clusters": result of geo_k_medoids for this k}
+    """
+    assert(not kwargs.get("lazy")), "A lazy distance matrix cannot be shared between processes."
+    data = [Address(iid=i, street_name=street) for i, street in enumerate(list_of_streets)]
+
+    if deduplicate:
+        first_indices, inverse, weights = deduplicate_streets(list_of_streets)
+        unique_data = [Address(iid=j, street_name=list_of_streets[i]) for j, i in enumerate(first_indices)]
+        if kwargs.get("distance_matrix") is not None:
+            kwargs["distance_matrix"] = kwargs["distance_matrix"][np.ix_(first_indices, first_indices)]
+    else:
+        first_indices = inverse = np.arange(len(data))
+        unique_data, weights = data, None
+
+    # STEP 1-1 and 1-2, shared by all k
+    distance_matrix = get_distance_matrix(api_key, unique_data, metric=metric, **kwargs)
+    order = calculate_v_vector(distance_matrix, weights=weights).argsort()
+
+    # The same starts as in geo_k_medoids, each k with its own random number generator
+    starts = dict()
+    for k in list_of_k:
+        rng = np.random.default_rng(seed)
+        starts[k] = [order[:k]] + [get_initial_medoids_plus_plus(distance_matrix, k, rng, weights)
+                                   for _ in range(n_init - 1)]
+
+    shared, description = share_distance_matrix(distance_matrix)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = {k: [executor.submit(optimise_shared_medoids, description, initial_medoids, method, weights)
+                           for initial_medoids in list_initial_medoids]
+                       for k, list_initial_medoids in starts.items()}
+
+            # In case of equal costs, the earlier start wins
+            results = {k: min([future.result() for future in list_futures], key=lambda result: result[2])
+                       for k, list_futures in futures.items()}
+    finally:
+        shared.close()
+        shared.unlink()
+
+    sweep = dict()
+    for k, (labels, medoids, cost) in results.items():
+        sweep[k] = {"cost": cost,
+                    "clusters": clusters_to_result(build_clusters(data, labels[inverse], first_indices[medoids]))}
+
+    return sweep
+
+
+def geo_k_medoids(api_key, list_of_streets, k, metric="time", block_fill=False, cache=None, workers=1,
+                  queries_per_second=None, condensed=False, dtype=None, distance_matrix=None, neighbours=None,
+                  method="park_jun", n_init=1, seed=None, processes=None, deduplicate=False, instrumentation=None,
+                  checkpoint=None, provider=None, initial_centers=None, lazy=False):
     """ This function clusters a given list of streets (or coordinates) using the k-medoids algorithm described in:
         Hae-Sang Park and Chi-Hyuck Jun, 2009, A simple and fast algorithm for K-medoids clustering, in
         Expert Syst. Appl. 36. 3336-3341.
@@ -213,70 +2863,185 @@ def geo_k_medoids(api_key, list_of_streets, k, metric="time"):
     :param k:               integer showing the number of clusters
     :param metric:          "time" for travel time by car between points and "distance" for travel distance by car
                             Nb. If one wishes, the car feature can be changed by looking into class GoogleMapsClient
+    :param block_fill:      True, if the distance matrix should be filled with one request per block of up to
+                            MAX_ELEMENTS_PER_REQUEST pairs instead of one request per pair. The result is the same.
+    :param cache:           instance of DistanceCache. Only pairs of streets not found in the cache are requested
+    :param workers:         integer, number of requests in flight while filling the distance matrix. If larger than
+                            one, transient errors are retried with exponential backoff
+    :param queries_per_second: quota of the Distance Matrix API, which is not going to be exceeded. None for no limit
+    :param condensed:       True, if only the upper triangle of the distance matrix should be stored, see
+                            CondensedDistanceMatrix
+    :param dtype:           numpy dtype of the distance matrix, e.g. np.uint16, np.uint32 or np.float32 to save memory.
+                            None for np.uint32 with condensed (4 times less memory than a dense matrix of int) and
+                            int otherwise, see get_distance_dtype
+    :param distance_matrix: precalculated distance matrix belonging to list_of_streets, e.g. from
+                            update_distance_matrix. If given, no requests are sent at all
+    :param neighbours:      integer or None. If given, only the distances from each street to its nearest neighbours
+                            (by straight line) are requested, all others are estimated. See
+                            build_sparse_distance_matrix
+    :param method:          "park_jun" for the alternating algorithm of Park and Jun, "fasterpam" for optimising the
+                            initial medoids of Park and Jun by eager swaps, see run_fasterpam. Both reach local optima
+                            of different neighbourhoods, neither one always ends at the lower cost
+    :param n_init:          integer, number of starts. The first one uses the initial medoids of Park and Jun, all
+                            further ones random initial medoids following k-means++. The clustering of lowest cost is
+                            returned
+    :param seed:            seed of the random number generator for the additional starts, for reproducible results
+    :param processes:       integer, number of processes running the starts in parallel. None for the number of
+                            processors
+    :param deduplicate:     True, if identical streets (see normalise_street_name) should be requested and clustered
+                            only once, weighted by their number of occurrences. Every occurrence is still listed in the
+                            members of its cluster. A given distance_matrix still belongs to list_of_streets
+    :param instrumentation: instance of Instrumentation, which measures the phases, counts the requests and reports
+                            every iteration. None for no instrumentation
+    :param checkpoint:      string of path of a checkpoint file (see FillCheckpoint). The distances requested so far
+                            are saved in it regularly, and if the file exists, only the pairs missing in it are
+                            requested. None for no checkpoint
+    :param provider:        instance of DistanceProvider, e.g. PrecomputedDistanceProvider,
+                            StraightLineDistanceProvider or RoadGraphDistanceProvider, which provides the distance
+                            matrix instead of Google's Distance Matrix API. None for Google
+    :param initial_centers: list of strings of the centers of a previous run, e.g. [cluster["center"] for cluster in
+                            previous_result]. The first start begins at these medoids instead of the ones of STEP 1-3,
+                            see get_warm_start_medoids, and the i-th cluster of the result belongs to the i-th center.
+                            For nearly unchanged streets, the loop converges within one or two iterations and the
+                            clusters stay stable from run to run. None for STEP 1-3
+    :param lazy:            True, if distances should only be requested when the clustering reads them, see
+                            LazyDistanceMatrix and assign_labels_pruned. As v of STEP 1-2 needs every distance, all
+                            starts begin at random initial medoids following k-means++ (or at initial_centers), so
+                            the result differs from the one of a full distance matrix. The paid elements grow with
+                            about n * k for the assignments plus the squared sizes of the clusters for their medoids.
+                            Only works with method "park_jun", as every swap candidate of FasterPAM reads a whole row,
+                            which ends up requesting every pair anyway
     :return:                list of dictionaries, in which each dictionary represents one cluster as indicated in the
                             following: {"center": "street1", "members":["street 1", "street 2"]}
     """
 
-    assert(len(list_of_streets)<500),"By proceeding, high costs will encounter! " \
-                                     "The account belonging to passed API key will be charged with at least {} EUR! " \
-                                     "Delete this assertion, only if you know what you are doing! "\
-                                    .format(str(0.0025*len(list_of_streets)**2 + 0.0025*len(list_of_streets)))
+    assert(not (lazy and method == "fasterpam")), "FasterPAM reads every distance, use method 'park_jun' with lazy."
 
     # Initialisation
-    gmaps = GoogleMapsClient(api_key)
-
     init_street = Address(iid=-1, street_name='init')
     init = Cluster(center=init_street) # cluster to which all addresses will be initialised
 
-    distance_matrix = np.zeros((len(list_of_streets), len(list_of_streets)), dtype=int)
-
     data = list()
     for i, street in enumerate(list_of_streets):
         data.append(Address(iid=i, street_name=street, cluster=init))
 
-    # Filling entries of distance matrix
-    for column in range(len(data)):
-        for row in range(column):
-            distance_matrix[column, row] = gmaps.distance_between_streets(street_one=data[column].get_street_name(),
-                                                                          street_two=data[row].get_street_name(),
-                                                                          metric=metric)
-
-    distance_matrix = symmetrise(distance_matrix)
-
-    # STEP 1-2
-    for i in range(len(data)):
-        data[i].set_v(calculate_v(i, distance_matrix))
-
-    v_list = np.array([data[i].get_v() for i in range(len(data))])
+    if deduplicate:
+        first_indices, inverse, weights = deduplicate_streets(list_of_streets)
+        unique_data = [Address(iid=j, street_name=list_of_streets[i], cluster=init)
+                       for j, i in enumerate(first_indices)]
+        if distance_matrix is not None:
+            distance_matrix = distance_matrix[np.ix_(first_indices, first_indices)]
+    else:
+        first_indices = inverse = np.arange(len(data))
+        unique_data, weights = data, None
+
+    with measure_phase(instrumentation, "distance_matrix"):
+        distance_matrix = get_distance_matrix(api_key, unique_data, metric=metric, block_fill=block_fill, cache=cache,
+                                              workers=workers, queries_per_second=queries_per_second,
+                                              condensed=condensed, dtype=dtype, distance_matrix=distance_matrix,
+                                              neighbours=neighbours, instrumentation=instrumentation,
+                                              checkpoint=checkpoint, provider=provider, lazy=lazy)
+
+    # STEP 1-2, which would read every distance of a lazy distance matrix
+    if isinstance(distance_matrix, LazyDistanceMatrix):
+        v_list = None
+    else:
+        with measure_phase(instrumentation, "v"):
+            v_list = calculate_v_vector(distance_matrix, weights=weights)
+
+        for i in range(len(data)):
+            data[i].set_v(v_list[inverse[i]])
 
     # STEP 1-3
-    indices_initial_mediods = v_list.argsort()[:k]
-
-    list_clusters = list()
-    for index in indices_initial_mediods:
-        list_clusters.append(Cluster(center=data[index]))
-
-    # STEP 1-4
-    assign_street_cluster(streets=data, list_clusters=list_clusters, distance_matrix=distance_matrix)
-
-    # STEP 1-5
-    cost = calculate_cost(data, distance_matrix)
-    
-    # STEP 2 and 3
-    while True:
-        for cluster in list_clusters:
-            cluster.set_minimising_center(distance_matrix)
-
-        assign_street_cluster(streets=data, list_clusters=list_clusters, distance_matrix=distance_matrix)
+    rng = np.random.default_rng(seed)
+    if initial_centers is not None:
+        streets = [address.get_street_name() for address in unique_data]
+        indices_initial_mediods = get_warm_start_medoids(api_key, streets, initial_centers, distance_matrix, v_list, k,
+                                                         metric=metric, cache=cache, provider=provider, rng=rng,
+                                                         weights=weights)
+    elif v_list is None:
+        indices_initial_mediods = get_initial_medoids_plus_plus(distance_matrix, k, rng, weights)
+    else:
+        indices_initial_mediods = v_list.argsort()[:k]
+
+    list_initial_medoids = [indices_initial_mediods] + [get_initial_medoids_plus_plus(distance_matrix, k, rng, weights)
+                                                        for _ in range(n_init - 1)]
+
+    # STEP 1-4 till STEP 3
+    with measure_phase(instrumentation, "clustering"):
+        labels, medoids, cost = optimise_multi_start(distance_matrix, list_initial_medoids, method, processes, weights,
+                                                     instrumentation)
+
+    if instrumentation is not None:
+        instrumentation.report()
+
+    # Every occurrence of a street belongs to the cluster of the street, the first occurrence of a medoid is the center
+    list_clusters = build_clusters(data, labels[inverse], first_indices[medoids])
+
+    return clusters_to_result(list_clusters)
+
+
+def geo_k_medoids_regions(api_key, list_of_streets, k, regions=None, metric="time", coordinates=None,
+                          allocation="size", seed=None, processes=None, max_region_size=MAX_REGION_SIZE, **kwargs):
+    """ Two-level version of geo_k_medoids for city-wide or country-wide lists of streets. The streets are partitioned
+        into coarse geographic regions by their coordinates first (see partition_coordinates), the k clusters are
+        distributed among the regions (see distribute_clusters), and geo_k_medoids runs within each region. Only the
+        distance matrices within the regions are built, so the requested elements and the memory drop from O(n^2) to
+        O(sum of n_i^2) for regions of n_i streets. Streets of different regions never share a cluster. No region has
+        more than max_region_size streets, regions exceeding it are split further, so k has to be at least the number
+        of regions this leads to.
 
-        if calculate_cost(data, distance_matrix) >= cost:
-            break
-
-        cost = calculate_cost(data, distance_matrix)
-
-    result = list()
-    for cluster in list_clusters:
-        result.append({"center":cluster.get_center().get_street_name(),
-                       "members":[street.get_street_name() for street in cluster.get_member()]})
-
-    return result
+    :param api_key:         string of Google Services API key, for being able to use their services
+    :param list_of_streets: list containing strings, which represents the data one wishes to cluster
+    :param k:               integer showing the total number of clusters
+    :param regions:         integer, number of regions to start with. None for regions of about max_region_size
+                            streets
+    :param metric:          "time" for travel time by car between points and "distance" for travel distance by car
+    :param coordinates:     dictionary of street to its coordinates (latitude, longitude). Streets missing in it are
+                            geocoded. None for geocoding all streets
+    :param allocation:      "size" for distributing the clusters in proportion to the number of streets of a region,
+                            "spread" for distributing them in proportion to the sum of straight line distances from
+                            the streets of a region to its mean, i.e. the cost of a region with a single cluster
+    :param seed:            seed of the random number generator of the partition
+    :param processes:       integer, number of processes running the regions in parallel. None for the number of
+                            processors, 1 for running them one after another in this process, which is needed for
+                            keyword arguments that cannot be pickled, e.g. a DistanceCache or an Instrumentation
+    :param max_region_size: integer, maximal number of streets of a region. None for no limit
+    :param kwargs:          further keyword arguments of geo_k_medoids, used within every region, e.g. block_fill,
+                            workers, method or provider
+    :return:                list of dictionaries, in which each dictionary represents one cluster as indicated in the
+                            following: {"center": "street1", "members":["street 1", "street 2"]}. The clusters of
+                            the first region come first
+    """
+    assert(allocation in ("size", "spread")), "Allocation has to be 'size' or 'spread'."
+    if regions is None:
+        regions = (-(-len(list_of_streets) // max_region_size) if max_region_size is not None else 1)
+    regions = min(regions, k)
+
+    gmaps = (GoogleMapsClient(api_key, cache=kwargs.get("cache")) if api_key else None)
+    points = get_coordinates(list_of_streets, (coordinates or dict()), gmaps)
+    labels = partition_coordinates(points, regions, seed=seed, max_size=max_region_size)
+
+    regions = labels.max() + 1
+    assert(regions <= k), "Regions of at most {} streets need at least {} clusters, raise k or max_region_size."\
+        .format(max_region_size, regions)
+
+    members = [np.flatnonzero(labels == region) for region in range(regions)]
+    sizes = np.array([len(indices) for indices in members])
+    if allocation == "spread":
+        shares = np.array([haversine(points[indices], points[indices].mean(axis=0)).sum() for indices in members])
+    else:
+        shares = sizes
+    counts = distribute_clusters(sizes, k, shares)
+
+    list_of_arguments = [([list_of_streets[i] for i in indices], int(count)) for indices, count in zip(members, counts)]
+    if processes == 1:
+        results = [geo_k_medoids(api_key, streets, count, metric=metric, **kwargs)
+                   for streets, count in list_of_arguments]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(geo_k_medoids, api_key, streets, count, metric=metric, **kwargs)
+                       for streets, count in list_of_arguments]
+            results = [future.result() for future in futures]
+
+    return [cluster for result in results for cluster in result]
@@ -1,14 +1,256 @@
+import os
+import abc
+import copy
+import time
 import string
+import sqlite3
+import threading
+import concurrent.futures
 import googlemaps
+import numpy as np
 
 import util as u
 
 
+class DistanceCache:
+
+    def __init__(self, path="distance_cache.sqlite", ttl=None, max_entries=None, symmetric=True):
+        """ Persistent cache for distances obtained by the Distance Matrix API, saved in a SQLite database. Entries are
+            keyed by the normalised origin, normalised destination, metric and means of travel.
+
+        :param path:        string of path of the SQLite file, it is created if it does not exist yet
+        :param ttl:         time to live of an entry in seconds. Older entries are treated as missing. None for no expiry
+        :param max_entries: maximal number of entries. If exceeded, the least recently used entries are deleted. None
+                            for no limit
+        :param symmetric:   True, if the distance from a to b may be used for the distance from b to a. The clustering
+                            symmetrises the distance matrix anyway
+        """
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._symmetric = symmetric
+        self._hits = 0
+        self._misses = 0
+        self._last_used = dict()
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS distances (origin TEXT, destination TEXT, metric TEXT, "
+                                 "mode TEXT, value INTEGER, created REAL, last_used REAL, "
+                                 "PRIMARY KEY (origin, destination, metric, mode))")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS distances_last_used ON distances (last_used)")
+        self._connection.commit()
+        self._entries = self._connection.execute("SELECT COUNT(*) FROM distances").fetchone()[0]
+
+    def _key(self, origin, destination, metric, mode):
+        origin = u.normalise_street_name(origin)
+        destination = u.normalise_street_name(destination)
+        if self._symmetric and destination < origin:
+            origin, destination = destination, origin
+        return origin, destination, metric, mode
+
+    def get(self, origin, destination, metric, mode="driving"):
+        """ Returns the cached distance from origin to destination or None, if it is not cached or expired.
+
+        :param origin:      string of street, the travel starts at
+        :param destination: string of street, the travel ends at
+        :param metric:      "time" or "distance"
+        :param mode:        means of travel as understood by the Distance Matrix API, e.g. "driving"
+        :return:            cached distance or None
+        """
+        key = self._key(origin, destination, metric, mode)
+        now = time.time()
+
+        with self._lock:
+            row = self._connection.execute("SELECT value, created FROM distances WHERE origin=? AND destination=? "
+                                           "AND metric=? AND mode=?", key).fetchone()
+
+            # Expired entries are overwritten as soon as the distance has been requested again
+            if row is None or (self._ttl is not None and now - row[1] > self._ttl):
+                self._misses += 1
+                return None
+
+            # Writing the time of usage is postponed to the next commit, so reading stays cheap
+            self._last_used[key] = now
+            self._hits += 1
+            return row[0]
+
+    def set(self, origin, destination, metric, value, mode="driving"):
+        """ Saves the distance from origin to destination. Least recently used entries are evicted, if the cache
+            exceeds max_entries.
+
+        :param origin:      string of street, the travel starts at
+        :param destination: string of street, the travel ends at
+        :param metric:      "time" or "distance"
+        :param value:       distance returned by the Distance Matrix API
+        :param mode:        means of travel as understood by the Distance Matrix API, e.g. "driving"
+        """
+        self.set_many([(origin, destination, value)], metric, mode)
+
+    def set_many(self, entries, metric, mode="driving"):
+        """ Same as set, but for a list of (origin, destination, value) tuples in one single transaction.
+
+        :param entries: list of tuples (origin, destination, value)
+        :param metric:  "time" or "distance"
+        :param mode:    means of travel as understood by the Distance Matrix API, e.g. "driving"
+        """
+        now = time.time()
+
+        with self._lock:
+            self._write_last_used()
+
+            for origin, destination, value in entries:
+                key = self._key(origin, destination, metric, mode)
+                cursor = self._connection.execute("UPDATE distances SET value=?, created=?, last_used=? WHERE origin=? "
+                                                  "AND destination=? AND metric=? AND mode=?",
+                                                  (int(value), now, now) + key)
+                if cursor.rowcount == 0:
+                    self._connection.execute("INSERT INTO distances VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                             key + (int(value), now, now))
+                    self._entries += 1
+
+            if self._max_entries is not None and self._entries > self._max_entries:
+                self._connection.execute("DELETE FROM distances WHERE rowid IN (SELECT rowid FROM distances "
+                                         "ORDER BY last_used LIMIT ?)", (self._entries - self._max_entries,))
+                self._entries = self._max_entries
+
+            self._connection.commit()
+
+    def _write_last_used(self):
+        self._connection.executemany("UPDATE distances SET last_used=? WHERE origin=? AND destination=? AND metric=? "
+                                     "AND mode=?", [(now,) + key for key, now in self._last_used.items()])
+        self._last_used.clear()
+
+    def get_hits(self):
+        return self._hits
+
+    def get_misses(self):
+        return self._misses
+
+    def get_statistics(self):
+        """ Returns the hit and miss counters of this cache together with the money saved by the hits.
+
+        :return:    dictionary with keys "hits", "misses", "hit_rate", "entries" and "saved_eur"
+        """
+        lookups = self._hits + self._misses
+        return {"hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": (self._hits / lookups if lookups else 0.0),
+                "entries": self._entries,
+                "saved_eur": round(self._hits * u.COST_PER_ELEMENT, 2)}
+
+    def close(self):
+        with self._lock:
+            self._write_last_used()
+            self._connection.commit()
+            self._connection.close()
+
+
+class GeocodeCache:
+
+    def __init__(self, path="geocode_cache.sqlite", ttl=None):
+        """ Persistent cache for coordinates obtained by the Geocoding API, saved in a SQLite database. Entries are
+            keyed by the normalised street name.
+
+        :param path:    string of path of the SQLite file, it is created if it does not exist yet
+        :param ttl:     time to live of an entry in seconds. Older entries are treated as missing. None for no expiry
+        """
+        self._ttl = ttl
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS geocodes (street_name TEXT PRIMARY KEY, coordinates TEXT, "
+                                 "created REAL)")
+        self._connection.commit()
+
+    def get(self, street_name):
+        """ Returns the cached coordinates of the street or None, if they are not cached or expired.
+
+        :param street_name: string of street name
+        :return:            string of latitude and longitude or None
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT coordinates, created FROM geocodes WHERE street_name=?",
+                                           (u.normalise_street_name(street_name),)).fetchone()
+
+            if row is None or (self._ttl is not None and time.time() - row[1] > self._ttl):
+                self._misses += 1
+                return None
+
+            self._hits += 1
+            return row[0]
+
+    def set_many(self, entries):
+        """ Saves a list of (street_name, coordinates) tuples in one single transaction.
+
+        :param entries: list of tuples (street_name, coordinates)
+        """
+        now = time.time()
+
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?)",
+                                         [(u.normalise_street_name(street_name), coordinates, now)
+                                          for street_name, coordinates in entries])
+            self._connection.commit()
+
+    def get_statistics(self):
+        """ Returns the hit and miss counters of this cache.
+
+        :return:    dictionary with keys "hits" and "misses"
+        """
+        return {"hits": self._hits, "misses": self._misses}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity=None):
+        """ Thread safe rate limiter following the token bucket scheme. On average, acquire returns rate times per
+            second, short bursts of up to capacity calls are allowed.
+
+        :param rate:        float, number of tokens added per second, e.g. the queries per second quota of the API
+        :param capacity:    maximal number of tokens in the bucket, defaults to one second worth of tokens
+        """
+        self._rate = rate
+        self._capacity = (capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self._capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Blocks until a token is available and takes it.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._last_refill) * self._rate)
+                self._last_refill = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                waiting_time = (1 - self._tokens) / self._rate
+
+            time.sleep(waiting_time)
+
+
 class GoogleMapsClient:
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache=None, mode="driving", geocode_cache=None):
+        """
+        :param api_key:         string of Google Services API key
+        :param cache:           instance of DistanceCache, which is asked before any request is sent. None for no cache
+        :param mode:            means of travel, see the mode parameter of the Distance Matrix API
+        :param geocode_cache:   instance of GeocodeCache, which is asked before any address is geocoded
+        """
         self.__api_key = api_key
         self.__gmaps_client = googlemaps.Client(key = api_key)
+        self.__cache = cache
+        self.__mode = mode
+        self.__geocode_cache = geocode_cache
 
     def distance_between_streets(self, street_one, street_two):
         """ This function uses the Google Distance Matrix API for its queries. In this context, distance means the time
@@ -22,7 +264,53 @@ class GoogleMapsClient:
         :param street_two:  string of street name of coordinates of second street
         :return:            distance between two given streets, note the different meaning of distance here!
         """
-        return self.__gmaps_client.distance_matrix(street_one, street_two)['rows'][0]['elements'][0]['duration']['value']
+        if self.__cache is not None:
+            value = self.__cache.get(street_one, street_two, "time", self.__mode)
+            if value is not None:
+                return value
+
+        value = self.__gmaps_client.distance_matrix(street_one, street_two,
+                                                    mode=self.__mode)['rows'][0]['elements'][0]['duration']['value']
+
+        if self.__cache is not None:
+            self.__cache.set(street_one, street_two, "time", value, self.__mode)
+
+        return value
+
+    def distances_between_streets(self, origins, destinations):
+        """ Same as distance_between_streets, but for several origins and destinations in one single request. The
+            number of origins and destinations has to stay within the limits of one request, see u.MAX_ORIGINS,
+            u.MAX_DESTINATIONS and u.MAX_ELEMENTS.
+
+        :param origins:         list of strings of street names or coordinates, where the travel starts
+        :param destinations:    list of strings of street names or coordinates, where the travel ends
+        :return:                list of lists, where entry [i][j] is the distance from origins[i] to destinations[j]
+        """
+        result = [[None] * len(destinations) for _ in origins]
+
+        if self.__cache is not None:
+            for i, origin in enumerate(origins):
+                for j, destination in enumerate(destinations):
+                    result[i][j] = self.__cache.get(origin, destination, "time", self.__mode)
+
+        # Only origins and destinations with at least one missing pair are requested
+        missing_origins = [i for i in range(len(origins)) if None in result[i]]
+        missing_destinations = [j for j in range(len(destinations)) if any(result[i][j] is None for i in missing_origins)]
+
+        if missing_origins:
+            rows = self.__gmaps_client.distance_matrix([origins[i] for i in missing_origins],
+                                                       [destinations[j] for j in missing_destinations],
+                                                       mode=self.__mode)['rows']
+            new_entries = list()
+            for i, row in zip(missing_origins, rows):
+                for j, element in zip(missing_destinations, row['elements']):
+                    result[i][j] = element['duration']['value']
+                    new_entries.append((origins[i], destinations[j], result[i][j]))
+
+            if self.__cache is not None:
+                self.__cache.set_many(new_entries, "time", self.__mode)
+
+        return result
 
     def address_to_coordinates(self, street_name):
         """ Since the Google Maps' Static Map API does not allow more then fifteen human readable addresses in their
@@ -31,14 +319,49 @@ class GoogleMapsClient:
         :param street_name: string of street name the coordinates are asked for
         :return:            string of latitude and longitude of street name using Google Maps Geocode API
         """
-        coordinates_dict = self.__gmaps_client.geocode(street_name)[0]["geometry"]["location"]
-        return "{},{}".format(coordinates_dict["lat"], coordinates_dict["lng"])
+        return self.addresses_to_coordinates([street_name], workers=1)[0]
+
+    def addresses_to_coordinates(self, street_names, workers=8, limiter=None):
+        """ Converts many addresses into coordinates at once. Identical addresses (after normalisation) are geocoded
+            only once, addresses found in the geocode cache not at all. The remaining ones are requested by a pool of
+            workers.
+
+        :param street_names:    list of strings of street names the coordinates are asked for
+        :param workers:         integer, maximal number of requests in flight
+        :param limiter:         instance of TokenBucket, which keeps the requests within the quota of the API
+        :return:                list of strings of latitude and longitude, one for each entry of street_names
+        """
+        unique_streets = dict()
+        for street_name in street_names:
+            unique_streets.setdefault(u.normalise_street_name(street_name), street_name)
+
+        coordinates = dict()
+        if self.__geocode_cache is not None:
+            for key, street_name in unique_streets.items():
+                coordinates[key] = self.__geocode_cache.get(street_name)
+
+        missing = [key for key in unique_streets if coordinates.get(key) is None]
+
+        def geocode(key):
+            location = u.request_with_retry(lambda: self.__gmaps_client.geocode(unique_streets[key]),
+                                            limiter)[0]["geometry"]["location"]
+            return "{},{}".format(location["lat"], location["lng"])
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for key, value in zip(missing, executor.map(geocode, missing)):
+                coordinates[key] = value
+
+        if self.__geocode_cache is not None and missing:
+            self.__geocode_cache.set_many([(unique_streets[key], coordinates[key]) for key in missing])
+
+        return [coordinates[u.normalise_street_name(street_name)] for street_name in street_names]
 
     def plot_history(self, history_dict):
         """ This function takes a history dictionary, in which the key is the time step and the value is the list of
             clusters at that time step. It then returns a list of URLs for each time step.
 
-        :param history_dict:    dictionary where key is time step and value is list of clusters at that time step
+        :param history_dict:    dictionary where key is time step and value is list of clusters at that time step, or
+                                an instance of ClusteringHistory
         :return:                list of valid URLs for Google's Static Maps API
         """
 
@@ -68,7 +391,8 @@ class GoogleMapsClient:
         """ This function plots all streets but does not plot any cluster information. This is basically the initial
             state.
 
-        :param history_dict:    dictionary where key is time step and value is list of clusters at that time step
+        :param history_dict:    dictionary where key is time step and value is list of clusters at that time step, or
+                                an instance of ClusteringHistory
         :return:                URL for Google's Static Map API with all points on that map
         """
 
@@ -85,6 +409,212 @@ class GoogleMapsClient:
         return marker_string
 
 
+class DistanceProvider(abc.ABC):
+    """ Source of the distance matrix of geo_k_medoids other than Google's Distance Matrix API. A provider only has to
+        implement get_distance_matrix, a provider without it cannot be instantiated.
+    """
+
+    @abc.abstractmethod
+    def get_distance_matrix(self, list_of_streets):
+        """
+        :param list_of_streets: list of strings of streets
+        :return:                symmetric ndarray containing the distance from each street to each street
+        """
+
+
+class PrecomputedDistanceProvider(DistanceProvider):
+
+    def __init__(self, distance_matrix, list_of_streets):
+        """ Provides distances from a distance matrix calculated before, e.g. one of the demo datasets. Any subset of
+            its streets in any order can be asked for, streets are compared by normalise_street_name.
+
+        :param distance_matrix: ndarray or CondensedDistanceMatrix belonging to list_of_streets
+        :param list_of_streets: list of strings of streets
+        """
+        assert(distance_matrix.shape == (len(list_of_streets), len(list_of_streets))), "Distance matrix does not fit " \
+                                                                                       "the list of streets."
+        self._distance_matrix = distance_matrix
+        self._index = {u.normalise_street_name(street): i for i, street in enumerate(list_of_streets)}
+
+    def get_distance_matrix(self, list_of_streets):
+        indices = list()
+        for street in list_of_streets:
+            assert(u.normalise_street_name(street) in self._index), "Street {} is not part of the precomputed " \
+                                                                    "distance matrix.".format(street)
+            indices.append(self._index[u.normalise_street_name(street)])
+
+        return np.asarray(self._distance_matrix[np.ix_(indices, indices)])
+
+
+class StraightLineDistanceProvider(DistanceProvider):
+
+    def __init__(self, coordinates=None, gmaps=None, factor=1.0, euclidean=False):
+        """ Provides straight line distances between the coordinates of the streets, optionally multiplied by a factor,
+            e.g. a detour factor or the inverse of a speed for travel times. Costs nothing, but ignores the road
+            network.
+
+        :param coordinates: dictionary of street to its coordinates, either (latitude, longitude) in degrees or, with
+                            euclidean, (x, y) in meters. Streets missing in it are geocoded with gmaps
+        :param gmaps:       instance of GoogleMapsClient used for geocoding. None, if all coordinates are given
+        :param factor:      float, all distances in meters are multiplied by it
+        :param euclidean:   True for planar coordinates, False for latitudes and longitudes (haversine)
+        """
+        self._coordinates = (coordinates if coordinates is not None else dict())
+        self._gmaps = gmaps
+        self._factor = factor
+        self._euclidean = euclidean
+
+    def get_distance_matrix(self, list_of_streets, rows_at_once=1024):
+        coordinates = u.get_coordinates(list_of_streets, self._coordinates, self._gmaps)
+        distance_matrix = np.zeros((len(coordinates), len(coordinates)))
+
+        for start in range(0, len(coordinates), rows_at_once):
+            rows, columns = coordinates[start:start + rows_at_once, None, :], coordinates[None, :, :]
+            if self._euclidean:
+                distance_matrix[start:start + rows_at_once] = np.sqrt(((rows - columns) ** 2).sum(axis=2))
+            else:
+                distance_matrix[start:start + rows_at_once] = u.haversine(rows, columns)
+
+        return self._factor * distance_matrix
+
+
+class RoadGraph:
+
+    def __init__(self, coordinates, sources, targets, weights, directed=True):
+        """ Road network for calculating travel times offline. The edges are stored in compressed sparse row format,
+            such that the edges leaving node i are edges indptr[i] till indptr[i + 1].
+
+        :param coordinates: ndarray of shape (nodes, 2) of latitudes and longitudes in degrees
+        :param sources:     ndarray of indices of the nodes the edges start at
+        :param targets:     ndarray of indices of the nodes the edges end at
+        :param weights:     ndarray of non negative weights of the edges, e.g. travel times in seconds
+        :param directed:    False, if every edge can be used in both directions
+        """
+        self._coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+        self._directed = directed
+
+        sources, targets, weights = np.asarray(sources), np.asarray(targets), np.asarray(weights, dtype=float)
+        assert(len(sources) == len(targets) == len(weights)), "Every edge needs a source, a target and a weight."
+        assert(np.all(weights >= 0)), "Dijkstra's algorithm needs non negative weights."
+        self._edges = (sources, targets, weights)
+
+        if not directed:
+            sources, targets, weights = np.concatenate([sources, targets]), np.concatenate([targets, sources]), \
+                                        np.concatenate([weights, weights])
+
+        order = np.argsort(sources, kind="stable")
+        self._indptr = np.searchsorted(sources[order], np.arange(len(self._coordinates) + 1))
+        self._indices = targets[order]
+        self._weights = weights[order]
+
+    @staticmethod
+    def load(path):
+        """ Opens a road graph saved by RoadGraph.save.
+
+        :param path:    string of path of .npz file
+        :return:        instance of RoadGraph
+        """
+        with np.load(path, allow_pickle=False) as graph:
+            return RoadGraph(graph["coordinates"], graph["sources"], graph["targets"], graph["weights"],
+                             bool(graph["directed"]))
+
+    @staticmethod
+    def from_csv(nodes_path, edges_path, directed=True):
+        """ Reads a road graph exported to two CSV files with one header line each, e.g. from OpenStreetMap.
+
+        :param nodes_path:  string of path of the nodes, with columns id, latitude and longitude
+        :param edges_path:  string of path of the edges, with columns id of source, id of target and travel time
+        :param directed:    False, if every edge can be used in both directions
+        :return:            instance of RoadGraph
+        """
+        nodes = np.loadtxt(nodes_path, delimiter=",", skiprows=1, ndmin=2)
+        edges = np.loadtxt(edges_path, delimiter=",", skiprows=1, ndmin=2)
+
+        order = np.argsort(nodes[:, 0])
+        node_ids = nodes[order, 0]
+        sources, targets = np.searchsorted(node_ids, edges[:, 0]), np.searchsorted(node_ids, edges[:, 1])
+        assert(np.all(node_ids[np.minimum(sources, len(node_ids) - 1)] == edges[:, 0])
+               and np.all(node_ids[np.minimum(targets, len(node_ids) - 1)] == edges[:, 1])), \
+            "Edges refer to unknown nodes."
+
+        return RoadGraph(nodes[order, 1:3], sources, targets, edges[:, 2], directed)
+
+    def save(self, path):
+        with open(path, "wb") as file_graph:
+            np.savez(file_graph, coordinates=self._coordinates, sources=self._edges[0], targets=self._edges[1],
+                     weights=self._edges[2], directed=self._directed)
+
+    def get_nearest_nodes(self, coordinates, rows_at_once=64):
+        """ Snaps coordinates to the nearest nodes of the graph by straight line distance.
+
+        :param coordinates:     ndarray of shape (n, 2) of latitudes and longitudes in degrees
+        :param rows_at_once:    number of coordinates, whose distances to all nodes are calculated at once
+        :return:                ndarray of indices of nodes
+        """
+        nodes = np.zeros(len(coordinates), dtype=np.int64)
+        for start in range(0, len(coordinates), rows_at_once):
+            distances = u.haversine(coordinates[start:start + rows_at_once, None, :], self._coordinates[None, :, :])
+            nodes[start:start + rows_at_once] = np.argmin(distances, axis=1)
+
+        return nodes
+
+    def get_shortest_path_lengths(self, source_nodes, target_nodes, processes=None):
+        """ Runs one single source Dijkstra per source node, in parallel processes, each stopping as soon as all target
+            nodes are reached.
+
+        :param source_nodes:    ndarray of indices of nodes
+        :param target_nodes:    ndarray of indices of nodes
+        :param processes:       integer, number of worker processes. None for the number of processors, 1 for running
+                                in this process
+        :return:                ndarray of shape (sources, targets), inf for unreachable targets
+        """
+        graph = (self._indptr.tolist(), self._indices.tolist(), self._weights.tolist(),
+                 np.asarray(target_nodes).tolist())
+        source_nodes = np.asarray(source_nodes).tolist()
+
+        if processes == 1 or len(source_nodes) < 2:
+            return np.array([u.run_dijkstra(*graph, source) for source in source_nodes]).reshape(len(source_nodes), -1)
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes, initializer=u.set_worker_road_graph,
+                                                    initargs=graph) as executor:
+            chunksize = max(1, len(source_nodes) // (4 * (processes or os.cpu_count() or 1)))
+            rows = list(executor.map(u.run_worker_dijkstra, source_nodes, chunksize=chunksize))
+
+        return np.array(rows).reshape(len(source_nodes), -1)
+
+
+class RoadGraphDistanceProvider(DistanceProvider):
+
+    def __init__(self, graph, coordinates=None, gmaps=None, processes=None):
+        """ Provides travel times (or whatever the weights of the graph are) on a local road network, without any
+            request to the Distance Matrix API. Every street is snapped to its nearest node, and one single source
+            Dijkstra per street fills a whole row of the distance matrix. Like the fill via Google, the distance from
+            the later to the earlier street of each pair is used for both directions.
+
+        :param graph:       instance of RoadGraph or string of path of a graph saved by RoadGraph.save
+        :param coordinates: dictionary of street to its coordinates (latitude, longitude). Streets missing in it are
+                            geocoded with gmaps
+        :param gmaps:       instance of GoogleMapsClient used for geocoding. None, if all coordinates are given
+        :param processes:   integer, number of processes running Dijkstra's algorithm. None for the number of
+                            processors
+        """
+        self._graph = (RoadGraph.load(graph) if isinstance(graph, str) else graph)
+        self._coordinates = (coordinates if coordinates is not None else dict())
+        self._gmaps = gmaps
+        self._processes = processes
+
+    def get_distance_matrix(self, list_of_streets):
+        nodes = self._graph.get_nearest_nodes(u.get_coordinates(list_of_streets, self._coordinates, self._gmaps))
+
+        # Streets snapped to the same node need only one run of Dijkstra's algorithm
+        unique_nodes, inverse = np.unique(nodes, return_inverse=True)
+        lengths = self._graph.get_shortest_path_lengths(unique_nodes, unique_nodes, self._processes)
+        assert(np.all(np.isfinite(lengths))), "Some streets cannot be reached from each other in the road graph."
+
+        distance_matrix = np.tril(lengths[np.ix_(inverse, inverse)])
+        return u.symmetrise(distance_matrix)
+
+
 class Address:
 
     def __init__(self, iid, street_name, cluster=None):
@@ -144,6 +674,37 @@ class Cluster:
     def get_member(self):
         return self._members
 
+    def set_member(self, members):
+        """ Replaces all members of this cluster at once and sets this cluster as their cluster. Unlike add_member, the
+            old clusters of the addresses are not updated.
+
+        :param members: list of addresses, elements are of type Address
+        """
+        self._members = list(members)
+        for address in self._members:
+            address.set_cluster(self)
+
+    @staticmethod
+    def from_labels(data, labels, medoids, detached=False):
+        """ Creates the clusters described by the arrays of u.assign_labels and u.update_medoids.
+
+        :param data:        list of addresses, elements are of type Address
+        :param labels:      ndarray of labels, entry i is the number of the cluster data[i] belongs to
+        :param medoids:     ndarray of indices of the medoids, one per cluster
+        :param detached:    True, if the clusters should consist of copies of the addresses, such that the clusters the
+                            addresses of data belong to stay untouched
+        :return:            list of clusters, elements are of type Cluster
+        """
+        if detached:
+            data = [copy.copy(address) for address in data]
+
+        list_clusters = list()
+        for cluster, medoid in enumerate(medoids):
+            list_clusters.append(Cluster(center=data[medoid]))
+            list_clusters[-1].set_member([data[i] for i in np.flatnonzero(labels == cluster)])
+
+        return list_clusters
+
     def add_member(self, address):
         """ This function adds a new address to this cluster. Simultaneously, it deletes the passed address in its old
             cluster. Thus, we secure, that each address has only one single cluster.
@@ -160,10 +721,11 @@ class Cluster:
 
         :param address: type Address, which is going to be deleted
         """
-        if str(address) in [str(ad) for ad in self._members]:
-            self._members.remove(address)
-        # Possible problems: Same address twice!
-        # TODO: Deal with duplicate addresses!
+        # Addresses are compared by identity, as two different addresses may share the same street name
+        for i, member in enumerate(self._members):
+            if member is address:
+                del self._members[i]
+                break
 
     def set_minimising_center(self, distance_matrix):
         """ This function gets the medoid of this cluster and sets it as the new center
@@ -186,5 +748,61 @@ class Cluster:
 
         :param gmaps:   instance of GoogleMapsClient being able to use the Geolocation API
         """
-        for street in self._members:
-            street.set_geo_location( gmaps.address_to_coordinates(street.get_street_name()) )
+        coordinates = gmaps.addresses_to_coordinates([street.get_street_name() for street in self._members])
+
+        for street, street_coordinates in zip(self._members, coordinates):
+            street.set_geo_location(street_coordinates)
+
+
+class ClusteringHistory:
+
+    def __init__(self, data, k, capacity=16):
+        """ Records the state of the clustering after every time step as compact arrays: the label of every address as
+            int32, the indices of the medoids and the total cost. Instances of Cluster are only created when a time step
+            is accessed, e.g. by GoogleMapsClient.plot_history, which treats this like the former history dictionary.
+
+        :param data:        list of addresses, elements are of type Address
+        :param k:           number of clusters
+        :param capacity:    number of time steps the buffers are allocated for, they grow if needed
+        """
+        self._data = data
+        self._length = 0
+        self._labels = np.empty((capacity, len(data)), dtype=np.int32)
+        self._medoids = np.empty((capacity, k), dtype=np.int32)
+        self._costs = np.empty(capacity, dtype=np.float64)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, time_step):
+        if not 0 <= time_step < self._length:
+            raise IndexError("time step {} has not been recorded".format(time_step))
+
+        # Looking at a past time step must not move the addresses of the current clustering
+        return Cluster.from_labels(self._data, self._labels[time_step], self._medoids[time_step], detached=True)
+
+    def record(self, labels, medoids, cost):
+        """ Appends the state of the next time step.
+
+        :param labels:  ndarray of labels, entry i is the number of the cluster address i belongs to
+        :param medoids: ndarray of indices of the medoids, one per cluster
+        :param cost:    total cost of this state
+        """
+        if self._length == len(self._costs):
+            self._labels = np.concatenate((self._labels, np.empty_like(self._labels)))
+            self._medoids = np.concatenate((self._medoids, np.empty_like(self._medoids)))
+            self._costs = np.concatenate((self._costs, np.empty_like(self._costs)))
+
+        self._labels[self._length] = labels
+        self._medoids[self._length] = medoids
+        self._costs[self._length] = cost
+        self._length += 1
+
+    def get_labels(self, time_step):
+        return self._labels[time_step]
+
+    def get_medoids(self, time_step):
+        return self._medoids[time_step]
+
+    def get_cost(self, time_step):
+        return self._costs[time_step]
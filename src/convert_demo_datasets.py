@@ -0,0 +1,12 @@
+import util as u
+
+
+DEMO_DATASETS = ["munich_30", "munich_70", "munich_100", "munich_150"]
+
+
+if __name__ == "__main__":
+
+    # Converts the pickled demo datasets into memory mappable .npy files with a JSON sidecar, see u.save_dataset
+    for name in DEMO_DATASETS:
+        u.convert_pickled_dataset("../demo/{}".format(name), name)
+        print("Converted dataset {}".format(name))
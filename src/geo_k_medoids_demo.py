@@ -1,13 +1,12 @@
 import sys
-import copy as copy
 import numpy as np
-import pickle as p
 
 import Classes as c
 import util as u
 
 
-def geo_k_medoids_demo(k, api_key="", list_of_streets="", demo="", plot=True):
+def geo_k_medoids_demo(k, api_key="", list_of_streets="", demo="", plot=True, block_fill=False, cache=None, workers=1,
+                       queries_per_second=None, geocode_cache=None, provider=None):
     """ This is the visual demonstration for the geo_k_medoids function in the geo_k_medoids.py module. This function
         follows the exact same algorithm, namely the one described by Hae-Sang Park and Chi-Hyuck Jun, 2009,
         A simple and fast algorithm for K-medoids clustering, in Expert Syst. Appl. 36. 3336-3341.
@@ -38,6 +37,17 @@ def geo_k_medoids_demo(k, api_key="", list_of_streets="", demo="", plot=True):
     :param plot:            True, if links to Google's Static Map API should be generated.
                             Attention! If True, costs will incure for converting street names to GPS coordinates and
                             if you click on the generated links for using Static Maps API!
+    :param block_fill:      True, if the distance matrix should be filled with one request per block of streets instead
+                            of one request per pair of streets. Same result, but far less requests.
+    :param cache:           instance of c.DistanceCache. Only pairs of streets not found in the cache are requested,
+                            so repeated runs with mostly the same streets become cheap
+    :param workers:         number of requests in flight while filling the distance matrix. If larger than one,
+                            transient errors are retried with exponential backoff
+    :param queries_per_second: quota of the Distance Matrix API, which is not going to be exceeded. None for no limit
+    :param geocode_cache:   instance of c.GeocodeCache. Only addresses not found in the cache are geocoded for the plots
+    :param provider:        instance of c.DistanceProvider, e.g. c.StraightLineDistanceProvider or
+                            c.RoadGraphDistanceProvider, which provides the distance matrix of list_of_streets instead of
+                            Google's Distance Matrix API. No API key is needed then, except for the plots
     """
 
     # Initialisation
@@ -45,29 +55,35 @@ def geo_k_medoids_demo(k, api_key="", list_of_streets="", demo="", plot=True):
     init = c.Cluster(center=init_street)
 
     if api_key:
-        gmaps = c.GoogleMapsClient(api_key)
+        gmaps = c.GoogleMapsClient(api_key, cache=cache, geocode_cache=geocode_cache)
+
+    metadata = dict()
 
     if demo:
         print("Starting demo version, dataset {} selected".format(demo))
 
-        # Loading demo files
+        # Loading demo files, STEP 1-1
         try:
-            file_street_list = open("../demo/{}/{}_street_list.obj".format(demo, demo), "rb")
-            list_of_streets = p.load(file_street_list)
-            file_street_list.close()
-
-            # STEP 1-1
-            file_distance_matrix = open("../demo/{}/{}_distance_matrix.obj".format(demo, demo), "rb")
-            distance_matrix = p.load(file_distance_matrix)
-            file_distance_matrix.close()
+            list_of_streets, distance_matrix, metadata = u.load_dataset("../demo/{}".format(demo), demo)
 
         except FileNotFoundError:
-            sys.exit("No files found in demo/{} directory.".format(demo))
+            sys.exit("No dataset found in demo/{} directory. Old pickled datasets can be converted by running "
+                     "convert_demo_datasets.py.".format(demo))
+
+        data = list()
+        for i, street in enumerate(list_of_streets):
+            data.append(c.Address(iid=i, street_name=street, cluster=init))
+
+    elif provider is not None:
+        assert (list_of_streets != ""), "No list of streets given, try demo version."
 
         data = list()
         for i, street in enumerate(list_of_streets):
             data.append(c.Address(iid=i, street_name=street, cluster=init))
 
+        # STEP 1-1, without any request to the Distance Matrix API
+        distance_matrix = provider.get_distance_matrix(list_of_streets)
+
     else:
         # No demonstration! Actual usage of algorithm
 
@@ -84,55 +100,90 @@ def geo_k_medoids_demo(k, api_key="", list_of_streets="", demo="", plot=True):
         amounts_request = int(0.5 * len(data) * (len(data) + 1) - len(data))
         u.wait_user_assertion(amounts_request)
 
-        for column in range(len(data)):
-            for row in range(column):
-                distance_matrix[column, row] = gmaps.distance_between_streets(street_one=data[column].get_street_name(),
-                                                                              street_two=data[row].get_street_name())
+        if workers > 1:
+            limiter = (c.TokenBucket(queries_per_second) if queries_per_second else None)
+            u.fill_distance_matrix_concurrent(gmaps, data, distance_matrix, limiter=limiter, block_fill=block_fill,
+                                              workers=workers)
+        elif block_fill:
+            u.fill_distance_matrix_blocks(gmaps, data, distance_matrix)
+        else:
+            for column in range(len(data)):
+                for row in range(column):
+                    distance_matrix[column, row] = gmaps.distance_between_streets(
+                        street_one=data[column].get_street_name(), street_two=data[row].get_street_name())
 
         distance_matrix = u.symmetrise(distance_matrix)
 
+        if cache is not None:
+            print("Distance cache: {}".format(cache.get_statistics()))
+
     # STEP 1-2
-    for i in range(len(data)):
-        data[i].set_v(u.calculate_v(i, distance_matrix))
+    v_list = u.calculate_v_vector(distance_matrix)
 
-    v_list = np.array([data[i].get_v() for i in range(len(data))])
+    for i in range(len(data)):
+        data[i].set_v(v_list[i])
 
     # STEP 1-3
     indices_initial_mediods = v_list.argsort()[:k]
 
-    list_clusters = list()
-    for index in indices_initial_mediods:
-        list_clusters.append(c.Cluster(center=data[index]))
+    medoids = np.array(indices_initial_mediods)
 
     # STEP 1-4
-    u.assign_street_cluster(streets=data, list_clusters=list_clusters, distance_matrix=distance_matrix)
+    labels = u.assign_labels(distance_matrix, medoids)
 
     # STEP 1-5
-    cost = u.calculate_cost(data, distance_matrix)
+    point_costs = u.get_point_costs(distance_matrix, np.arange(len(data)), medoids[labels])
+    cost = point_costs.sum()
 
     # STEP 2
-    n = 0
-    history_dict = dict()
+    history = c.ClusteringHistory(data, k)
 
-    if api_key:
-        # Since Google Maps' Static Map API allows only a maximum of fifteen human readable addresses, all addresses
-        # need to be converted to GPS coordinates, again using Google's API and spending even more money...
-        for cluster in list_clusters:
-            cluster.set_geo_location_for_members(gmaps)
+    # Since Google Maps' Static Map API allows only a maximum of fifteen human readable addresses, all addresses
+    # need to be converted to GPS coordinates. Datasets store them after the first run, otherwise Google's API is used
+    # again, spending even more money...
+    if "coordinates" in metadata:
+        for street, coordinates in zip(data, metadata["coordinates"]):
+            street.set_geo_location(coordinates)
 
-    while True:
-        history_dict[n] = copy.deepcopy(list_clusters)
+    elif api_key and plot:
+        list_coordinates = gmaps.addresses_to_coordinates([street.get_street_name() for street in data])
+        for street, coordinates in zip(data, list_coordinates):
+            street.set_geo_location(coordinates)
 
-        for cluster in list_clusters:
-            cluster.set_minimising_center(distance_matrix)
+        if demo:
+            u.save_coordinates("../demo/{}".format(demo), demo, list_coordinates)
 
-        u.assign_street_cluster(streets=data, list_clusters=list_clusters, distance_matrix=distance_matrix)
-        n += 1
+    # Only clusters which gained or lost members need a new medoid, and the cost changes only for the points whose
+    # medoid moved or who moved to another cluster
+    dirty = np.ones(k, dtype=bool)
 
-        if u.calculate_cost(data, distance_matrix) >= cost:
+    while True:
+        history.record(labels, medoids, cost)
+
+        new_medoids = u.update_medoids(distance_matrix, labels, medoids, clusters=np.flatnonzero(dirty))
+        members = np.flatnonzero(np.isin(labels, np.flatnonzero(new_medoids != medoids)))
+        medoids = new_medoids
+        new_point_costs = u.get_point_costs(distance_matrix, members, medoids[labels[members]])
+        new_cost = cost + (new_point_costs - point_costs[members]).sum()
+        point_costs[members] = new_point_costs
+
+        new_labels = u.assign_labels(distance_matrix, medoids)
+        moved = np.flatnonzero(new_labels != labels)
+        new_point_costs = u.get_point_costs(distance_matrix, moved, medoids[new_labels[moved]])
+        new_cost += (new_point_costs - point_costs[moved]).sum()
+        point_costs[moved] = new_point_costs
+
+        dirty[:] = False
+        dirty[labels[moved]] = True
+        dirty[new_labels[moved]] = True
+        labels = new_labels
+
+        if new_cost >= cost:
             break
 
-        cost = u.calculate_cost(data, distance_matrix)
+        cost = new_cost
+
+    list_clusters = c.Cluster.from_labels(data, labels, medoids)
 
     # Printing reslults
     print("\nResults!")
@@ -143,9 +194,9 @@ def geo_k_medoids_demo(k, api_key="", list_of_streets="", demo="", plot=True):
     if api_key and plot:
 
         print("Printing links to plots")
-        print("Step 0: {}".format(gmaps.plot_streets_without_label(history_dict)))
+        print("Step 0: {}".format(gmaps.plot_streets_without_label(history)))
 
-        list_urls = gmaps.plot_history(history_dict)
+        list_urls = gmaps.plot_history(history)
 
         for i, entry in enumerate(list_urls):
             print("Step {}: {}".format(i+1, entry))
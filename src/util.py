@@ -1,7 +1,38 @@
+import os
 import sys
+import json
+import math
+import time
+import heapq
+import random
+import pickle
+import concurrent.futures
+import googlemaps
 import numpy as np
 
 
+# Limits of a single request to Google's Distance Matrix API
+MAX_ORIGINS = 25
+MAX_DESTINATIONS = 25
+MAX_ELEMENTS = 100
+
+# Price of one element (pair of streets) of the Distance Matrix API in EUR
+COST_PER_ELEMENT = 0.005
+
+# Mean radius of the earth in meters, used for straight line distances between coordinates
+EARTH_RADIUS = 6371000
+
+
+def normalise_street_name(street_name):
+    """ Normalises a street name for comparisons, such that upper and lower case as well as surplus white spaces do not
+        matter.
+
+    :param street_name: string of street name
+    :return:            string of normalised street name
+    """
+    return " ".join(street_name.lower().split())
+
+
 def sum_over_columns(matrix, row):
     result = 0
     for i in range(len(matrix)):
@@ -25,10 +56,262 @@ def calculate_v(index, matrix):
     return result
 
 
+def calculate_v_vector(matrix, chunk_size=None):
+    """ Vectorised version of calculate_v, returning v for all indices at once. The row sums are calculated only once,
+        thus it needs O(n^2) instead of O(n^3) operations. The rows are added in the same order as in calculate_v, so
+        the results are identical.
+
+    :param matrix:      ndarray distance matrix
+    :param chunk_size:  number of rows divided by their row sum at once. Limits the temporary memory to chunk_size x n
+                        floats. None for choosing it automatically, such that at most about 256 MB are used
+    :return:            ndarray of v for every index
+    """
+    n = len(matrix)
+    if chunk_size is None:
+        chunk_size = max(1, 2 ** 25 // max(n, 1))
+    chunk_size = min(chunk_size, n)
+
+    row_sums = matrix.sum(axis=1)
+    result = np.zeros(n)
+
+    # The first row of the buffer carries the result of the previous chunks, such that the summation order is kept
+    buffer = np.empty((chunk_size + 1, n))
+    for start in range(0, n, chunk_size):
+        end = min(start + chunk_size, n)
+        buffer[0] = result
+        np.divide(matrix[start:end], row_sums[start:end, None], out=buffer[1:end - start + 1])
+        result = buffer[:end - start + 1].sum(axis=0)
+
+    return result
+
+
 def symmetrise(matrix):
     return matrix + matrix.T - np.diag(matrix.diagonal())
 
 
+def get_lower_triangle_tiles(n, max_elements=MAX_ELEMENTS, max_origins=MAX_ORIGINS, max_destinations=MAX_DESTINATIONS):
+    """ Splits the strictly lower triangle of a n x n matrix into blocks of origins and destinations, such that each
+        block fits into one single Distance Matrix API request. Every entry [i, j] with i > j is covered exactly once,
+        and no other entry is covered, so no element is paid for more than with one request per pair.
+
+    :param n:                   integer, size of the distance matrix
+    :param max_elements:        maximal number of origins times destinations in one request
+    :param max_origins:         maximal number of origins in one request
+    :param max_destinations:    maximal number of destinations in one request
+    :return:                    list of tuples (origin_indices, destination_indices), both of type range
+    """
+    size = min(math.isqrt(max_elements), max_origins, max_destinations)
+    tiles = list()
+
+    for row_start in range(0, n, size):
+        row_end = min(row_start + size, n)
+        for column_start in range(0, row_start, size):
+            tiles.append((range(row_start, row_end), range(column_start, column_start + size)))
+
+        # block on the diagonal, split such that neither the diagonal nor the mirrored pairs are requested (and billed)
+        tiles.extend(get_triangle_tiles(row_start, row_end))
+
+    return tiles
+
+
+def get_triangle_tiles(start, end):
+    """ Splits the pairs [i, j] with start <= j < i < end into rectangular blocks covering each pair exactly once. The
+        triangle is halved recursively into the block of its lower half times its upper half and two smaller triangles.
+
+    :param start:   integer, first index of the triangle
+    :param end:     integer, index after the last one of the triangle
+    :return:        list of tuples (origin_indices, destination_indices), both of type range
+    """
+    if end - start < 2:
+        return list()
+
+    middle = (start + end) // 2
+    return [(range(middle, end), range(start, middle))] + get_triangle_tiles(start, middle) \
+        + get_triangle_tiles(middle, end)
+
+
+def fill_distance_matrix_blocks(gmaps, data, distance_matrix):
+    """ Fills the lower triangle of the distance matrix with one Distance Matrix API request per block of streets,
+        instead of one request per pair of streets. The entries are the same, only the number of requests shrinks.
+
+    :param gmaps:           instance of GoogleMapsClient
+    :param data:            list of addresses, elements are of type Address
+    :param distance_matrix: ndarray, whose lower triangle is going to be filled
+    """
+    for origin_indices, destination_indices in get_lower_triangle_tiles(len(data)):
+        block = gmaps.distances_between_streets(origins=[data[i].get_street_name() for i in origin_indices],
+                                                destinations=[data[j].get_street_name() for j in destination_indices])
+        for row, i in zip(block, origin_indices):
+            for value, j in zip(row, destination_indices):
+                if i > j:
+                    distance_matrix[i, j] = value
+
+
+def is_transient_error(error):
+    """ Decides, whether a failed request to Google's APIs is worth retrying, e.g. time outs, server errors or an
+        exceeded query limit. Errors like an invalid API key or an unknown address are not transient.
+
+    :param error:   exception raised by the googlemaps library
+    :return:        True, if the request may succeed when sent again
+    """
+    if isinstance(error, googlemaps.exceptions.HTTPError):
+        return error.status_code == 429 or error.status_code >= 500
+    if isinstance(error, (googlemaps.exceptions.Timeout, googlemaps.exceptions.TransportError)):
+        return True
+    return isinstance(error, googlemaps.exceptions.ApiError) and error.status in ("OVER_QUERY_LIMIT", "UNKNOWN_ERROR")
+
+
+def request_with_retry(request, limiter=None, max_retries=5, backoff=0.5):
+    """ Calls request, waiting for the rate limiter before each attempt. Transient errors are retried with exponentially
+        growing and randomly jittered waiting times, all other errors are raised immediately.
+
+    :param request:     function without arguments sending the actual request
+    :param limiter:     instance of TokenBucket or None for no rate limit
+    :param max_retries: integer, number of retries before the error is raised
+    :param backoff:     waiting time in seconds before the first retry, it doubles with each retry
+    :return:            return value of request
+    """
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return request()
+        except Exception as error:
+            if attempt == max_retries or not is_transient_error(error):
+                raise
+            time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def fill_distance_matrix_concurrent(gmaps, data, distance_matrix, limiter=None, block_fill=False, workers=8,
+                                    max_retries=5, backoff=0.5):
+    """ Fills the lower triangle of the distance matrix with several requests in flight at the same time. The results
+        are written directly into distance_matrix. Without block_fill, each worker fills a whole column of the lower
+        triangle with one request per pair, with block_fill each worker requests one block at a time.
+
+    :param gmaps:           instance of GoogleMapsClient
+    :param data:            list of addresses, elements are of type Address
+    :param distance_matrix: ndarray, whose lower triangle is going to be filled
+    :param limiter:         instance of TokenBucket, which keeps the requests within the quota of the API
+    :param block_fill:      True, if one request should contain a whole block of pairs
+    :param workers:         integer, maximal number of requests in flight
+    :param max_retries:     integer, number of retries of a request failing with a transient error
+    :param backoff:         waiting time in seconds before the first retry, it doubles with each retry
+    """
+    def fill_block(origin_indices, destination_indices):
+        origins = [data[i].get_street_name() for i in origin_indices]
+        destinations = [data[j].get_street_name() for j in destination_indices]
+        block = request_with_retry(lambda: gmaps.distances_between_streets(origins, destinations),
+                                   limiter, max_retries, backoff)
+        for row, i in zip(block, origin_indices):
+            for value, j in zip(row, destination_indices):
+                if i > j:
+                    distance_matrix[i, j] = value
+
+    def fill_column(column):
+        for row in range(column):
+            distance_matrix[column, row] = request_with_retry(
+                lambda: gmaps.distance_between_streets(street_one=data[column].get_street_name(),
+                                                       street_two=data[row].get_street_name()),
+                limiter, max_retries, backoff)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    if block_fill:
+        futures = [executor.submit(fill_block, *tile) for tile in get_lower_triangle_tiles(len(data))]
+    else:
+        futures = [executor.submit(fill_column, column) for column in range(1, len(data))]
+
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+    finally:
+        # In case of an error, pending requests are dropped instead of being paid for
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def haversine(coordinates_one, coordinates_two):
+    """ Straight line distance along the surface of the earth in meters. Works on ndarrays of coordinates, whose last
+        axis holds latitude and longitude in degrees, and broadcasts like numpy.
+
+    :param coordinates_one: ndarray of shape (..., 2)
+    :param coordinates_two: ndarray of shape (..., 2)
+    :return:                ndarray of distances in meters
+    """
+    latitude_one, longitude_one = np.radians(coordinates_one[..., 0]), np.radians(coordinates_one[..., 1])
+    latitude_two, longitude_two = np.radians(coordinates_two[..., 0]), np.radians(coordinates_two[..., 1])
+
+    a = np.sin((latitude_two - latitude_one) / 2) ** 2 \
+        + np.cos(latitude_one) * np.cos(latitude_two) * np.sin((longitude_two - longitude_one) / 2) ** 2
+
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def get_coordinates(list_of_streets, coordinates, gmaps=None):
+    """ Looks up the coordinates of streets, geocoding the ones missing in coordinates.
+
+    :param list_of_streets: list of strings of streets
+    :param coordinates:     dictionary of street to its coordinates
+    :param gmaps:           instance of GoogleMapsClient, only needed if a street is missing in coordinates
+    :return:                ndarray of shape (n, 2)
+    """
+    missing = [street for street in list_of_streets if street not in coordinates]
+    if missing:
+        assert(gmaps is not None), "No coordinates of {} and no GoogleMapsClient for geocoding them.".format(missing[0])
+        coordinates = dict(coordinates)
+        coordinates.update((street, tuple(float(value) for value in location.split(",")))
+                           for street, location in zip(missing, gmaps.addresses_to_coordinates(missing)))
+
+    return np.array([coordinates[street] for street in list_of_streets], dtype=float).reshape(-1, 2)
+
+
+# Road graph of a worker process of Classes.RoadGraph.get_shortest_path_lengths, see set_worker_road_graph
+worker_road_graph = None
+
+
+def set_worker_road_graph(indptr, indices, weights, target_nodes):
+    """ Initialiser of the worker processes of Classes.RoadGraph.get_shortest_path_lengths. The graph is sent to every
+        process once instead of once per source node.
+    """
+    global worker_road_graph
+    worker_road_graph = (indptr, indices, weights, target_nodes)
+
+
+def run_worker_dijkstra(source):
+    return run_dijkstra(*worker_road_graph, source)
+
+
+def run_dijkstra(indptr, indices, weights, target_nodes, source):
+    """ Single source Dijkstra on a graph in compressed sparse row format (see Classes.RoadGraph), stopping as soon as
+        all target nodes are settled. Works on lists, which are faster than ndarrays for single element accesses.
+
+    :param indptr:          list, the edges leaving node i are edges indptr[i] till indptr[i + 1]
+    :param indices:         list of the nodes the edges end at
+    :param weights:         list of the weights of the edges
+    :param target_nodes:    list of indices of nodes, whose distance from the source is asked for
+    :param source:          index of node the shortest paths start at
+    :return:                list of lengths of the shortest paths to the target nodes, inf for unreachable ones
+    """
+    distances = {source: 0.0}
+    settled = set()
+    remaining = set(target_nodes)
+    heap = [(0.0, source)]
+
+    while heap and remaining:
+        distance, node = heapq.heappop(heap)
+        if node in settled:
+            continue
+        settled.add(node)
+        remaining.discard(node)
+
+        for edge in range(indptr[node], indptr[node + 1]):
+            neighbour = indices[edge]
+            new_distance = distance + weights[edge]
+            if new_distance < distances.get(neighbour, math.inf):
+                distances[neighbour] = new_distance
+                heapq.heappush(heap, (new_distance, neighbour))
+
+    return [(distances[node] if node in settled else math.inf) for node in target_nodes]
+
+
 def get_nearest_center(street, list_clusters, distance_matrix):
     """ Takes an address and returns the cluster it has the smallest distance to.
 
@@ -72,6 +355,71 @@ def calculate_cost(data, distance_matrix):
     return cost
 
 
+def assign_labels(distance_matrix, medoids):
+    """ Array version of assign_street_cluster. Assigns every point to its nearest medoid. Ties are broken in favour of
+        the medoid coming first, just like in get_nearest_center.
+
+    :param distance_matrix: distance matrix coding the distance from each point to each point
+    :param medoids:         ndarray of indices of the medoids, one per cluster
+    :return:                ndarray of labels, entry i is the number of the cluster point i belongs to
+    """
+    return np.argmin(distance_matrix[:, medoids], axis=1)
+
+
+def calculate_cost_labels(distance_matrix, labels, medoids):
+    """ Array version of calculate_cost.
+
+    :param distance_matrix: distance matrix coding the distance from each point to each point
+    :param labels:          ndarray of labels, entry i is the number of the cluster point i belongs to
+    :param medoids:         ndarray of indices of the medoids, one per cluster
+    :return:                sum of all distances from each point to the medoid of its cluster
+    """
+    return distance_matrix[np.arange(len(labels)), medoids[labels]].sum()
+
+
+def get_point_costs(distance_matrix, points, medoids_of_points):
+    """ Distances of points to their medoids, as signed integers for integer distance matrices, such that differences
+        of them do not overflow.
+
+    :param distance_matrix:     distance matrix coding the distance from each point to each point
+    :param points:              ndarray of indices of points
+    :param medoids_of_points:   ndarray of indices of the medoid of each point
+    :return:                    ndarray of the cost of each point
+    """
+    distances = np.asarray(distance_matrix[points, medoids_of_points])
+    return distances.astype(np.int64 if np.issubdtype(distances.dtype, np.integer) else float)
+
+
+def update_medoids(distance_matrix, labels, medoids, block_elements=2 ** 24, clusters=None):
+    """ Array version of Cluster.set_minimising_center for all clusters. The new medoid of a cluster is the member with
+        the smallest sum of distances to all other members, ties are broken in favour of the smaller index. Clusters
+        without members keep their medoid.
+
+    :param distance_matrix: distance matrix coding the distance from each point to each point
+    :param labels:          ndarray of labels, entry i is the number of the cluster point i belongs to
+    :param medoids:         ndarray of indices of the medoids, one per cluster
+    :param block_elements:  maximal number of entries of the distance matrix gathered at once
+    :param clusters:        iterable of the numbers of the clusters to be updated, all others keep their medoid. None
+                            for all clusters
+    :return:                ndarray of indices of the new medoids
+    """
+    new_medoids = medoids.copy()
+
+    for cluster in (range(len(medoids)) if clusters is None else clusters):
+        members = np.flatnonzero(labels == cluster)
+        if len(members) == 0:
+            continue
+
+        costs = np.zeros(len(members))
+        step = max(1, block_elements // len(members))
+        for start in range(0, len(members), step):
+            costs += distance_matrix[np.ix_(members[start:start + step], members)].sum(axis=0)
+
+        new_medoids[cluster] = members[np.argmin(costs)]
+
+    return new_medoids
+
+
 def clean_street_name(string_street_name):
     string_street_name = string_street_name.replace("ä", "ae")
     string_street_name = string_street_name.replace("ö", "oe")
@@ -130,7 +478,7 @@ def wait_user_assertion(amount_expected_requests):
     print("WARNING!\tYou are going to perform {} requests to Google Maps' Distance Matrix API."
           .format(amount_expected_requests))
     print("\t\t\tThe account belonging to this API key will be charged with approximately {}€, if you choose to continue."
-        .format(round(0.005 * amount_expected_requests, 2)))
+        .format(round(COST_PER_ELEMENT * amount_expected_requests, 2)))
     print("\nDo you wish to continue?")
     user = input("Enter yes or no: ")
     if user == "yes" or user == "y":
@@ -152,4 +500,86 @@ def list_of_colors(number_colors_needed):
             colors.append(str(hex(color)))
 
     return colors
-		
\ No newline at end of file
+
+
+def save_dataset(directory, name, list_of_streets, distance_matrix, metadata=None):
+    """ Saves a dataset as <name>_distance_matrix.npy, which can be memory mapped, and a small JSON sidecar
+        <name>_dataset.json containing the list of streets and further metadata. Neither file needs pickle for loading.
+
+    :param directory:       string of directory the files are saved in
+    :param name:            string of name of dataset, e.g. "munich_30"
+    :param list_of_streets: list containing strings of street names, entry i belongs to row i of the distance matrix
+    :param distance_matrix: ndarray of shape (n, n)
+    :param metadata:        dictionary of further information, e.g. metric or means of travel
+    """
+    assert(distance_matrix.shape == (len(list_of_streets), len(list_of_streets))), \
+        "Distance matrix does not fit the list of streets."
+
+    matrix_file = "{}_distance_matrix.npy".format(name)
+    np.save(os.path.join(directory, matrix_file), np.asarray(distance_matrix))
+
+    sidecar = {"name": name,
+               "matrix_file": matrix_file,
+               "n": len(list_of_streets),
+               "dtype": str(distance_matrix.dtype),
+               "streets": list(list_of_streets)}
+    sidecar.update(metadata or dict())
+
+    with open(os.path.join(directory, "{}_dataset.json".format(name)), "w", encoding="utf-8") as file_sidecar:
+        json.dump(sidecar, file_sidecar, ensure_ascii=False, indent=1)
+
+
+def load_dataset(directory, name):
+    """ Opens a dataset saved by save_dataset. The distance matrix is memory mapped read only, so opening is nearly
+        instant and only the pages actually used are read from disk. Several processes share the same pages.
+
+    :param directory:   string of directory the files are saved in
+    :param name:        string of name of dataset, e.g. "munich_30"
+    :return:            tuple of list of streets, memory mapped distance matrix and dictionary of the sidecar
+    """
+    with open(os.path.join(directory, "{}_dataset.json".format(name)), encoding="utf-8") as file_sidecar:
+        sidecar = json.load(file_sidecar)
+
+    distance_matrix = np.load(os.path.join(directory, sidecar["matrix_file"]), mmap_mode="r")
+    assert(distance_matrix.shape == (sidecar["n"], sidecar["n"])), "Distance matrix does not fit the list of streets."
+
+    return sidecar["streets"], distance_matrix, sidecar
+
+
+def save_coordinates(directory, name, coordinates):
+    """ Adds the coordinates of the streets to the JSON sidecar of a dataset saved by save_dataset, so plotting the
+        dataset needs no Geocoding API requests anymore.
+
+    :param directory:   string of directory the dataset is saved in
+    :param name:        string of name of dataset, e.g. "munich_30"
+    :param coordinates: list of strings of latitude and longitude, one for each street of the dataset
+    """
+    path = os.path.join(directory, "{}_dataset.json".format(name))
+    with open(path, encoding="utf-8") as file_sidecar:
+        sidecar = json.load(file_sidecar)
+
+    assert(len(coordinates) == sidecar["n"]), "Number of coordinates does not fit the dataset."
+    sidecar["coordinates"] = list(coordinates)
+
+    with open(path, "w", encoding="utf-8") as file_sidecar:
+        json.dump(sidecar, file_sidecar, ensure_ascii=False, indent=1)
+
+
+def convert_pickled_dataset(directory, name, dtype=None):
+    """ Converts a dataset of the old format, <name>_street_list.obj and <name>_distance_matrix.obj saved with pickle,
+        into the format of save_dataset. Only convert files from trusted sources, since unpickling can execute code.
+
+    :param directory:   string of directory containing the pickled files
+    :param name:        string of name of dataset, e.g. "munich_30"
+    :param dtype:       numpy dtype of the converted distance matrix, None for keeping the dtype
+    """
+    with open(os.path.join(directory, "{}_street_list.obj".format(name)), "rb") as file_street_list:
+        list_of_streets = pickle.load(file_street_list)
+
+    with open(os.path.join(directory, "{}_distance_matrix.obj".format(name)), "rb") as file_distance_matrix:
+        distance_matrix = pickle.load(file_distance_matrix)
+
+    if dtype is not None:
+        distance_matrix = distance_matrix.astype(dtype)
+
+    save_dataset(directory, name, list_of_streets, distance_matrix, metadata={"metric": "time", "mode": "driving"})